@@ -1,15 +1,38 @@
 import os
 import re
+import copy
 import json
+import zlib
+import gzip
+import mmap
+import math
+import time
+import hashlib
+import sqlite3
+import shutil
+import tempfile
+import threading
 import yaml
 import chardet
+import codecs
 from pathlib import Path
-from typing import List, Dict, Optional
+from contextlib import ExitStack
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, List, Dict, Optional
+import numpy as np
 import pandas as pd
 from datetime import datetime
 import uuid
 import streamlit as st
 
+# Быстрая замена chardet с тем же интерфейсом detect(), если установлена
+try:
+    import cchardet as fast_chardet
+except ImportError:
+    fast_chardet = chardet
+
 # Добавляем библиотеку для работы с RTF
 try:
     import striprtf.striprtf as rtf
@@ -23,6 +46,30 @@ except ImportError:
 # КОНФИГУРАЦИЯ ПАПОК И ТИПОВ ДОКУМЕНТОВ
 # ==============================================
 
+# Правила удаления комментариев и служебных пометок из текста разделов.
+# pattern - регулярное выражение (без учета регистра, точка включает перенос
+# строки). Необязательный contains - подстрока, без которой правило не может
+# сработать (по умолчанию буквальное начало выражения): если ее нет в тексте,
+# правило пропускается.
+# Правила одного прохода (pass) объединяются в одно выражение; проходы идут по
+# порядку, поэтому правило, которому важен результат предыдущих (например,
+# пустая строка на месте удаленной пометки), выносится в следующий проход.
+DEFAULT_CLEANING_RULES = [
+    {"name": "edition", "pass": 1, "pattern": r"\(в ред\. [^)]*\)"},
+    {"name": "introduced", "pass": 1, "pattern": r"\(введена [^)]*\)"},
+    {"name": "item_edition", "pass": 1, "pattern": r"\(п\. \d+ в ред\. [^)]*\)"},
+    {"name": "consultant_bracket", "pass": 1, "pattern": r"\[[^\]]*Консультант[^\]]*\]"},
+    {"name": "consultant_note", "pass": 2, "pattern": r"КонсультантПлюс: примечание\..*?(?=\n\n|\Z)"},
+    {"name": "federal_law_ref", "pass": 3, "pattern": r"Федеральн(?:ого|ым) законом от \d{2}\.\d{2}\.\d{4} [№N]\d+-\S+"},
+    {"name": "see_also", "pass": 4, "pattern": r"см\. [^.]*\."},
+    {"name": "edition_date", "pass": 4, "pattern": r"ред\. \d{2}\.\d{2}\.\d{4}"},
+    {"name": "copyright", "pass": 4, "pattern": r"©.*"},
+    {"name": "item_introduced", "pass": 4,
+     "pattern": r"\(п\. \d+\.\d введен Федеральным законом от \d{2}\.\d{2}\.\d{4} N \d+-\S+\)"},
+    {"name": "federal_law_edition", "pass": 4,
+     "pattern": r"\(в ред\. Федерального закона от \d{2}\.\d{2}\.\d{4} N \d+-\S+\)"}
+]
+
 def load_config():
     """
     Загружает конфигурацию из JSON файла.
@@ -65,7 +112,27 @@ def load_config():
         "database_path": str(project_dir / "knowledge_database.db"),
         "templates_path": str(project_dir / "templates.json"),
         "expert_sessions_path": str(project_dir / "expert_sessions"),
-        "supported_extensions": [".md", ".txt", ".rtf"]
+        "supported_extensions": [".md", ".txt", ".rtf"],
+        "storage_backend": "json",
+        "normative_split_mode": "chapter",
+        "section_max_tokens": 0,
+        "section_min_tokens": 0,
+        "chars_per_token": 3.0,
+        "token_budget_priority": ["normative", "expertise", "methodology", "structured"],
+        "page_size": 50,
+        "recommend_top_k": 10,
+        "duplicate_threshold": 0.8,
+        "duplicate_min_words": 30,
+        "prompt_duplicates": "keep",
+        "citation_depth": 1,
+        "watch_folders": False,
+        "watch_interval": 10,
+        "watch_debounce": 5,
+        "ingest_workers": 1,
+        "json_compression": "none",
+        "lazy_content": False,
+        "cleaning_rules": DEFAULT_CLEANING_RULES,
+        "splitters": {}
     }
 
 def save_config(config):
@@ -128,6 +195,21 @@ CONFIG = load_config()
 # Получаем список поддерживаемых расширений
 SUPPORTED_EXTENSIONS = CONFIG.get("supported_extensions", [".md", ".txt", ".rtf"])
 
+# Среднее число символов на токен для оценки размера промта (русский текст)
+try:
+    CHARS_PER_TOKEN = float(CONFIG.get("chars_per_token", 3.0))
+except (TypeError, ValueError):
+    CHARS_PER_TOKEN = 0.0
+if not (math.isfinite(CHARS_PER_TOKEN) and CHARS_PER_TOKEN > 0):
+    print(f"⚠ chars_per_token должен быть положительным числом ({CONFIG.get('chars_per_token')!r}), используется 3.0")
+    CHARS_PER_TOKEN = 3.0
+
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка числа токенов текста для модели (без токенизатора)"""
+    if not text:
+        return 0
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
 # Создаем необходимые папки по умолчанию (если используются пути по умолчанию)
 if not Path(CONFIG["folders"]["normative"]).exists():
     created = create_default_folders(CONFIG["folders"])
@@ -155,6 +237,124 @@ expert_sessions_path.mkdir(exist_ok=True, parents=True)
 class FileFormatReader:
     """Класс для чтения файлов разных форматов"""
     
+    # Метки порядка байтов (BOM): сначала более длинные, чтобы UTF-32 не принять за UTF-16
+    BOMS = [
+        (codecs.BOM_UTF32_LE, 'utf-32-le'),
+        (codecs.BOM_UTF32_BE, 'utf-32-be'),
+        (codecs.BOM_UTF8, 'utf-8'),
+        (codecs.BOM_UTF16_LE, 'utf-16-le'),
+        (codecs.BOM_UTF16_BE, 'utf-16-be'),
+    ]
+    
+    # Объем начала файла, по которому угадывается однобайтовая кодировка
+    ENCODING_SAMPLE_SIZE = 64 * 1024
+    
+    _NON_ASCII = bytes(range(0x80))            # удаляется из образца, остаются байты >= 0x80
+    _NON_LETTERS = bytes(range(0x80, 0xC0))    # остаются 0xC0-0xFF - буквы в cp1251 и koi8-r
+    _LOWER_HALF = bytes(range(0xC0, 0xE0))     # остаются 0xE0-0xFF
+    
+    # Кэш кодировок: (путь, размер, mtime) → кодировка
+    _encoding_cache: Dict[tuple, str] = {}
+    
+    @staticmethod
+    def _guess_cyrillic(sample: bytes) -> Optional[str]:
+        """
+        Быстрое угадывание однобайтовой кириллицы. Строчные буквы в cp1251
+        занимают 0xE0-0xFF, а в koi8-r - 0xC0-0xDF; в русском тексте строчных
+        букв гораздо больше, поэтому достаточно сравнить эти две половины.
+        """
+        high = sample.translate(None, FileFormatReader._NON_ASCII)
+        if not high:
+            return None
+        letters = high.translate(None, FileFormatReader._NON_LETTERS)
+        if len(letters) < len(high) * 0.7:
+            return None  # не похоже на кириллицу
+        upper_half = len(letters.translate(None, FileFormatReader._LOWER_HALF))
+        return 'cp1251' if upper_half * 2 >= len(letters) else 'koi8-r'
+    
+    @staticmethod
+    def _guess_utf16(sample: bytes) -> Optional[str]:
+        """
+        UTF-16 без BOM: старший байт латиницы, цифр и пробелов нулевой, поэтому
+        нули стоят почти только на одной позиции пары (в русском тексте - хотя
+        бы у пробелов).
+        """
+        even_zeros = sample[0::2].count(0)
+        odd_zeros = sample[1::2].count(0)
+        if max(even_zeros, odd_zeros) < len(sample) // 64 or min(even_zeros, odd_zeros) * 4 > max(even_zeros, odd_zeros):
+            return None
+        return 'utf-16-le' if odd_zeros > even_zeros else 'utf-16-be'
+    
+    @staticmethod
+    def detect_encoding(raw_data: bytes) -> str:
+        """
+        Определяет кодировку по ступеням, от дешевых к дорогим: BOM, строгая
+        эвристика UTF-16, строгая проверка UTF-8, эвристика cp1251/koi8-r по
+        началу файла и только в последнюю очередь chardet на ограниченном образце.
+        """
+        for bom, encoding in FileFormatReader.BOMS:
+            if raw_data.startswith(bom):
+                return encoding
+        
+        # Нулевые байты - допустимый UTF-8, поэтому UTF-16 проверяется раньше
+        sample = raw_data[:FileFormatReader.ENCODING_SAMPLE_SIZE]
+        if b'\x00' in sample:
+            encoding = FileFormatReader._guess_utf16(sample)
+            if encoding:
+                return encoding
+        
+        try:
+            codecs.decode(raw_data, 'utf-8')
+            return 'utf-8'
+        except UnicodeDecodeError:
+            pass
+        
+        encoding = FileFormatReader._guess_cyrillic(sample)
+        if encoding:
+            try:
+                codecs.decode(sample, encoding)
+                return encoding
+            except UnicodeDecodeError:
+                pass
+        
+        result = fast_chardet.detect(sample)
+        encoding = result.get('encoding')
+        if encoding and (result.get('confidence') or 0) >= 0.7:
+            return encoding.lower()
+        return 'cp1251'
+    
+    @staticmethod
+    def decode(raw_data: bytes, file_path: Optional[Path] = None,
+               fallbacks: tuple = ('utf-8', 'cp1251', 'utf-16-le', 'iso-8859-1')) -> str:
+        """
+        Декодирует содержимое файла. Кодировка запоминается по отпечатку файла
+        (путь, размер, mtime), поэтому при повторном чтении не определяется заново.
+        """
+        cache_key = None
+        if file_path is not None:
+            stat = file_path.stat()
+            cache_key = (str(file_path), stat.st_size, stat.st_mtime_ns)
+        
+        encoding = FileFormatReader._encoding_cache.get(cache_key) if cache_key else None
+        if encoding is None:
+            encoding = FileFormatReader.detect_encoding(raw_data)
+        
+        for enc in (encoding,) + tuple(e for e in fallbacks if e != encoding):
+            try:
+                # utf-8-sig и utf-16 без указания порядка сами снимают BOM
+                codec = {'utf-8': 'utf-8-sig'}.get(enc, enc)
+                content = raw_data.decode(codec, errors='strict')
+            except (UnicodeDecodeError, LookupError):
+                continue
+            if content.startswith('\ufeff'):
+                content = content[1:]
+            if cache_key:
+                FileFormatReader._encoding_cache[cache_key] = enc
+            return content
+        
+        # Последняя попытка с игнорированием ошибок
+        return raw_data.decode('utf-8', errors='ignore')
+    
     @staticmethod
     def read_file(file_path: Path) -> Optional[str]:
         """
@@ -193,29 +393,9 @@ class FileFormatReader:
             if not raw_data:
                 return ""
             
-            # Пробуем определить кодировку
-            encoding_result = chardet.detect(raw_data)
-            encoding = encoding_result['encoding']
-            
-            # Пробуем разные кодировки
-            encodings_to_try = ['utf-8', 'cp1251', 'cp1252', 'iso-8859-1', 'windows-1251']
-            if encoding and encoding not in encodings_to_try:
-                encodings_to_try.insert(0, encoding)
-            
-            rtf_content = None
-            for enc in encodings_to_try:
-                try:
-                    rtf_content = raw_data.decode(enc, errors='strict')
-                    break
-                except (UnicodeDecodeError, LookupError):
-                    continue
-            
-            if rtf_content is None:
-                # Последняя попытка с игнорированием ошибок
-                try:
-                    rtf_content = raw_data.decode('utf-8', errors='ignore')
-                except:
-                    rtf_content = raw_data.decode('latin-1', errors='ignore')
+            rtf_content = FileFormatReader.decode(
+                raw_data, file_path, fallbacks=('utf-8', 'cp1251', 'cp1252', 'iso-8859-1')
+            )
             
             # Конвертируем RTF в обычный текст
             try:
@@ -240,44 +420,7 @@ class FileFormatReader:
             if not raw_data:
                 return ""
             
-            encoding_result = chardet.detect(raw_data)
-            encoding = encoding_result['encoding']
-            confidence = encoding_result['confidence']
-            
-            if not encoding or confidence < 0.7:
-                encodings_to_try = ['utf-8', 'utf-16-le', 'utf-16-be', 'cp1251', 'iso-8859-1']
-            else:
-                encodings_to_try = [encoding, 'utf-8', 'utf-16-le', 'utf-16-be']
-            
-            for enc in encodings_to_try:
-                try:
-                    if enc.startswith('utf-16'):
-                        if len(raw_data) >= 2:
-                            bom = raw_data[:2]
-                            if bom == b'\xff\xfe':
-                                content = raw_data[2:].decode('utf-16-le')
-                                return content
-                            elif bom == b'\xfe\xff':
-                                content = raw_data[2:].decode('utf-16-be')
-                                return content
-                            else:
-                                try:
-                                    content = raw_data.decode('utf-16-le')
-                                    return content
-                                except:
-                                    content = raw_data.decode('utf-16-be')
-                                    return content
-                    
-                    content = raw_data.decode(enc, errors='strict')
-                    return content
-                except (UnicodeDecodeError, LookupError):
-                    continue
-            
-            # Последняя попытка
-            try:
-                return raw_data.decode('utf-8', errors='ignore')
-            except:
-                return raw_data.decode('latin-1', errors='ignore')
+            return FileFormatReader.decode(raw_data, file_path)
                 
         except Exception as e:
             print(f"❌ Ошибка чтения текстового файла {file_path}: {e}")
@@ -415,534 +558,3090 @@ class TemplateManager:
         self.templates = self._load_templates()
 
 # ==============================================
-# СИСТЕМА УПРАВЛЕНИЯ БАЗОЙ РАЗДЕЛОВ
+# ХРАНИЛИЩА БАЗЫ РАЗДЕЛОВ (JSON / SQLite)
 # ==============================================
 
-class SimpleSectionDatabase:
-    """Простая система для создания и управления базой разделов"""
+def write_json_atomic(path: Path, data, compress: bool = False, **dump_kwargs):
+    """
+    Записывает JSON (при compress - сжатый gzip) во временный файл рядом с
+    целевым и заменяет им целевой через os.replace. При сбое или параллельном
+    сохранении на диске остается целая прежняя или новая версия файла.
+    """
+    payload = json.dumps(data, ensure_ascii=False, **dump_kwargs).encode('utf-8')
+    if compress:
+        payload = gzip.compress(payload, compresslevel=3, mtime=0)
     
-    def __init__(self):
-        self.db_path = Path(CONFIG["database_path"])
-        self.sections_db = self.db_path / "sections.json"
-        self.metadata_db = self.db_path / "metadata.json"
-        self.file_reader = FileFormatReader()  # Добавляем ридер файлов
-        
-        # Загружаем существующую базу или создаем новую
-        self.sections = self._load_sections()
-        self.metadata = self._load_metadata()
+    tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+def read_json_file(path: Path):
+    """Читает JSON файл, сжатый gzip распознается по сигнатуре"""
+    with open(path, 'rb') as f:
+        payload = f.read()
+    if payload[:2] == b'\x1f\x8b':
+        payload = gzip.decompress(payload)
+    return json.loads(payload)
+
+
+class SectionContentStore:
+    """
+    Тексты разделов в одном файле, куда новые тексты только дописываются
+    (UTF-8 подряд). Раздел ссылается на текст парой (смещение, длина в
+    байтах). Чтение идет через mmap без копирования файла в память, поэтому
+    несколько процессов Streamlit делят одни и те же страницы кэша ОС.
+    Одинаковые тексты (например, неизменные главы в редакциях ЗК и ГрК)
+    хранятся один раз.
+    """
     
-    def _load_sections(self) -> List[Dict]:
-        """Загружаем базу разделов"""
-        if self.sections_db.exists():
-            try:
-                with open(self.sections_db, 'r', encoding='utf-8') as f:
-                    sections = json.load(f)
-                    print(f"✅ База разделов загружена из {self.sections_db}")
-                    return sections
-            except Exception as e:
-                print(f"❌ Ошибка загрузки базы разделов: {e}")
-                return []
-        print("📁 База разделов не найдена, создается новая")
-        return []
+    # Файл переписывается, когда живые тексты занимают меньше этой доли
+    COMPACT_RATIO = 0.5
     
-    def _load_metadata(self) -> Dict:
-        """Загружаем метаданные базы"""
-        if self.metadata_db.exists():
-            try:
-                with open(self.metadata_db, 'r', encoding='utf-8') as f:
-                    metadata = json.load(f)
-                    print(f"✅ Метаданные базы загружены из {self.metadata_db}")
-                    return metadata
-            except Exception as e:
-                print(f"❌ Ошибка загрузки метаданных: {e}")
-                return {}
-        print("📁 Метаданные базы не найдены, создаются новые")
-        return {
-            "created_at": "",
-            "last_updated": "",
-            "total_sections": 0,
-            "total_documents": 0,
-            "by_folder": {},
-            "supported_extensions": SUPPORTED_EXTENSIONS
-        }
+    def __init__(self, path: Path):
+        self.path = path
+        self._mmap: Optional[mmap.mmap] = None
+        self._mapped_size = 0
+        self.live_refs: set = set()  # ссылки последней сохраненной/загруженной базы
     
-    def _clean_text_from_comments(self, text: str) -> str:
-        """Очищает текст от различных комментариев и служебной информации"""
-        if not text:
-            return text
-        
-        # Паттерны для удаления - ТОЛЬКО конкретные комментарии
-        patterns_to_remove = [
-            r'\(в ред\. [^)]*\)',
-            r'\(введена [^)]*\)',
-            r'\(п\. \d+ в ред\. [^)]*\)',
-            r'\[[^\]]*Консультант[^\]]*\]',
-            r'КонсультантПлюс: примечание\..*?(?=\n\n|\Z)',
-            r'Федеральн(?:ого|ым) законом от \d{2}\.\d{2}\.\d{4} [№N]\d+-\S+',
-            r'см\. [^.]*\.',
-            r'ред\. \d{2}\.\d{2}\.\d{4}',
-            r'©.*',
-            r'\(п\. \d+\.\d введен Федеральным законом от \d{2}\.\d{2}\.\d{4} N \d+-\S+\)',
-            r'\(в ред\. Федерального закона от \d{2}\.\d{2}\.\d{4} N \d+-\S+\)'
-        ]
+    def size(self) -> int:
+        """Размер файла текстов в байтах"""
+        return self.path.stat().st_size if self.path.exists() else 0
+    
+    def _mapped(self):
+        """Отображение файла в память (переоткрывается, если файл вырос)"""
+        size = self.size()
+        if size == 0:
+            return b""
+        if self._mmap is None or self._mapped_size != size:
+            self.close()
+            with open(self.path, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mapped_size = size
+        return self._mmap
+    
+    def close(self):
+        """Закрывает отображение файла (нужно перед удалением файла в Windows)"""
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+            self._mapped_size = 0
+    
+    def read(self, ref) -> str:
+        """Текст по ссылке (смещение, длина): декодируется прямо из memoryview"""
+        offset, length = ref[0], ref[1]
+        if not length:
+            return ""
+        with memoryview(self._mapped()) as view:
+            return str(view[offset:offset + length], 'utf-8')
+    
+    def store(self, sections: List[Dict]) -> List[list]:
+        """
+        Возвращает ссылки на тексты разделов по порядку. Разделы без текста в
+        памяти сохраняют свою ссылку; новые тексты дописываются в конец файла,
+        если такого же текста в файле еще нет.
+        """
+        if not any("content" in section for section in sections):
+            refs = [section.get("content_ref", [0, 0]) for section in sections]
+            self.live_refs = {tuple(ref) for ref in refs}
+            return refs
         
-        cleaned_text = text
+        # Хэши уже записанных текстов (в т.ч. разделов прежней версии базы,
+        # которые при полной пересборке пришли заново) для поиска повторов
+        known = {}
+        existing = set(self.live_refs)
+        existing.update(tuple(section["content_ref"]) for section in sections
+                        if "content" not in section and section.get("content_ref"))
+        with memoryview(self._mapped()) as view:
+            for offset, length in existing:
+                if length:
+                    known[hashlib.sha1(view[offset:offset + length]).digest()] = [offset, length]
         
-        # Очищаем каждый паттерн отдельно
-        for pattern in patterns_to_remove:
-            cleaned_text = re.sub(pattern, '', cleaned_text, flags=re.IGNORECASE|re.DOTALL)
+        refs = []
+        pending = []
+        end = self.size()
+        for section in sections:
+            if "content" not in section:
+                refs.append(section.get("content_ref", [0, 0]))
+                continue
+            
+            data = section["content"].encode('utf-8')
+            digest = hashlib.sha1(data).digest()
+            ref = known.get(digest)
+            if ref is None:
+                ref = [end, len(data)]
+                known[digest] = ref
+                pending.append(data)
+                end += len(data)
+            refs.append(ref)
         
-        return cleaned_text
+        if pending:
+            with open(self.path, 'ab') as f:
+                f.writelines(pending)
+                f.flush()
+                os.fsync(f.fileno())
+        self.live_refs = {tuple(ref) for ref in refs}
+        return refs
     
-    def _clean_special_characters(self, text: str) -> str:
-        """Очищает текст от специальных символов и форматирования, убирает лишние пустые строки"""
-        if not text:
-            return text
+    def needs_compaction(self, refs: List[list]) -> bool:
+        """Слишком много места занято текстами, на которые больше нет ссылок"""
+        live = sum(length for _, length in {tuple(ref) for ref in refs})
+        return self.size() > 0 and live < self.size() * self.COMPACT_RATIO
+    
+    def compact(self, refs: List[list], new_path: Path) -> tuple:
+        """Переписывает живые тексты в новый файл, возвращает (новое хранилище, новые ссылки)"""
+        moved = {}
+        offset = 0
+        with open(new_path, 'wb') as out, memoryview(self._mapped()) as view:
+            for ref in refs:
+                key = tuple(ref)
+                if key in moved:
+                    continue
+                out.write(view[ref[0]:ref[0] + ref[1]])
+                moved[key] = [offset, ref[1]]
+                offset += ref[1]
+            out.flush()
+            os.fsync(out.fileno())
         
-        # Удаляем множественные пробелы и табуляции
-        cleaned = re.sub(r'[ \t]+', ' ', text)
+        print(f"🗜️ Файл текстов сжат: {self.size()} → {offset} байт")
+        store = SectionContentStore(new_path)
+        store.live_refs = set(map(tuple, moved.values()))
+        return store, [moved[tuple(ref)] for ref in refs]
+
+
+class JsonSectionStorage:
+    """
+    Хранение базы разделов в JSON файлах sections.json (или sections.json.gz
+    при json_compression = "gzip") и metadata.json. Файлы сохраняются
+    атомарно, файл разделов начинается с заголовка формата и версии.
+    
+    В ленивом режиме (lazy_content) тексты разделов лежат в хранилище
+    текстов contents.<метка>.bin (SectionContentStore), а разделы ссылаются
+    на них парой content_ref (смещение, длина в байтах); имя файла текстов
+    записано в заголовке.
+    """
+    
+    name = "json"
+    
+    FORMAT = "expert_sections"
+    # 1 - список разделов без заголовка, 2 - {"format", "version", "sections"}
+    FORMAT_VERSION = 2
+    
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+        self.compress = CONFIG.get("json_compression", "none") == "gzip"
+        self.plain_sections_db = self.db_path / "sections.json"
+        self.gzip_sections_db = self.db_path / "sections.json.gz"
+        self.sections_db = self.gzip_sections_db if self.compress else self.plain_sections_db
+        self.metadata_db = self.db_path / "metadata.json"
+        self.selections_dir = self.db_path / "selections"
+        self.lazy = bool(CONFIG.get("lazy_content", False))
+        self.content_store: Optional[SectionContentStore] = None  # тексты, на которые ссылаются разделы
+    
+    def _existing_sections_file(self) -> Optional[Path]:
+        """Файл разделов: в настроенном формате, а если его нет - в другом"""
+        for candidate in (self.sections_db, self.plain_sections_db, self.gzip_sections_db):
+            if candidate.exists():
+                return candidate
+        return None
+    
+    def exists(self) -> bool:
+        """Есть ли сохраненная база разделов"""
+        return self._existing_sections_file() is not None
+    
+    def load_sections(self) -> Optional[List[Dict]]:
+        """Загружаем разделы, None - если база еще не создана"""
+        sections_file = self._existing_sections_file()
+        if sections_file is None:
+            return None
         
-        # Удаляем символы мягких переносов и другие специальные символы
-        cleaned = cleaned.replace('\xad', '')  # мягкий перенос
-        cleaned = cleaned.replace('\xa0', ' ')  # неразрывный пробел
+        data = read_json_file(sections_file)
+        content_file = None
+        if isinstance(data, list):
+            sections = data  # версия 1 - без заголовка
+        elif data.get("format") == self.FORMAT and data.get("version", 0) <= self.FORMAT_VERSION:
+            sections = data.get("sections", [])
+            content_file = data.get("content_file")
+        else:
+            raise ValueError(f"неподдерживаемый формат базы: {data.get('format')} v{data.get('version')}")
         
-        # Удаляем скрытые символы форматирования
-        cleaned = re.sub(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]', '', cleaned)
+        if self.content_store is not None:
+            self.content_store.close()
+        self.content_store = SectionContentStore(self.db_path / content_file) if content_file else None
+        if self.content_store is not None:
+            self.content_store.live_refs = {tuple(s["content_ref"]) for s in sections if "content_ref" in s}
+        if self.content_store is not None and not self.lazy:
+            # База сохранена в ленивом режиме, который сейчас выключен - возвращаем тексты
+            contents = self.load_content(sections)
+            for section in sections:
+                if "content_ref" in section:
+                    section["content"] = contents.get(section.get("id"), "")
+                    del section["content_ref"]
         
-        # Удаляем множественные переносы строк (оставляем максимум 2 подряд)
-        cleaned = re.sub(r'\n{3,}', '\n\n', cleaned)
+        print(f"✅ База разделов загружена из {sections_file}")
+        return sections
+    
+    def load_content(self, sections: List[Dict]) -> Dict[str, str]:
+        """Тексты разделов по ссылкам content_ref (ID раздела → текст)"""
+        if self.content_store is None:
+            return {}
+        return {
+            section.get("id"): self.content_store.read(section["content_ref"])
+            for section in sections if "content_ref" in section
+        }
+    
+    def load_metadata(self) -> Optional[Dict]:
+        """Загружаем метаданные, None - если их еще нет"""
+        if not self.metadata_db.exists():
+            return None
+        metadata = read_json_file(self.metadata_db)
+        print(f"✅ Метаданные базы загружены из {self.metadata_db}")
+        return metadata
+    
+    def save(self, sections: List[Dict], metadata: Dict):
+        """
+        Сохраняем базу целиком (компактный JSON, атомарная замена файлов).
+        В ленивом режиме новые тексты дописываются в хранилище текстов (при
+        большом объеме устаревших текстов оно переписывается в новый файл),
+        а ссылки content_ref у разделов обновляются после сохранения базы.
+        """
+        self.db_path.mkdir(exist_ok=True, parents=True)
         
-        # Удаляем пустые строки в начале и конце
-        cleaned = cleaned.strip()
+        header = {"format": self.FORMAT, "version": self.FORMAT_VERSION}
+        store, refs = None, None
+        if self.lazy:
+            store = self.content_store or SectionContentStore(
+                self.db_path / f"contents.{uuid.uuid4().hex[:8]}.bin"
+            )
+            refs = store.store(sections)
+            if store.needs_compaction(refs):
+                store, refs = store.compact(refs, self.db_path / f"contents.{uuid.uuid4().hex[:8]}.bin")
+            header["content_file"] = store.path.name
+            stored = [
+                {**{k: v for k, v in section.items() if k != "content"}, "content_ref": ref}
+                for section, ref in zip(sections, refs)
+            ]
+        else:
+            stored = [{k: v for k, v in section.items() if k != "content_ref"} for section in sections]
         
-        # Заменяем множественные пробелы на один
-        cleaned = re.sub(r' +', ' ', cleaned)
+        try:
+            write_json_atomic(self.sections_db, {**header, "sections": stored},
+                              compress=self.compress, separators=(',', ':'))
+        except Exception:
+            if store is not None and store is not self.content_store:
+                store.close()
+                store.path.unlink(missing_ok=True)
+            raise
         
-        # Удаляем пробелы в начале и конце каждой строки
-        lines = cleaned.split('\n')
-        cleaned_lines = []
-        for line in lines:
-            line = line.strip()
-            if line:  # добавляем только непустые строки
-                cleaned_lines.append(line)
+        # База ссылается на новое хранилище текстов - прежние файлы больше не нужны
+        if self.content_store is not None and self.content_store is not store:
+            self.content_store.close()
+        self.content_store = store
+        if refs is not None:
+            for section, ref in zip(sections, refs):
+                section["content_ref"] = ref
+        for old_file in self.db_path.glob("contents.*.bin"):
+            if store is None or old_file != store.path:
+                try:
+                    old_file.unlink()
+                except OSError as e:
+                    # В Windows файл, открытый другим процессом, удалится при следующем сохранении
+                    print(f"⚠ Не удалось удалить старый файл текстов {old_file.name}: {e}")
         
-        # Собираем обратно с нормальными переносами строк
-        cleaned = '\n'.join(cleaned_lines)
+        # Файл в другом формате после смены json_compression больше не нужен
+        for stale_file in (self.plain_sections_db, self.gzip_sections_db):
+            if stale_file != self.sections_db and stale_file.exists():
+                stale_file.unlink()
         
-        return cleaned
+        write_json_atomic(self.metadata_db, metadata, indent=2)
     
-    def _extract_yaml_metadata(self, content: str) -> Dict:
-        """Извлекает метаданные из YAML заголовка в начале документа"""
-        metadata = {}
-        
-        try:
-            content_stripped = content.strip()
-            if content_stripped.startswith('---'):
-                parts = content_stripped.split('---', 2)
-                if len(parts) >= 3:
-                    yaml_content = parts[1].strip()
-                    if yaml_content:
-                        metadata = yaml.safe_load(yaml_content) or {}
-        except (yaml.YAMLError, AttributeError) as e:
-            print(f"  ⚠ Не удалось прочитать YAML: {e}")
+    def _user_selection_file(self, user_id: str) -> Path:
+        """Файл выбора пользователя (имя очищается от недопустимых символов)"""
+        safe_name = re.sub(r'[^\w.-]', '_', user_id)[:64] or "default"
+        return self.selections_dir / f"{safe_name}.json"
+    
+    def load_user_selection(self, user_id: str) -> Optional[List[str]]:
+        """ID выбранных пользователем разделов, None - если выбор еще не сохранялся"""
+        selection_file = self._user_selection_file(user_id)
+        if not selection_file.exists():
+            return None
+        return read_json_file(selection_file).get("selected_ids", [])
+    
+    def save_user_selection(self, user_id: str, section_ids: List[str]):
+        """Сохраняем выбор пользователя в отдельный небольшой файл"""
+        self.selections_dir.mkdir(exist_ok=True, parents=True)
+        write_json_atomic(self._user_selection_file(user_id), {
+            "user_id": user_id,
+            "updated_at": datetime.now().isoformat(),
+            "selected_ids": list(section_ids)
+        }, indent=2)
+    
+    def remap_user_selections(self, id_map: Dict[str, str]) -> int:
+        """Заменяет устаревшие ID разделов в сохраненных выборах, возвращает число выборов"""
+        if not self.selections_dir.exists():
+            return 0
         
-        if not isinstance(metadata, dict):
-            metadata = {}
+        updated = 0
+        for selection_file in self.selections_dir.glob("*.json"):
+            data = read_json_file(selection_file)
+            old_ids = data.get("selected_ids", [])
+            new_ids = list(dict.fromkeys(id_map.get(section_id, section_id) for section_id in old_ids))
+            if new_ids != old_ids:
+                data["selected_ids"] = new_ids
+                write_json_atomic(selection_file, data, indent=2)
+                updated += 1
+        return updated
+
+
+class SqliteSectionStorage:
+    """
+    Хранение базы разделов в SQLite: таблицы документов и разделов, выбор
+    пользователей (отдельные строки без перезаписи базы). Поиск по разделам
+    выполняет индекс BM25 базы, как и для JSON хранилища. Таблица selections
+    осталась от общего выбора и читается только для его миграции.
+    """
+    
+    name = "sqlite"
+    
+    # Поля раздела, которые хранятся в отдельных колонках
+    DOCUMENT_FIELDS = ("folder", "document", "document_extension", "document_title", "document_path", "metadata")
+    SECTION_FIELDS = ("id", "title", "content", "section_type", "word_count", "selected")
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS documents (
+            id INTEGER PRIMARY KEY,
+            path TEXT NOT NULL UNIQUE,
+            folder TEXT NOT NULL,
+            name TEXT NOT NULL,
+            extension TEXT,
+            title TEXT,
+            metadata TEXT
+        );
+        CREATE TABLE IF NOT EXISTS sections (
+            rowid INTEGER PRIMARY KEY,
+            id TEXT NOT NULL UNIQUE,
+            document_id INTEGER NOT NULL REFERENCES documents(id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            title TEXT,
+            content TEXT,
+            section_type TEXT,
+            word_count INTEGER,
+            extra TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_sections_document ON sections(document_id);
+        CREATE INDEX IF NOT EXISTS idx_sections_position ON sections(position);
+        CREATE TABLE IF NOT EXISTS selections (
+            section_id TEXT PRIMARY KEY,
+            selected_at TEXT
+        );
+        CREATE TABLE IF NOT EXISTS selection_users (
+            user_id TEXT PRIMARY KEY,
+            updated_at TEXT
+        );
+        CREATE TABLE IF NOT EXISTS user_selections (
+            user_id TEXT NOT NULL REFERENCES selection_users(user_id) ON DELETE CASCADE,
+            section_id TEXT NOT NULL,
+            selected_at TEXT,
+            PRIMARY KEY (user_id, section_id)
+        );
+        CREATE TABLE IF NOT EXISTS database_metadata (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+        -- Индекс FTS5 прежних версий: поиск идет по индексу BM25 базы
+        DROP TRIGGER IF EXISTS sections_ai;
+        DROP TRIGGER IF EXISTS sections_ad;
+        DROP TRIGGER IF EXISTS sections_au;
+        DROP TABLE IF EXISTS sections_fts;
+    """
+    
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+        self.sqlite_db = self.db_path / "sections.sqlite"
+        self.lazy = bool(CONFIG.get("lazy_content", False))
+        self.db_path.mkdir(exist_ok=True, parents=True)
         
-        return metadata
+        with self._connect() as conn:
+            conn.executescript(self.SCHEMA)
     
-    def save_database(self):
-        """Сохраняем базу на диск"""
-        try:
-            self.db_path.mkdir(exist_ok=True, parents=True)
-            
-            with open(self.sections_db, 'w', encoding='utf-8') as f:
-                json.dump(self.sections, f, ensure_ascii=False, indent=2)
-            
-            with open(self.metadata_db, 'w', encoding='utf-8') as f:
-                json.dump(self.metadata, f, ensure_ascii=False, indent=2)
-            
-            print(f"💾 База данных сохранена в {self.db_path}")
-        except Exception as e:
-            print(f"❌ Ошибка сохранения базы данных: {e}")
+    def _connect(self) -> sqlite3.Connection:
+        """Открывает соединение (отдельное на каждую операцию - Streamlit работает в нескольких потоках)"""
+        conn = sqlite3.connect(self.sqlite_db, timeout=30)
+        conn.execute("PRAGMA foreign_keys = ON")
+        conn.execute("PRAGMA journal_mode = WAL")
+        return conn
     
-    def scan_and_build_database(self):
-        """Сканируем папки и строим базу разделов"""
-        print("🔍 Начинаем сканирование папок...")
+    def load_sections(self) -> Optional[List[Dict]]:
+        """Загружаем разделы в порядке базы (в ленивом режиме без текстов), None - если база пуста"""
+        with self._connect() as conn:
+            rows = conn.execute(f"""
+                SELECT s.id, s.title, {"NULL" if self.lazy else "s.content"}, s.section_type, s.word_count, s.extra,
+                       d.folder, d.name, d.extension, d.title, d.path, d.metadata,
+                       sel.section_id IS NOT NULL
+                FROM sections s
+                JOIN documents d ON d.id = s.document_id
+                LEFT JOIN selections sel ON sel.section_id = s.id
+                ORDER BY s.position
+            """).fetchall()
         
-        all_sections = []
-        folder_stats = {}
+        if not rows:
+            return None
         
-        for folder_name, folder_path in CONFIG["folders"].items():
-            if not folder_path or not Path(folder_path).exists():
-                print(f"⚠ Папка не найдена: {folder_path}")
-                continue
-            
-            folder = Path(folder_path)
-            print(f"\n📁 Сканируем: {folder} ({folder_name})")
+        sections = []
+        for (section_id, title, content, section_type, word_count, extra,
+             folder, name, extension, doc_title, path, metadata, selected) in rows:
+            section = {
+                "id": section_id,
+                "folder": folder,
+                "document": name,
+                "document_extension": extension,
+                "document_title": doc_title,
+                "document_path": path,
+                "title": title,
+                "content": content,
+                "section_type": section_type,
+                "word_count": word_count,
+                "metadata": json.loads(metadata) if metadata else {},
+                "selected": bool(selected)
+            }
+            if self.lazy:
+                del section["content"]
+            if extra:
+                section.update(json.loads(extra))
+            sections.append(section)
+        
+        print(f"✅ База разделов загружена из {self.sqlite_db}")
+        return sections
+    
+    def load_metadata(self) -> Optional[Dict]:
+        """Загружаем метаданные, None - если их еще нет"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT value FROM database_metadata WHERE key = 'metadata'"
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def load_content(self, sections: List[Dict]) -> Dict[str, str]:
+        """Тексты разделов из таблицы sections (ID раздела → текст)"""
+        section_ids = [section.get("id") for section in sections]
+        contents = {}
+        with self._connect() as conn:
+            for start in range(0, len(section_ids), 500):
+                chunk = section_ids[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT id, content FROM sections WHERE id IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                contents.update({section_id: content or "" for section_id, content in rows})
+        return contents
+    
+    def save(self, sections: List[Dict], metadata: Dict):
+        """
+        Сохраняем базу одной транзакцией. ID разделов детерминированы по
+        содержимому, поэтому вставляются только новые разделы, удаляются
+        исчезнувшие, а у остальных обновляется лишь позиция.
+        """
+        with self._connect() as conn:
+            document_ids = {}
+            for section in sections:
+                path = section.get("document_path", "")
+                if path in document_ids:
+                    continue
+                conn.execute("""
+                    INSERT INTO documents(path, folder, name, extension, title, metadata)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(path) DO UPDATE SET
+                        folder = excluded.folder, name = excluded.name, extension = excluded.extension,
+                        title = excluded.title, metadata = excluded.metadata
+                """, (
+                    path,
+                    section.get("folder", "unknown"),
+                    section.get("document", ""),
+                    section.get("document_extension", ""),
+                    section.get("document_title", ""),
+                    json.dumps(section.get("metadata", {}), ensure_ascii=False, default=str)
+                ))
+                document_ids[path] = conn.execute(
+                    "SELECT id FROM documents WHERE path = ?", (path,)
+                ).fetchone()[0]
             
-            # Ищем файлы ВСЕХ поддерживаемых форматов
-            files = []
-            for ext in SUPPORTED_EXTENSIONS:
-                files.extend(list(folder.rglob(f"*{ext}")))
+            existing_ids = {row[0] for row in conn.execute("SELECT id FROM sections")}
+            new_ids = {section.get("id") for section in sections}
             
-            folder_sections = 0
-            folder_documents = len(files)
+            conn.executemany(
+                "DELETE FROM sections WHERE id = ?",
+                [(section_id,) for section_id in existing_ids - new_ids]
+            )
             
-            for file_path in files:
-                print(f"  📄 {file_path.name} ({file_path.suffix})...", end="")
-                
-                try:
-                    # Используем универсальный ридер файлов
-                    content = self.file_reader.read_file(file_path)
-                    
-                    if content is None:
-                        print(f" ❌ Не удалось прочитать файл")
-                        continue
-                    
-                    # Извлекаем метаданные из YAML заголовка
-                    metadata = self._extract_yaml_metadata(content)
-                    
-                    # Получаем название документа из метаданных или имени файла
-                    document_title = metadata.get('title', file_path.stem)
-                    
-                    # ОЧИЩАЕМ ТЕКСТ ОТ СЛУЖЕБНЫХ СИМВОЛОВ
-                    cleaned_content = self._clean_special_characters(content)
-                    
-                    # РАЗБИВАЕМ ДОКУМЕНТ НА РАЗДЕЛЫ В ЗАВИСИМОСТИ ОТ ТИПА ПАПКИ
-                    sections = self._split_document_by_type(
-                        cleaned_content,
-                        file_path, 
-                        folder_name, 
-                        document_title
-                    )
-                    
-                    print(f" → {len(sections)} разделов")
-                    folder_sections += len(sections)
-                    
-                    # Добавляем разделы в общий список
-                    for i, section in enumerate(sections):
-                        # ОЧИЩАЕМ КОНТЕНТ КАЖДОГО РАЗДЕЛА ОТ КОММЕНТАРИЕВ
-                        section_content = section.get("content", "")
-                        final_content = self._clean_text_from_comments(section_content)
-                        
-                        all_sections.append({
-                            "id": f"{file_path.stem}_{i}_{uuid.uuid4().hex[:8]}",
-                            "folder": folder_name,
-                            "document": file_path.name,
-                            "document_extension": file_path.suffix,
-                            "document_title": document_title,
-                            "document_path": str(file_path),
-                            "title": section.get("title", document_title),
-                            "content": final_content,
-                            "section_type": section.get("type", "text"),
-                            "word_count": len(final_content.split()),
-                            "metadata": metadata,
-                            "selected": False
-                        })
-                        
-                except Exception as e:
-                    print(f" ❌ Ошибка: {e}")
-                    import traceback
-                    traceback.print_exc()
+            for position, section in enumerate(sections):
+                document_id = document_ids[section.get("document_path", "")]
+                if section.get("id") in existing_ids:
+                    # ID построен по заголовку и тексту: раз он совпал, они не изменились.
+                    # Заголовок и текст не перезаписываются, чтобы триггер не переиндексировал строку
+                    conn.execute("""
+                        UPDATE sections SET document_id = ?, position = ?,
+                            section_type = ?, word_count = ?, extra = ?
+                        WHERE id = ?
+                    """, (
+                        document_id,
+                        position,
+                        section.get("section_type", "text"),
+                        section.get("word_count", 0),
+                        self._extra_fields(section),
+                        section.get("id")
+                    ))
+                else:
+                    conn.execute("""
+                        INSERT INTO sections(document_id, position, title, content, section_type, word_count, extra, id)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    """, (
+                        document_id,
+                        position,
+                        section.get("title", ""),
+                        section.get("content", ""),
+                        section.get("section_type", "text"),
+                        section.get("word_count", 0),
+                        self._extra_fields(section),
+                        section.get("id")
+                    ))
             
-            folder_stats[folder_name] = {
-                "documents": folder_documents,
-                "sections": folder_sections
-            }
-        
-        # Обновляем базу
-        self.sections = all_sections
-        
-        # Обновляем метаданные
-        self.metadata = {
-            "created_at": self.metadata.get("created_at", datetime.now().isoformat()),
-            "last_updated": datetime.now().isoformat(),
-            "total_sections": len(all_sections),
-            "total_documents": sum(stats["documents"] for stats in folder_stats.values()),
-            "by_folder": folder_stats,
-            "supported_extensions": SUPPORTED_EXTENSIONS
+            conn.execute("""
+                DELETE FROM documents WHERE id NOT IN (SELECT DISTINCT document_id FROM sections)
+            """)
+            conn.execute(
+                "INSERT OR REPLACE INTO database_metadata(key, value) VALUES ('metadata', ?)",
+                (json.dumps(metadata, ensure_ascii=False, default=str),)
+            )
+    
+    def load_user_selection(self, user_id: str) -> Optional[List[str]]:
+        """ID выбранных пользователем разделов, None - если выбор еще не сохранялся"""
+        with self._connect() as conn:
+            if not conn.execute(
+                "SELECT 1 FROM selection_users WHERE user_id = ?", (user_id,)
+            ).fetchone():
+                return None
+            rows = conn.execute(
+                "SELECT section_id FROM user_selections WHERE user_id = ? ORDER BY rowid", (user_id,)
+            ).fetchall()
+        return [row[0] for row in rows]
+    
+    def save_user_selection(self, user_id: str, section_ids: List[str]):
+        """Приводит строки выбора пользователя в соответствие с переданными ID"""
+        selected_ids = set(section_ids)
+        now = datetime.now().isoformat()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO selection_users(user_id, updated_at) VALUES (?, ?)",
+                (user_id, now)
+            )
+            stored_ids = {row[0] for row in conn.execute(
+                "SELECT section_id FROM user_selections WHERE user_id = ?", (user_id,)
+            )}
+            conn.executemany(
+                "DELETE FROM user_selections WHERE user_id = ? AND section_id = ?",
+                [(user_id, section_id) for section_id in stored_ids - selected_ids]
+            )
+            conn.executemany(
+                "INSERT INTO user_selections(user_id, section_id, selected_at) VALUES (?, ?, ?)",
+                [(user_id, section_id, now) for section_id in selected_ids - stored_ids]
+            )
+    
+    def remap_user_selections(self, id_map: Dict[str, str]) -> int:
+        """Заменяет устаревшие ID разделов в выборах всех пользователей, возвращает число строк"""
+        with self._connect() as conn:
+            cursor = conn.executemany(
+                "UPDATE OR REPLACE user_selections SET section_id = ? WHERE section_id = ?",
+                [(new_id, old_id) for old_id, new_id in id_map.items()]
+            )
+            return cursor.rowcount
+    
+    def _extra_fields(self, section: Dict) -> Optional[str]:
+        """Дополнительные поля раздела, для которых нет отдельных колонок"""
+        extra = {
+            key: value for key, value in section.items()
+            if key not in self.DOCUMENT_FIELDS and key not in self.SECTION_FIELDS
         }
+        return json.dumps(extra, ensure_ascii=False, default=str) if extra else None
+
+
+def create_section_storage(db_path: Path):
+    """Создает хранилище базы разделов по настройке storage_backend из config.json"""
+    backend = CONFIG.get("storage_backend", "json")
+    
+    if backend == "sqlite":
+        storage = SqliteSectionStorage(db_path)
         
-        # Сохраняем
-        self.save_database()
-        
-        print(f"\n✅ База создана!")
-        print(f"   Всего документов: {self.metadata['total_documents']}")
-        print(f"   Всего разделов: {self.metadata['total_sections']}")
-        
-        # Статистика по форматам
-        format_stats = {}
-        for section in all_sections:
-            ext = section.get("document_extension", ".txt").lower()
-            format_stats[ext] = format_stats.get(ext, 0) + 1
+        # Однократный перенос существующей JSON базы в пустую SQLite базу
+        json_storage = JsonSectionStorage(db_path)
+        json_storage.lazy = False  # при переносе нужны тексты разделов
+        if storage.load_metadata() is None and json_storage.exists():
+            try:
+                sections = json_storage.load_sections() or []
+                metadata = json_storage.load_metadata() or {}
+                storage.save(sections, metadata)
+                print(f"📦 JSON база перенесена в SQLite: {len(sections)} разделов")
+            except Exception as e:
+                print(f"❌ Ошибка переноса JSON базы в SQLite: {e}")
         
-        print(f"   Форматы документов:")
-        for ext, count in format_stats.items():
-            print(f"     {ext}: {count} документов")
+        return storage
+    
+    if backend != "json":
+        print(f"⚠ Неизвестный тип хранилища '{backend}', используется JSON")
+    return JsonSectionStorage(db_path)
+
+# ==============================================
+# ПОЛНОТЕКСТОВЫЙ ПОИСК ПО РАЗДЕЛАМ (BM25)
+# ==============================================
+
+# Слова и номера (в том числе составные: "39.20", "218-ФЗ" дает "218" и "фз")
+TOKEN_PATTERN = re.compile(r'\d+(?:\.\d+)*|[а-яa-z]+')
+
+# Окончания для облегченного стемминга русского языка (по мотивам Snowball),
+# упорядочены по убыванию длины, чтобы отрезалось самое длинное окончание
+RUSSIAN_REFLEXIVE_ENDINGS = ("ся", "сь")
+RUSSIAN_ENDINGS = tuple(sorted({
+    # прилагательные и причастия
+    "ейшими", "ейшего", "ейшему", "ейшая", "ейшее", "ейший",
+    "ими", "ыми", "его", "ого", "ему", "ому", "ее", "ие", "ые", "ое", "ей", "ий", "ый", "ой",
+    "ем", "им", "ым", "ом", "их", "ых", "ую", "юю", "ая", "яя", "ою", "ею",
+    # глаголы
+    "ила", "ыла", "ена", "ейте", "уйте", "ите", "или", "ыли", "ует", "уют", "ены", "ить", "ыть",
+    "ешь", "нно", "ла", "на", "ете", "йте", "ли", "ть", "ны", "ет", "ют", "ят", "ит", "ат",
+    # существительные
+    "иями", "ями", "ами", "иях", "ях", "ах", "ией", "ием", "ьми", "ия", "ья", "ию", "ью",
+    "ев", "ов", "ям", "ам", "а", "е", "и", "й", "о", "у", "ы", "ь", "ю", "я",
+}, key=len, reverse=True))
+RUSSIAN_MIN_STEM = 3
+
+
+@lru_cache(maxsize=200000)
+def stem_russian_word(word: str) -> str:
+    """Облегченный стемминг: отрезает возвратную частицу и одно окончание"""
+    if len(word) <= RUSSIAN_MIN_STEM or not ('а' <= word[0] <= 'я'):
+        return word
+    
+    for ending in RUSSIAN_REFLEXIVE_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) > RUSSIAN_MIN_STEM:
+            word = word[:-len(ending)]
+            break
+    
+    for ending in RUSSIAN_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= RUSSIAN_MIN_STEM:
+            return word[:-len(ending)]
+    
+    return word
+
+
+def analyze_text(text: str) -> List[str]:
+    """Разбивает текст на термы: нижний регистр, ё→е, стемминг слов"""
+    if not text:
+        return []
+    normalized = text.lower().replace('ё', 'е')
+    return [stem_russian_word(token) for token in TOKEN_PATTERN.findall(normalized)]
+
+
+class SectionSearchIndex:
+    """
+    Инвертированный индекс по заголовкам и текстам разделов с ранжированием BM25.
+    Индекс обновляется инкрементально: раздел с новым ID добавляется, исчезнувший
+    удаляется (ID раздела зависит от его текста, так что измененный раздел -
+    это удаление старого ID и добавление нового).
+    """
+    
+    VERSION = 1
+    K1 = 1.2
+    B = 0.75
+    TITLE_BOOST = 3
+    SNIPPET_RADIUS = 90
+    
+    def __init__(self):
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.doc_lengths: Dict[str, int] = {}
+        self.total_length = 0
+    
+    @property
+    def section_ids(self) -> set:
+        return set(self.doc_lengths)
+    
+    def copy(self) -> "SectionSearchIndex":
+        """Копия для обновления без блокировки базы: исходный индекс не меняется"""
+        index = SectionSearchIndex()
+        index.postings = {term: dict(section_postings) for term, section_postings in self.postings.items()}
+        index.doc_lengths = dict(self.doc_lengths)
+        index.total_length = self.total_length
+        return index
+    
+    def add_section(self, section_id: str, title: str, content: str):
+        """Добавляет раздел в индекс (заголовок весит больше текста)"""
+        if section_id in self.doc_lengths:
+            self.remove_section(section_id)
+        
+        frequencies = {}
+        terms = analyze_text(content)
+        for term in terms:
+            frequencies[term] = frequencies.get(term, 0) + 1
+        for term in analyze_text(title):
+            frequencies[term] = frequencies.get(term, 0) + self.TITLE_BOOST
+        
+        for term, frequency in frequencies.items():
+            self.postings.setdefault(term, {})[section_id] = frequency
+        
+        length = sum(frequencies.values())
+        self.doc_lengths[section_id] = length
+        self.total_length += length
+    
+    def remove_section(self, section_id: str):
+        """Удаляет раздел из индекса"""
+        length = self.doc_lengths.pop(section_id, None)
+        if length is None:
+            return
+        self.total_length -= length
+        
+        for term in list(self.postings):
+            section_postings = self.postings[term]
+            if section_postings.pop(section_id, None) is not None and not section_postings:
+                del self.postings[term]
+    
+    def sync(self, sections: List[Dict], content_loader=None) -> Dict[str, int]:
+        """
+        Приводит индекс в соответствие со списком разделов, возвращает число
+        изменений. content_loader(разделы) -> {ID: текст} подгружает тексты
+        разделов, загруженных без них (ленивый режим).
+        """
+        current = {section.get("id"): section for section in sections}
+        removed = self.section_ids - set(current)
+        added = set(current) - self.section_ids
+        
+        if removed:
+            # Удаляем пачкой за один проход по словарю термов
+            for section_id in removed:
+                self.total_length -= self.doc_lengths.pop(section_id, 0)
+            for term in list(self.postings):
+                section_postings = self.postings[term]
+                for section_id in removed.intersection(section_postings):
+                    del section_postings[section_id]
+                if not section_postings:
+                    del self.postings[term]
+        
+        missing = [current[i] for i in added if "content" not in current[i]]
+        loaded = content_loader(missing) if missing and content_loader else {}
+        
+        for section_id in added:
+            section = current[section_id]
+            content = section["content"] if "content" in section else loaded.get(section_id, "")
+            self.add_section(section_id, section.get("title", ""), content)
+        
+        return {"added": len(added), "removed": len(removed)}
+    
+    def search(self, query: str, limit: int = 200) -> List[tuple]:
+        """Возвращает [(ID раздела, оценка BM25)] по убыванию релевантности"""
+        query_terms = set(analyze_text(query))
+        if not query_terms or not self.doc_lengths:
+            return []
+        
+        total_docs = len(self.doc_lengths)
+        average_length = self.total_length / total_docs
+        scores = {}
+        
+        for term in query_terms:
+            section_postings = self.postings.get(term)
+            if not section_postings:
+                continue
+            
+            idf = math.log(1 + (total_docs - len(section_postings) + 0.5) / (len(section_postings) + 0.5))
+            for section_id, frequency in section_postings.items():
+                norm = self.K1 * (1 - self.B + self.B * self.doc_lengths[section_id] / average_length)
+                scores[section_id] = scores.get(section_id, 0.0) + idf * frequency * (self.K1 + 1) / (frequency + norm)
+        
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+    
+    def snippet(self, content: str, query: str) -> str:
+        """
+        Фрагмент текста вокруг совпадения с самым редким термом запроса
+        (все совпадения во фрагменте выделены **...**)
+        """
+        stems = sorted(set(analyze_text(query)), key=len, reverse=True)
+        if not content or not stems:
+            return ""
+        
+        pattern = re.compile(
+            r'(?<!\w)(' + '|'.join(re.escape(stem) for stem in stems) + r')\w*',
+            re.IGNORECASE
+        )
+        # Ищем по нормализованному тексту (ё→е), длина строки при этом не меняется
+        normalized = content.replace('ё', 'е').replace('Ё', 'Е')
+        
+        match = None
+        for stem in sorted(stems, key=lambda term: len(self.postings.get(term, {}))):
+            match = re.search(r'(?<!\w)' + re.escape(stem) + r'\w*', normalized, re.IGNORECASE)
+            if match:
+                break
+        if not match:
+            return ""
+        
+        start = max(0, match.start() - self.SNIPPET_RADIUS)
+        end = min(len(content), match.end() + self.SNIPPET_RADIUS)
+        
+        parts = []
+        position = start
+        for hit in pattern.finditer(normalized, start, end):
+            if hit.end() > end:
+                break
+            parts.append(content[position:hit.start()])
+            parts.append(f"**{content[hit.start():hit.end()]}**")
+            position = hit.end()
+        parts.append(content[position:end])
+        fragment = "".join(parts).replace('\n', ' ')
+        
+        return ("…" if start > 0 else "") + fragment.strip() + ("…" if end < len(content) else "")
+    
+    def to_dict(self) -> Dict:
+        return {
+            "version": self.VERSION,
+            "doc_lengths": self.doc_lengths,
+            "postings": self.postings
+        }
+    
+    @classmethod
+    def from_dict(cls, data: Dict) -> "SectionSearchIndex":
+        index = cls()
+        if data.get("version") != cls.VERSION:
+            return index
+        index.doc_lengths = data.get("doc_lengths", {})
+        index.postings = data.get("postings", {})
+        index.total_length = sum(index.doc_lengths.values())
+        return index
+
+
+class SectionVectorIndex:
+    """
+    Векторный индекс TF-IDF для подбора разделов по описанию вопроса.
+    
+    Строится из частот термов поискового индекса (те же стеммы, заголовок
+    с повышенным весом), поэтому тексты разделов повторно не читаются.
+    Векторы разделов нормированы и хранятся по столбцам-термам в массивах
+    NumPy (indptr/rows/weights, как в разреженной матрице CSC): косинусная
+    близость к запросу - сумма весов только по столбцам термов запроса.
+    Сохраняется рядом с базой в vector_index.npz.
+    """
+    
+    VERSION = 1
+    
+    def __init__(self):
+        self.section_ids = np.array([], dtype=str)
+        self.terms: Dict[str, int] = {}
+        self.idf = np.zeros(0)
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.rows = np.zeros(0, dtype=np.int32)
+        self.weights = np.zeros(0, dtype=np.float32)
+    
+    def __len__(self) -> int:
+        return len(self.section_ids)
+    
+    @classmethod
+    def build(cls, search_index: SectionSearchIndex) -> "SectionVectorIndex":
+        """Строит индекс из частот термов поискового индекса"""
+        index = cls()
+        section_ids = sorted(search_index.doc_lengths)
+        positions = {section_id: position for position, section_id in enumerate(section_ids)}
+        terms = sorted(search_index.postings)
+        
+        counts = [len(search_index.postings[term]) for term in terms]
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        rows = np.fromiter(
+            (positions[section_id] for term in terms for section_id in search_index.postings[term]),
+            dtype=np.int32, count=int(indptr[-1])
+        )
+        frequencies = np.fromiter(
+            (frequency for term in terms for frequency in search_index.postings[term].values()),
+            dtype=np.float64, count=int(indptr[-1])
+        )
+        
+        # Сглаженный idf и логарифмическая частота терма
+        total = len(section_ids)
+        idf = np.log((1 + total) / (1 + np.asarray(counts, dtype=np.float64))) + 1
+        weights = (1 + np.log(frequencies)) * np.repeat(idf, counts)
+        norms = np.sqrt(np.bincount(rows, weights=weights ** 2, minlength=total))
+        weights /= np.where(norms > 0, norms, 1)[rows]
+        
+        index.section_ids = np.array(section_ids, dtype=str)
+        index.terms = {term: position for position, term in enumerate(terms)}
+        index.idf = idf
+        index.indptr = indptr
+        index.rows = rows
+        index.weights = weights.astype(np.float32)
+        return index
+    
+    def recommend(self, question: str, limit: int = 50) -> List[tuple]:
+        """Возвращает [(ID раздела, косинусная близость)] по убыванию близости"""
+        frequencies = {}
+        for term in analyze_text(question):
+            if term in self.terms:
+                frequencies[term] = frequencies.get(term, 0) + 1
+        if not frequencies or not len(self):
+            return []
+        
+        columns = np.array([self.terms[term] for term in frequencies])
+        query = (1 + np.log(np.array(list(frequencies.values()), dtype=np.float64))) * self.idf[columns]
+        query /= np.linalg.norm(query)
+        
+        scores = np.zeros(len(self), dtype=np.float64)
+        for column, weight in zip(columns, query):
+            start, end = self.indptr[column], self.indptr[column + 1]
+            scores[self.rows[start:end]] += weight * self.weights[start:end]
+        
+        found = np.flatnonzero(scores)
+        if len(found) > limit:
+            found = found[np.argpartition(-scores[found], limit - 1)[:limit]]
+        found = found[np.argsort(-scores[found], kind="stable")]
+        return [(str(self.section_ids[i]), float(scores[i])) for i in found]
+    
+    def save(self, path: Path):
+        """Атомарно сохраняет индекс в файл .npz"""
+        tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.savez(
+                    f,
+                    version=np.array(self.VERSION),
+                    section_ids=self.section_ids,
+                    terms=np.array(list(self.terms), dtype=str),
+                    idf=self.idf,
+                    indptr=self.indptr,
+                    rows=self.rows,
+                    weights=self.weights
+                )
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+    
+    @classmethod
+    def load(cls, path: Path) -> "SectionVectorIndex":
+        index = cls()
+        with np.load(path, allow_pickle=False) as data:
+            if int(data["version"]) != cls.VERSION:
+                return index
+            index.section_ids = data["section_ids"]
+            index.terms = {str(term): position for position, term in enumerate(data["terms"])}
+            index.idf = data["idf"]
+            index.indptr = data["indptr"]
+            index.rows = data["rows"]
+            index.weights = data["weights"]
+        return index
+
+
+class SectionDuplicateIndex:
+    """
+    Поиск повторяющихся и почти одинаковых разделов (разные редакции одного
+    документа, длинные повторы в выгрузках) методом MinHash + LSH.
+    
+    Текст раздела превращается в множество шинглов - хэшей подряд идущих слов,
+    множество - в подпись из NUM_PERM минимумов случайных хэш-функций: доля
+    совпавших позиций подписей оценивает сходство Жаккара двух разделов.
+    Подписи делятся на BANDS полос; разделы, совпавшие хотя бы в одной полосе,
+    становятся кандидатами и сравниваются с первым разделом своей корзины,
+    поэтому время растет почти линейно с числом разделов, а не квадратично.
+    Кандидаты объединяются по цепочкам сходства, поэтому каждая группа затем
+    проверяется по основному разделу: в ней остаются только разделы со
+    сходством с ним не ниже порога, остальные группируются заново между собой.
+    Подписи считаются только для новых разделов и хранятся в duplicates.npz,
+    группы повторов пересчитываются по подписям.
+    """
+    
+    VERSION = 1
+    SHINGLE_WORDS = 5
+    NUM_PERM = 128
+    BANDS = 32
+    SEED = 20240101
+    PRIME = 4294967311  # простое число больше 2^32
+    
+    def __init__(self, threshold: float = 0.8, min_words: int = 30):
+        self.threshold = threshold
+        self.min_words = min_words
+        self.signatures: Dict[str, np.ndarray] = {}
+        self.short_ids: set = set()  # разделы, слишком короткие для подписи
+        # ID раздела → ID основного раздела группы; основной раздел → вся группа
+        self.duplicate_of: Dict[str, str] = {}
+        self.groups: Dict[str, List[str]] = {}
+        self.similarity: Dict[str, float] = {}
+        
+        rng = np.random.default_rng(self.SEED)
+        self._a = rng.integers(1, 2 ** 31, self.NUM_PERM, dtype=np.uint64)[:, None]
+        self._b = rng.integers(0, 2 ** 32, self.NUM_PERM, dtype=np.uint64)[:, None]
+    
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        """Подпись MinHash текста или None для слишком короткого текста"""
+        words = TOKEN_PATTERN.findall(text.lower().replace('ё', 'е'))
+        if len(words) < max(self.min_words, self.SHINGLE_WORDS):
+            return None
+        
+        word_hashes = np.fromiter((zlib.crc32(word.encode('utf-8')) for word in words),
+                                  dtype=np.uint64, count=len(words))
+        count = len(words) - self.SHINGLE_WORDS + 1
+        shingles = np.zeros(count, dtype=np.uint64)
+        for offset in range(self.SHINGLE_WORDS):
+            shingles = (shingles * np.uint64(1000003) + word_hashes[offset:offset + count]) & np.uint64(0xFFFFFFFF)
+        shingles = np.unique(shingles)
+        
+        signature = np.full(self.NUM_PERM, np.iinfo(np.uint64).max, dtype=np.uint64)
+        for start in range(0, len(shingles), 4096):
+            hashed = (self._a * shingles[start:start + 4096] + self._b) % np.uint64(self.PRIME)
+            np.minimum(signature, hashed.min(axis=1), out=signature)
+        return signature.astype(np.uint32)
+    
+    def copy(self) -> "SectionDuplicateIndex":
+        """Копия для обновления без блокировки базы (подписи общие, они не меняются)"""
+        index = copy.copy(self)
+        index.signatures = dict(self.signatures)
+        index.short_ids = set(self.short_ids)
+        return index
+    
+    def sync(self, sections: List[Dict], content_loader=None) -> Dict[str, int]:
+        """
+        Досчитывает подписи новых разделов и убирает подписи исчезнувших,
+        затем пересчитывает группы. Возвращает число изменений.
+        """
+        current = {section.get("id"): section for section in sections}
+        known = set(self.signatures) | self.short_ids
+        removed = known - set(current)
+        added = set(current) - known
+        
+        for section_id in removed:
+            self.signatures.pop(section_id, None)
+        
+        missing = [current[i] for i in added if "content" not in current[i]]
+        loaded = content_loader(missing) if missing and content_loader else {}
+        for section_id in added:
+            section = current[section_id]
+            content = section["content"] if "content" in section else loaded.get(section_id, "")
+            signature = self.signature(content)
+            if signature is not None:
+                self.signatures[section_id] = signature
+        
+        self.short_ids = set(current) - set(self.signatures)
+        self.build_groups(sections)
+        return {"added": len(added), "removed": len(removed)}
+    
+    def build_groups(self, sections: List[Dict]):
+        """Группирует разделы с оценкой сходства не ниже порога (порядок разделов - как в базе)"""
+        order = [section.get("id") for section in sections if section.get("id") in self.signatures]
+        sizes = {section.get("id"): ExpertFileGenerator.section_tokens(section) for section in sections}
+        self.duplicate_of, self.groups, self.similarity = {}, {}, {}
+        if len(order) < 2:
+            return
+        
+        matrix = np.stack([self.signatures[section_id] for section_id in order])
+        rows = self.NUM_PERM // self.BANDS
+        parents = list(range(len(order)))
+        
+        def find(i):
+            while parents[i] != i:
+                parents[i] = parents[parents[i]]
+                i = parents[i]
+            return i
+        
+        for band in range(self.BANDS):
+            buckets = {}
+            for i, key in enumerate(map(bytes, matrix[:, band * rows:(band + 1) * rows])):
+                buckets.setdefault(key, []).append(i)
+            for members in buckets.values():
+                first = members[0]
+                for i in members[1:]:
+                    if find(i) != find(first) and np.mean(matrix[i] == matrix[first]) >= self.threshold:
+                        parents[find(i)] = find(first)
+        
+        clusters = {}
+        for i in range(len(order)):
+            clusters.setdefault(find(i), []).append(i)
+        
+        for members in clusters.values():
+            while len(members) >= 2:
+                # Основной раздел группы - самый полный (при равенстве - первый в базе)
+                main = max(members, key=lambda i: (sizes.get(order[i], 0), -i))
+                scores = np.mean(matrix[members] == matrix[main], axis=1)
+                group = [i for i, score in zip(members, scores) if i == main or score >= self.threshold]
+                members = [i for i, score in zip(members, scores) if i != main and score < self.threshold]
+                if len(group) < 2:
+                    continue
+                
+                self.groups[order[main]] = [order[main]] + [order[i] for i in group if i != main]
+                for i, score in zip(group, np.mean(matrix[group] == matrix[main], axis=1)):
+                    self.duplicate_of[order[i]] = order[main]
+                    self.similarity[order[i]] = float(score)
+    
+    def save(self, path: Path):
+        """Атомарно сохраняет подписи разделов в файл .npz"""
+        section_ids = list(self.signatures)
+        tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.savez(
+                    f,
+                    version=np.array(self.VERSION),
+                    min_words=np.array(self.min_words),
+                    section_ids=np.array(section_ids, dtype=str),
+                    short_ids=np.array(sorted(self.short_ids), dtype=str),
+                    signatures=(np.stack([self.signatures[i] for i in section_ids]) if section_ids
+                                else np.zeros((0, self.NUM_PERM), dtype=np.uint32))
+                )
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+    
+    def load(self, path: Path):
+        """Загружает подписи (группы пересчитываются при sync)"""
+        with np.load(path, allow_pickle=False) as data:
+            if int(data["version"]) != self.VERSION or int(data["min_words"]) != self.min_words:
+                return
+            self.signatures = {
+                str(section_id): signature
+                for section_id, signature in zip(data["section_ids"], data["signatures"])
+            }
+            self.short_ids = {str(section_id) for section_id in data["short_ids"]}
+
+# ==============================================
+# ССЫЛКИ МЕЖДУ РАЗДЕЛАМИ НОРМАТИВНЫХ АКТОВ
+# ==============================================
+
+class SectionCitationIndex:
+    """
+    Граф ссылок между разделами: "в соответствии со статьей 39.20 настоящего
+    Кодекса", "статьи 26 Федерального закона от 13.07.2015 N 218-ФЗ".
+    
+    При сканировании из каждого раздела извлекаются ссылки на статьи (номер
+    статьи и признаки документа: "настоящего ...", номер закона, название
+    кодекса или закона), номера статей, заголовки которых есть в разделе, и
+    признаки самого документа (по первому разделу). Извлеченное хранится по
+    ID разделов в citations.json и досчитывается только для новых разделов.
+    По ним строятся словари "раздел → разделы статей, на которые он ссылается"
+    и обратный, поэтому ссылки раздела и добавление статей по ссылкам - это
+    поиск по словарю, а не просмотр текстов. Ссылки на статьи без указания
+    документа ("статьи 55") не учитываются: в выгрузках это обычно остатки
+    пометок о редакциях.
+    """
+    
+    VERSION = 1
+    
+    ARTICLE_REFERENCE = re.compile(
+        r'(?<!\w)стать(?:я|и|е|ей|ю|ям|ями|ях)[^\S\n]+'
+        r'(?P<numbers>\d+(?:\.\d+)*(?:[^\S\n]*(?:,|и|или|-|–)[^\S\n]*\d+(?:\.\d+)*)*)'
+        r'(?P<target>[^\S\n]*(?:'
+        r'(?P<self>настоящ(?:его|им|ему|ем)[^\S\n]+(?:Кодекса|Федерального[^\S\n]+закона|Закона))'
+        r'|(?P<code>[А-Я][а-я]+)[^\S\n]+кодекса'
+        r'|Федерального[^\S\n]+закона(?:[^\S\n]+от[^"\n]{0,40}?N[^\S\n]*(?P<number>\d+-ФЗ))?'
+        r'(?:[^\S\n]*"(?P<title>[^"\n]{3,200})")?'
+        r'))?'
+    )
+    LAW_NUMBER = re.compile(r'N[^\S\n]*(\d+-ФЗ)')
+    CODE_NAME = re.compile(r'([А-Яа-яЁё]+)(?:ый|ий|ЫЙ|ИЙ)[^\S\n]+(?:кодекс|КОДЕКС)')
+    QUOTED_TITLE = re.compile(r'"([^"\n]{5,300})"')
+    ARTICLE_HEADER = re.compile(r'^Статья[^\S\n]+(\d+(?:\.\d+)*)', re.MULTILINE)
+    HEAD_CHARS = 600
+    MAX_RANGE = 50
+    
+    def __init__(self):
+        self.entries: Dict[str, Dict] = {}
+        self.cites: Dict[str, List[str]] = {}
+        self.cited_by: Dict[str, List[str]] = {}
+        self.external: Dict[str, List[str]] = {}  # ссылки на статьи документов, которых нет в базе
+    
+    def copy(self) -> "SectionCitationIndex":
+        """Копия для обновления без блокировки базы (граф строится заново при sync)"""
+        index = copy.copy(self)
+        index.entries = dict(self.entries)
+        return index
+    
+    @staticmethod
+    def _alias_title(title: str) -> str:
+        return "title:" + " ".join(title.lower().replace('ё', 'е').split())
+    
+    @classmethod
+    def _numbers(cls, text: str) -> List[str]:
+        """Номера статей из перечня: "39.3, 39.6 и 39.20", "94 - 100" """
+        numbers = []
+        parts = re.split(r'[^\S\n]*(,|и|или|-|–)[^\S\n]*', text)
+        for i in range(0, len(parts), 2):
+            number = parts[i]
+            if i >= 2 and parts[i - 1] in ('-', '–') and number.isdigit() and numbers and numbers[-1].isdigit():
+                start = int(numbers[-1])
+                if 0 < int(number) - start <= cls.MAX_RANGE:
+                    numbers.extend(str(n) for n in range(start + 1, int(number) + 1))
+                    continue
+            numbers.append(number)
+        return numbers
+    
+    @classmethod
+    def extract(cls, title: str, content: str) -> Dict:
+        """Ссылки раздела, номера статей с заголовками в разделе и признаки документа по началу текста"""
+        references = []
+        for match in cls.ARTICLE_REFERENCE.finditer(content):
+            if match.group("self"):
+                aliases = ["self"]
+            else:
+                aliases = []
+                if match.group("code"):
+                    aliases.append("code:" + stem_russian_word(match.group("code").lower()))
+                if match.group("number"):
+                    aliases.append("law:" + match.group("number"))
+                if match.group("title"):
+                    aliases.append(cls._alias_title(match.group("title")))
+            if not aliases:
+                continue
+            for number in cls._numbers(match.group("numbers")):
+                reference = [number, aliases]
+                if reference not in references:
+                    references.append(reference)
+        
+        title_article = cls.ARTICLE_HEADER.match(title)
+        head = content[:cls.HEAD_CHARS]
+        document_aliases = [f"law:{number}" for number in cls.LAW_NUMBER.findall(f"{title}\n{head}")[:1]]
+        document_aliases += ["code:" + stem_russian_word(name.lower()) for name in cls.CODE_NAME.findall(head)[:1]]
+        document_aliases += [cls._alias_title(name) for name in cls.QUOTED_TITLE.findall(f"{title}\n{head}")[:1]]
+        
+        return {
+            "references": references,
+            "article": title_article.group(1) if title_article else "",
+            "articles": cls.ARTICLE_HEADER.findall(content),
+            "aliases": document_aliases
+        }
+    
+    def sync(self, sections: List[Dict], content_loader=None) -> Dict[str, int]:
+        """Извлекает ссылки новых разделов, убирает исчезнувшие и перестраивает граф"""
+        current = {section.get("id"): section for section in sections}
+        removed = set(self.entries) - set(current)
+        added = set(current) - set(self.entries)
+        
+        for section_id in removed:
+            del self.entries[section_id]
+        
+        missing = [current[i] for i in added if "content" not in current[i]]
+        loaded = content_loader(missing) if missing and content_loader else {}
+        for section_id in added:
+            section = current[section_id]
+            content = section["content"] if "content" in section else loaded.get(section_id, "")
+            self.entries[section_id] = self.extract(section.get("title", ""), content)
+        
+        self.build_graph(sections)
+        return {"added": len(added), "removed": len(removed)}
+    
+    def build_graph(self, sections: List[Dict]):
+        """Сопоставляет ссылкам разделы статей и строит прямой и обратный словари"""
+        documents = {}  # признак документа → пути документов (по порядку базы)
+        articles = {}  # (путь документа, номер статьи) → ID раздела
+        seen_paths = set()
+        for section in sections:
+            entry = self.entries.get(section.get("id"))
+            if entry is None:
+                continue
+            path = section.get("document_path", "")
+            if path not in seen_paths:
+                # Признаки документа берутся из его первого раздела
+                seen_paths.add(path)
+                for alias in entry["aliases"]:
+                    documents.setdefault(alias, {})[path] = True
+            if entry["article"]:
+                articles[(path, entry["article"])] = section["id"]
+            for number in entry["articles"]:
+                articles.setdefault((path, number), section["id"])
+        
+        self.cites, self.cited_by, self.external = {}, {}, {}
+        for section in sections:
+            section_id = section.get("id")
+            entry = self.entries.get(section_id)
+            if not entry or not entry["references"]:
+                continue
+            
+            targets = []
+            for number, aliases in entry["references"]:
+                paths = []
+                for alias in aliases:
+                    paths = [section.get("document_path", "")] if alias == "self" else list(documents.get(alias, {}))
+                    if paths:
+                        break
+                if not paths:
+                    self.external.setdefault(section_id, []).append(
+                        f"ст. {number} {aliases[0].split(':', 1)[1]}"
+                    )
+                    continue
+                for path in paths:
+                    target = articles.get((path, number))
+                    if target and target != section_id and target not in targets:
+                        targets.append(target)
+            
+            if targets:
+                self.cites[section_id] = targets
+                for target in targets:
+                    self.cited_by.setdefault(target, []).append(section_id)
+    
+    def expand(self, section_ids, depth: int = 1) -> set:
+        """Разделы статей, на которые ссылаются указанные разделы, до глубины depth (без самих разделов)"""
+        seen = set(section_ids)
+        frontier = list(seen)
+        for _ in range(depth):
+            next_frontier = []
+            for section_id in frontier:
+                for target in self.cites.get(section_id, ()):
+                    if target not in seen:
+                        seen.add(target)
+                        next_frontier.append(target)
+            frontier = next_frontier
+        return seen - set(section_ids)
+    
+    def to_dict(self) -> Dict:
+        return {"version": self.VERSION, "sections": self.entries}
+    
+    @classmethod
+    def from_dict(cls, data: Dict) -> "SectionCitationIndex":
+        index = cls()
+        if data.get("version") == cls.VERSION:
+            index.entries = data.get("sections", {})
+        return index
+
+# ==============================================
+# ОЧИСТКА ТЕКСТА
+# ==============================================
+
+class TextCleaner:
+    """
+    Очистка текста документов с заранее скомпилированными выражениями.
+    
+    Нормализация убирает служебные символы и лишние пробелы быстрыми
+    строковыми операциями, регулярное выражение запускается, только если
+    такие символы в тексте есть. Правила удаления комментариев
+    (cleaning_rules) одного прохода применяются за один просмотр текста как
+    альтернатива: в каждой позиции срабатывает первое по порядку правило.
+    Кандидаты ищутся по буквальному началу правила (str.find в тексте в нижнем
+    регистре), а выражение проверяется только в этих позициях - IGNORECASE с
+    кириллицей иначе лишает re быстрого поиска префикса. Собирается
+    статистика срабатываний и времени по правилам и этапам.
+    """
+    
+    FLAGS = re.IGNORECASE | re.DOTALL
+    
+    # Мягкий перенос и скрытые символы форматирования удаляются
+    HIDDEN_CHARS = [chr(code) for code in [*range(0x00, 0x09), 0x0B, 0x0C, *range(0x0E, 0x20), 0x7F, 0xAD]]
+    HIDDEN_PATTERN = re.compile('[' + re.escape(''.join(HIDDEN_CHARS)) + ']+')
+    # Литеральное начало "  " позволяет re искать серии пробелов без проверки каждой позиции
+    SPACES = re.compile(r'  +')
+    
+    def __init__(self, rules: Optional[List[Dict]] = None):
+        self.rules = []
+        for rule in (DEFAULT_CLEANING_RULES if rules is None else rules):
+            if not rule.get("enabled", True):
+                continue
+            name = rule.get("name") or f"rule_{len(self.rules) + 1}"
+            try:
+                regex = re.compile(rule["pattern"], self.FLAGS)
+            except (KeyError, re.error) as e:
+                print(f"⚠ Правило очистки {name} пропущено: {e}")
+                continue
+            prefix = self._literal_prefix(rule["pattern"]).lower()
+            self.rules.append({
+                "name": name,
+                "pattern": rule["pattern"],
+                "regex": regex,
+                "prefix": prefix,
+                "contains": (rule.get("contains") or prefix).lower(),
+                "pass": rule.get("pass", 1)
+            })
+        
+        # Номера правил по проходам
+        self.passes = []
+        for number in sorted({rule["pass"] for rule in self.rules}):
+            self.passes.append([i for i, rule in enumerate(self.rules) if rule["pass"] == number])
+        
+        self._combined: Dict[tuple, re.Pattern] = {}
+        self.reset_stats()
+    
+    @staticmethod
+    def _literal_prefix(pattern: str) -> str:
+        """
+        Буквальное начало выражения, с которого начинается любое совпадение:
+        обычные символы и экранированные знаки препинания до первой
+        конструкции (класс, группа, квантификатор). Пустая строка, если
+        выражение содержит альтернативу верхнего уровня.
+        """
+        depth = 0
+        in_class = False
+        i = 0
+        while i < len(pattern):
+            char = pattern[i]
+            if char == '\\':
+                i += 2
+                continue
+            if in_class:
+                in_class = char != ']'
+            elif char == '[':
+                in_class = True
+            elif char == '(':
+                depth += 1
+            elif char == ')':
+                depth -= 1
+            elif char == '|' and depth == 0:
+                return ""
+            i += 1
+        
+        prefix = []
+        i = 0
+        while i < len(pattern):
+            char = pattern[i]
+            if char == '\\' and i + 1 < len(pattern) and not pattern[i + 1].isalnum():
+                literal, step = pattern[i + 1], 2
+            elif char not in '\\.^$*+?{}[]|()':
+                literal, step = char, 1
+            else:
+                break
+            # Символ с квантификатором может отсутствовать в совпадении
+            if pattern[i + step:i + step + 1] in ('?', '*', '{'):
+                break
+            prefix.append(literal)
+            i += step
+        return ''.join(prefix)
+    
+    def fingerprint(self) -> str:
+        """Отпечаток набора правил: при его смене файлы обрабатываются заново"""
+        data = json.dumps([[r["pattern"], r["pass"]] for r in self.rules], ensure_ascii=False)
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()[:12]
+    
+    def reset_stats(self):
+        self.stats = {
+            "hits": {rule["name"]: 0 for rule in self.rules},
+            "rule_seconds": {rule["name"]: 0.0 for rule in self.rules},
+            "seconds": {"normalize": 0.0, "comments": 0.0}
+        }
+    
+    def merge_stats(self, stats: Dict):
+        """Добавляет статистику, собранную в другом процессе"""
+        for key, values in stats.items():
+            totals = self.stats.setdefault(key, {})
+            for name, value in values.items():
+                totals[name] = totals.get(name, 0) + value
+    
+    def report(self) -> str:
+        """Краткий отчет: время этапов, срабатывания и время правил"""
+        seconds = self.stats["seconds"]
+        rules = ", ".join(
+            f"{name} {count} ({self.stats['rule_seconds'].get(name, 0.0) * 1000:.0f} мс)"
+            for name, count in self.stats["hits"].items() if count
+        )
+        return (f"🧹 Очистка текста: нормализация {seconds['normalize']:.2f}с, "
+                f"комментарии {seconds['comments']:.2f}с; срабатывания: {rules or 'нет'}")
+    
+    def normalize(self, text: str) -> str:
+        """Убирает служебные символы, лишние пробелы и пустые строки"""
+        if not text:
+            return text
+        started = time.perf_counter()
+        if any(char in text for char in self.HIDDEN_CHARS):
+            text = self.HIDDEN_PATTERN.sub('', text)
+        text = self.SPACES.sub(' ', text.replace('\t', ' ').replace('\xa0', ' '))
+        lines = (line.strip() for line in text.split('\n'))
+        cleaned = '\n'.join(line for line in lines if line)
+        self.stats["seconds"]["normalize"] += time.perf_counter() - started
+        return cleaned
+    
+    def _pattern_for(self, active: tuple) -> re.Pattern:
+        """Объединенное выражение для набора правил (компилируется один раз)"""
+        pattern = self._combined.get(active)
+        if pattern is None:
+            pattern = re.compile(
+                '|'.join(f'(?P<r{i}>{self.rules[i]["pattern"]})' for i in active),
+                self.FLAGS
+            )
+            self._combined[active] = pattern
+        return pattern
+    
+    def _next_candidate(self, i: int, text: str, lowered: str, start: int) -> Optional[int]:
+        """Ближайшая позиция от start, где правило i может совпасть"""
+        rule = self.rules[i]
+        if rule["prefix"]:
+            found = lowered.find(rule["prefix"], start)
+            return found if found >= 0 else None
+        match = rule["regex"].search(text, start)
+        return match.start() if match else None
+    
+    def _apply_pass(self, text: str, lowered: str, active: tuple) -> tuple:
+        """
+        Один проход правил: то же, что sub по альтернативе правил active,
+        но выражения проверяются только в позициях-кандидатах. Возвращает
+        очищенный текст и его копию в нижнем регистре.
+        """
+        hits = self.stats["hits"]
+        rule_seconds = self.stats["rule_seconds"]
+        clock = time.perf_counter
+        
+        candidates = {}
+        for i in active:
+            started = clock()
+            candidates[i] = self._next_candidate(i, text, lowered, 0)
+            rule_seconds[self.rules[i]["name"]] += clock() - started
+        
+        parts = []
+        position = 0
+        while True:
+            positions = [start for start in candidates.values() if start is not None]
+            if not positions:
+                break
+            start = min(positions)
+            
+            matched = None
+            for i in active:
+                if candidates[i] != start:
+                    continue
+                started = clock()
+                match = self.rules[i]["regex"].match(text, start)
+                rule_seconds[self.rules[i]["name"]] += clock() - started
+                if match and match.end() > start:
+                    matched = match
+                    hits[self.rules[i]["name"]] += 1
+                    break
+            
+            if matched is None:
+                resume = start + 1
+            else:
+                parts.append((position, start))
+                position = resume = matched.end()
+            
+            for i in active:
+                if candidates[i] is not None and candidates[i] < resume:
+                    started = clock()
+                    candidates[i] = self._next_candidate(i, text, lowered, resume)
+                    rule_seconds[self.rules[i]["name"]] += clock() - started
+        
+        if not parts:
+            return text, lowered
+        parts.append((position, len(text)))
+        return (''.join(text[a:b] for a, b in parts),
+                ''.join(lowered[a:b] for a, b in parts))
+    
+    def remove_comments(self, text: str) -> str:
+        """Удаляет комментарии и служебные пометки по правилам, проход за проходом"""
+        if not text or not self.rules:
+            return text
+        started = time.perf_counter()
+        
+        lowered = text.lower()
+        for rule_numbers in self.passes:
+            active = tuple(i for i in rule_numbers if self.rules[i]["contains"] in lowered)
+            if not active:
+                continue
+            
+            if len(lowered) == len(text):
+                text, lowered = self._apply_pass(text, lowered, active)
+            else:
+                # Редкие символы меняют длину в нижнем регистре - позиции не совпадут
+                def remove(match):
+                    self.stats["hits"][self.rules[int(match.lastgroup[1:])]["name"]] += 1
+                    return ''
+                text = self._pattern_for(active).sub(remove, text)
+                lowered = text.lower()
+        
+        self.stats["seconds"]["comments"] += time.perf_counter() - started
+        return text
+    
+    @staticmethod
+    def format_for_output(text: str) -> str:
+        """Текст для файлов сессии: строки без лишних пробелов, абзацы через пустую строку"""
+        if not text:
+            return text
+        lines = (line.strip() for line in TextCleaner.SPACES.sub(' ', text).split('\n'))
+        return '\n\n'.join(line for line in lines if line)
+
+# ==============================================
+# РАЗБИЕНИЕ ДОКУМЕНТОВ НА РАЗДЕЛЫ
+# ==============================================
+
+# Разделители по типам папок: тип папки → класс разделителя
+SPLITTERS: Dict[str, type] = {}
+
+def register_splitter(folder_type: str):
+    """Регистрирует класс разделителя для типа папки"""
+    def decorator(cls):
+        SPLITTERS[folder_type] = cls
+        return cls
+    return decorator
+
+
+class DocumentSplitter:
+    """
+    Базовый разделитель документа по заголовкам.
+    
+    Все виды заголовков объединены в одно скомпилированное выражение,
+    которое ищет их по всему тексту через finditer, без цикла по строкам.
+    Выражение начинается с перевода строки: такой буквальный префикс re ищет
+    быстро, а проверка первого символа заголовка отсеивает остальные строки
+    до перебора альтернатив. Совпадение занимает строку заголовка целиком.
+    """
+    
+    # Виды заголовков: (тип, выражение от первого непробельного символа строки).
+    # Выражение не должно выходить за строку, пробел внутри строки - [^\S\n]
+    HEADERS: List[tuple] = []
+    # Символы, с которых может начинаться заголовок (пусто - без отсева)
+    FIRST_CHARS = ""
+    
+    def __init__(self):
+        self.pattern = self.compile_headers(self.HEADERS, self.FIRST_CHARS)
+    
+    @staticmethod
+    def compile_headers(headers: List[tuple], first_chars: str = "") -> Optional[re.Pattern]:
+        """Одно выражение для всех видов заголовков (имя группы - тип заголовка)"""
+        if not headers:
+            return None
+        prefilter = f'(?=[{re.escape(first_chars)}])' if first_chars else ''
+        alternatives = '|'.join(f'(?P<{header_type}>{pattern})' for header_type, pattern in headers)
+        return re.compile(r'\n[^\S\n]*' + prefilter + '(?:' + alternatives + r')[^\n]*', re.MULTILINE)
+    
+    def iter_headers(self, text: str):
+        """
+        Совпадения заголовков по порядку. Текст просматривается с добавленным
+        в начало переводом строки, поэтому match.start() - начало строки
+        заголовка в исходном тексте, а match.end() - 1 - ее конец.
+        """
+        if self.pattern is None:
+            return
+        for match in self.pattern.finditer('\n' + text):
+            if self.accept(match):
+                yield match
+    
+    def accept(self, match) -> bool:
+        """Дополнительная проверка найденного заголовка"""
+        return True
+    
+    @staticmethod
+    def header_line(match) -> str:
+        """Строка заголовка без пробелов по краям"""
+        return match.group(0).strip()
+    
+    @staticmethod
+    def strip_front_matter(content: str) -> str:
+        """Текст документа без YAML заголовка"""
+        if content.strip().startswith('---'):
+            parts = content.split('---', 2)
+            if len(parts) >= 3:
+                return parts[2].strip()
+        return content
+    
+    def split(self, content: str, doc_title: str) -> List[Dict]:
+        """Разбивает текст документа на разделы"""
+        if not content:
+            return [{
+                "title": doc_title,
+                "content": "",
+                "type": "empty_document"
+            }]
+        return self.split_text(self.strip_front_matter(content), doc_title)
+    
+    def section_header(self, match) -> tuple:
+        """Заголовок и тип раздела для найденной строки заголовка"""
+        return self.header_line(match), match.lastgroup
+    
+    def split_text(self, text: str, doc_title: str) -> List[Dict]:
+        """
+        Плоское разбиение: текст от заголовка до следующего заголовка. Раздел
+        без единой строки после заголовка (заголовки подряд) не создается.
+        """
+        sections = []
+        title, section_type = doc_title, "document"
+        body_start = 0
+        found = False
+        
+        for match in self.iter_headers(text):
+            line_start = match.start()
+            if line_start > body_start:
+                sections.append({
+                    "title": title,
+                    "content": text[body_start:line_start].strip(),
+                    "type": section_type
+                })
+            title, section_type = self.section_header(match)
+            body_start = match.end()  # начало строки после заголовка
+            found = True
+        
+        if not found or body_start <= len(text):
+            sections.append({
+                "title": title,
+                "content": text[body_start:].strip(),
+                "type": section_type
+            })
+        
+        if not sections:
+            sections.append({
+                "title": doc_title,
+                "content": text.strip(),
+                "type": "full_document"
+            })
+        
+        return sections
+
+
+@register_splitter("normative")
+class NormativeSplitter(DocumentSplitter):
+    """
+    Нормативные документы: по главам ("ГЛАВА"/"Глава" с номером) или
+    иерархически (normative_split_mode).
+    """
+    
+    HEADERS = [
+        ("chapter", r'(?:ГЛАВА|Глава)[^\S\n]+[IVXLCDM\d]+(?:[.\-:]|[^\S\n]+\S).*'),
+    ]
+    FIRST_CHARS = "Г"
+    
+    # Уровни иерархии нормативного акта: Раздел → Глава → Статья → часть/пункт
+    # (тип, первые символы заголовка, выражение)
+    HIERARCHY_LEVELS = [
+        ("division", "Р", r'(?:РАЗДЕЛ|Раздел)[^\S\n]+[IVXLCDM\d]+(?:\.\d+)*(?:(?:[^\S\n]|[.\-:]).*)?$'),
+        ("chapter", "Г", r'(?:ГЛАВА|Глава)[^\S\n]+[IVXLCDM\d]+(?:\.\d+)*(?:[.\-:]|[^\S\n]+\S).*'),
+        ("article", "С", r'(?P<article_number>Статья[^\S\n]+\d+(?:\.\d+)*)(?:(?:[^\S\n]|[.\-:]).*)?$'),
+        ("part", "0123456789", r'(?P<part_number>\d+(?:\.\d+)*)\.[^\S\n]+\S'),
+    ]
+    # Глубина разбиения для режимов normative_split_mode (индекс последнего уровня)
+    HIERARCHY_DEPTH = {"article": 2, "part": 3}
+    
+    def __init__(self):
+        super().__init__()
+        self.hierarchy_patterns = {}
+        for mode, depth in self.HIERARCHY_DEPTH.items():
+            levels = self.HIERARCHY_LEVELS[:depth + 1]
+            self.hierarchy_patterns[mode] = self.compile_headers(
+                [(section_type, pattern) for section_type, _, pattern in levels],
+                "".join(first_chars for _, first_chars, _ in levels)
+            )
+    
+    def split_text(self, text: str, doc_title: str) -> List[Dict]:
+        split_mode = CONFIG.get("normative_split_mode", "chapter")
+        if split_mode in self.hierarchy_patterns:
+            return self.split_hierarchy(text, doc_title, self.hierarchy_patterns[split_mode])
+        return super().split_text(text, doc_title)
+    
+    def split_hierarchy(self, text: str, doc_title: str, pattern: re.Pattern) -> List[Dict]:
+        """
+        Иерархическое разделение: Раздел → Глава → Статья (→ часть/пункт в
+        режиме "part"). Каждый узел содержит только свой текст до первого
+        вложенного узла, а в поле "parent" - индекс родительского узла.
+        """
+        level_of = {section_type: level for level, (section_type, _, _) in enumerate(self.HIERARCHY_LEVELS)}
+        
+        # Текст до первого заголовка - преамбула документа
+        sections = [{
+            "title": doc_title,
+            "type": "document",
+            "level": 0,
+            "parent": None,
+            "parent_path": "",
+            "body_start": 0
+        }]
+        bounds = []  # (начало текста узла, конец текста узла)
+        stack = []  # (уровень, индекс узла) от корня к текущему узлу
+        article_title = ""
+        
+        for match in pattern.finditer('\n' + text):
+            section_type = match.lastgroup
+            
+            # Части выделяем только внутри статей
+            if section_type == "part" and not (stack and sections[stack[-1][1]]["type"] in ("article", "part")):
+                continue
+            
+            line_start = match.start()
+            bounds.append((sections[-1]["body_start"], line_start))
+            
+            level = level_of[section_type]
+            while stack and stack[-1][0] >= level:
+                stack.pop()
+            
+            if section_type == "part":
+                title = f"{article_title} ч. {match.group('part_number')}"
+                body_start = line_start  # строка части - начало ее текста
+            else:
+                title = self.header_line(match)
+                body_start = match.end()
+                if section_type == "article":
+                    article_title = match.group('article_number')
+            
+            sections.append({
+                "title": title,
+                "type": section_type,
+                "level": len(stack),
+                "parent": stack[-1][1] if stack else None,
+                "parent_path": " › ".join(sections[index]["title"] for _, index in stack),
+                "body_start": body_start
+            })
+            stack.append((level, len(sections) - 1))
+        
+        bounds.append((sections[-1]["body_start"], len(text)))
+        for section, (start, end) in zip(sections, bounds):
+            del section["body_start"]
+            section["content"] = text[start:end].strip()
+        
+        # Пустая преамбула без вложенных узлов не нужна
+        if not sections[0]["content"] and len(sections) > 1:
+            sections = sections[1:]
+            for section in sections:
+                if section["parent"] is not None:
+                    section["parent"] -= 1
+        
+        return sections
+
+
+@register_splitter("methodology")
+class MethodologySplitter(DocumentSplitter):
+    """Методические документы: заголовки 1 и 2 уровня markdown"""
+    
+    HEADERS = [
+        ("h1", r'#[^\S\n]+(?P<h1_title>\S.*)'),
+        ("h2", r'##[^\S\n]+(?P<h2_title>\S.*)'),
+    ]
+    FIRST_CHARS = "#"
+    
+    def section_header(self, match) -> tuple:
+        section_type = match.lastgroup
+        return match.group(f"{section_type}_title").rstrip(), section_type
+
+
+@register_splitter("structured")
+class StructuredSplitter(DocumentSplitter):
+    """Структурированные документы: заголовки в квадратных скобках"""
+    
+    HEADERS = [
+        ("bracketed_section", r'\[(?P<bracket_title>[^\[\]\n]+)\][^\S\n]*$'),
+    ]
+    FIRST_CHARS = "["
+    LETTER = re.compile(r'[А-Яа-яЁёA-Za-z]')
+    
+    def accept(self, match) -> bool:
+        # Заголовок должен быть не слишком длинным и содержать осмысленный
+        # текст (не только цифры или служебные символы)
+        header = match.group("bracket_title").strip()
+        return 3 < len(header) <= 200 and self.LETTER.search(header) is not None
+    
+    def section_header(self, match) -> tuple:
+        return match.group("bracket_title").strip(), "bracketed_section"
+
+
+@register_splitter("expertise")
+class ExpertiseSplitter(DocumentSplitter):
+    """Экспертные документы сохраняем полностью без разделения"""
+    
+    def split_text(self, text: str, doc_title: str) -> List[Dict]:
+        return [{
+            "title": doc_title,
+            "content": text.strip(),
+            "type": "expertise_document"
+        }]
+
+
+class ConfigSplitter(DocumentSplitter):
+    """
+    Разделитель, описанный в config.json (splitters → тип папки), без кода:
+    виды заголовков с уровнями, формат названия раздела и собственные
+    ограничения размера разделов. Заголовки ищутся тем же одним выражением через
+    finditer, что и у встроенных разделителей.
+    
+    Если у заголовков есть уровни больше 0, разделы получают уровень и
+    ссылку на родителя, как при иерархическом разбиении нормативных актов;
+    иначе разбиение плоское и пустые разделы отбрасываются.
+    """
+    
+    GROUP_NAME = re.compile(r'\(\?P([<=])(\w+)')
+    
+    def __init__(self, folder_type: str, rules: Dict):
+        self.folder_type = folder_type
+        self.headers = []
+        patterns = []
+        for number, header in enumerate(rules.get("headers", []), 1):
+            group = f"h{len(self.headers)}"
+            try:
+                # Имена групп пользователя уникальны только внутри своего заголовка
+                pattern = self.GROUP_NAME.sub(
+                    lambda m: f"(?P{m.group(1)}{group}_{m.group(2)}", header["pattern"]
+                )
+                re.compile(pattern)
+            except (KeyError, TypeError, re.error) as e:
+                print(f"⚠ Заголовок {number} разделителя {folder_type} пропущен: {e}")
+                continue
+            self.headers.append({
+                "group": group,
+                "type": header.get("type", "section"),
+                "level": int(header.get("level", 0)),
+                "title": header.get("title", "{line}"),
+                "include_header": bool(header.get("include_header", False)),
+                "inside": header.get("inside", [])
+            })
+            patterns.append((group, pattern))
+        
+        self.pattern = self.compile_headers(patterns, rules.get("first_chars", ""))
+        self.hierarchical = any(header["level"] > 0 for header in self.headers)
+        self.document_type = rules.get("document_type", "document")
+        # Свои ограничения размера разделов вместо общих section_max_tokens/section_min_tokens
+        self.size_normalizer = None
+        if "max_tokens" in rules or "min_tokens" in rules:
+            self.size_normalizer = SectionSizeNormalizer(
+                rules.get("max_tokens", 0) if rules.get("split_large", True) else 0,
+                rules.get("min_tokens", 0) if rules.get("merge_small", True) else 0
+            )
+    
+    def accept(self, match) -> bool:
+        # Выражение пользователя с \s может захватить перевод строки - такой заголовок не считается
+        return '\n' not in match.group(0)[1:]
+    
+    def section_title(self, header: Dict, match) -> str:
+        """Название раздела по формату title: {line} - строка заголовка, {имя} - группа выражения"""
+        prefix = header["group"] + "_"
+        values = {
+            name[len(prefix):]: (value or "").strip()
+            for name, value in match.groupdict().items() if name.startswith(prefix)
+        }
+        try:
+            return header["title"].format(line=self.header_line(match), **values)
+        except (KeyError, IndexError, ValueError):
+            return self.header_line(match)
+    
+    def split_text(self, text: str, doc_title: str) -> List[Dict]:
+        sections = [{
+            "title": doc_title,
+            "type": self.document_type,
+            "level": 0,
+            "parent": None,
+            "parent_path": ""
+        }]
+        starts = [0]
+        ends = []
+        stack = []  # (уровень заголовка, индекс узла) от корня к текущему узлу
+        headers = {header["group"]: header for header in self.headers}
+        
+        for match in self.iter_headers(text):
+            header = headers[match.lastgroup]
+            if self.hierarchical and header["inside"] and not (
+                    stack and sections[stack[-1][1]]["type"] in header["inside"]):
+                continue
+            
+            while stack and stack[-1][0] >= header["level"]:
+                stack.pop()
+            ends.append(match.start())
+            starts.append(match.start() if header["include_header"] else match.end())
+            sections.append({
+                "title": self.section_title(header, match),
+                "type": header["type"],
+                "level": len(stack),
+                "parent": stack[-1][1] if stack else None,
+                "parent_path": " › ".join(sections[index]["title"] for _, index in stack)
+            })
+            if self.hierarchical:
+                stack.append((header["level"], len(sections) - 1))
+        ends.append(len(text))
+        
+        for section, start, end in zip(sections, starts, ends):
+            section["content"] = text[start:end].strip()
+        
+        if self.hierarchical:
+            # Пустая преамбула без вложенных узлов не нужна
+            if not sections[0]["content"] and len(sections) > 1:
+                sections = sections[1:]
+                for section in sections:
+                    if section["parent"] is not None:
+                        section["parent"] -= 1
+            return sections
+        
+        sections = [
+            {"title": s["title"], "content": s["content"], "type": s["type"]}
+            for s in sections if s["content"]
+        ]
+        if not sections:
+            return [{"title": doc_title, "content": text.strip(), "type": "full_document"}]
+        return sections
+
+
+class SectionSizeNormalizer:
+    """
+    Выравнивание размеров разделов после разбиения (потоковый шаг сканирования).
+    
+    Раздел больше max_tokens делится на части "(часть N)" по границам статей,
+    затем абзацев и, для очень длинных абзацев, предложений; сам раздел
+    становится пустым узлом-заголовком, а части - его вложенными разделами,
+    поэтому выбор узла включает все части. Подряд идущие разделы меньше
+    min_tokens с общим родителем и без вложенных разделов объединяются в один.
+    Разделы обрабатываются по одному по мере разбиения, без копии всего
+    документа. Нулевой предел отключает соответствующую обработку.
+    """
+    
+    ARTICLE_START = re.compile(r'\n(?=(?:Статья|СТАТЬЯ)[^\S\n]+\d)')
+    SENTENCE_END = re.compile(r'(?<=[.!?;])[^\S\n]+')
+    
+    def __init__(self, max_tokens: int = 0, min_tokens: int = 0):
+        self.max_tokens = max(int(max_tokens or 0), 0)
+        self.min_tokens = max(int(min_tokens or 0), 0)
+    
+    @property
+    def enabled(self) -> bool:
+        return bool(self.max_tokens or self.min_tokens)
+    
+    def normalize(self, sections):
+        """
+        Принимает разделы разбиения (поле parent - индекс во входной
+        последовательности) и выдает разделы с пересчитанными индексами parent.
+        """
+        if not self.enabled:
+            yield from sections
+            return
+        
+        index_map = {}  # входной индекс → выходной индекс
+        emitted = 0
+        run = []  # подряд идущие маленькие разделы: (входной индекс, раздел)
+        
+        def flush(items):
+            nonlocal emitted
+            if not items:
+                return
+            if len(items) == 1:
+                out = [items[0][1]]
+            else:
+                out = [self._merge([section for _, section in items])]
+            for index, _ in items:
+                index_map[index] = emitted
+            for section in out:
+                emitted += 1
+                yield section
+        
+        for index, section in enumerate(sections):
+            parent = section.get("parent")
+            
+            # Раздел оказался родителем следующего - его нельзя объединять
+            if run and parent is not None and parent == run[-1][0]:
+                yield from flush(run[:-1])
+                yield from flush(run[-1:])
+                run = []
+            
+            if parent is not None:
+                section = {**section, "parent": index_map[parent]}
+            tokens = estimate_tokens(section.get("content", ""))
+            
+            if self.min_tokens and tokens < self.min_tokens:
+                if run and self._can_join(run, section):
+                    run.append((index, section))
+                    continue
+                yield from flush(run)
+                run = [(index, section)]
+                continue
+            
+            yield from flush(run)
+            run = []
+            
+            if self.max_tokens and tokens > self.max_tokens:
+                index_map[index] = emitted
+                for part in self._split(section, emitted):
+                    emitted += 1
+                    yield part
+                continue
+            
+            index_map[index] = emitted
+            emitted += 1
+            yield section
+        
+        yield from flush(run)
+    
+    def _can_join(self, run: List[tuple], section: Dict) -> bool:
+        """Раздел можно присоединить к серии маленьких разделов"""
+        last = run[-1][1]
+        if ("level" in last) != ("level" in section) or last.get("parent") != section.get("parent"):
+            return False
+        if not self.max_tokens:
+            return True
+        size = sum(estimate_tokens(item.get("content", "")) for _, item in run)
+        return size + estimate_tokens(section.get("content", "")) <= self.max_tokens
+    
+    @staticmethod
+    def _merge(items: List[Dict]) -> Dict:
+        """Объединяет серию маленьких разделов: заголовки сохраняются строками текста"""
+        paragraphs = []
+        for item in items:
+            title, content = item.get("title", ""), item.get("content", "")
+            if title and not content.startswith(title):
+                paragraphs.append(title)
+            if content:
+                paragraphs.append(content)
+        return {
+            **items[0],
+            "title": f"{items[0].get('title', '')} … {items[-1].get('title', '')}",
+            "content": "\n".join(paragraphs)
+        }
+    
+    def _split(self, section: Dict, container_index: int) -> List[Dict]:
+        """Пустой узел с заголовком раздела и его части как вложенные разделы"""
+        level = section.get("level", 0)
+        parent_path = section.get("parent_path", "")
+        container = {
+            **section,
+            "content": "",
+            "level": level,
+            "parent": section.get("parent"),
+            "parent_path": parent_path
+        }
+        part_path = f"{parent_path} › {section['title']}" if parent_path else section["title"]
+        return [container] + [
+            {
+                **section,
+                "title": f"{section['title']} (часть {number})",
+                "content": chunk,
+                "level": level + 1,
+                "parent": container_index,
+                "parent_path": part_path
+            }
+            for number, chunk in enumerate(self._chunks(section.get("content", "")), 1)
+        ]
+    
+    def _units(self, content: str) -> List[tuple]:
+        """
+        Неделимые куски текста (текст, разделитель перед ним): статьи, если
+        они помещаются в предел, иначе абзацы, а слишком длинные абзацы -
+        предложения или слова.
+        """
+        units = []
+        for block in self.ARTICLE_START.split(content):
+            if estimate_tokens(block) <= self.max_tokens:
+                units.append((block, "\n"))
+                continue
+            for paragraph in block.split('\n'):
+                if estimate_tokens(paragraph) <= self.max_tokens:
+                    units.append((paragraph, "\n"))
+                    continue
+                separator = "\n"
+                for sentence in self.SENTENCE_END.split(paragraph):
+                    if estimate_tokens(sentence) <= self.max_tokens:
+                        units.append((sentence, separator))
+                    else:
+                        # Предложение без знаков препинания - по словам
+                        units.extend((word, separator if number == 0 else " ")
+                                     for number, word in enumerate(sentence.split(' ')))
+                    separator = " "
+        return units
+    
+    def _chunks(self, content: str) -> List[str]:
+        """Жадно укладывает куски текста в части не больше max_tokens"""
+        chunks = []
+        current = []
+        size = 0
+        for text, separator in self._units(content):
+            tokens = estimate_tokens(text) + 1
+            if current and size + tokens > self.max_tokens:
+                chunks.append("".join(current).strip())
+                current, size = [], 0
+            current.append(separator + text if current else text)
+            size += tokens
+        if current:
+            chunks.append("".join(current).strip())
+        return [chunk for chunk in chunks if chunk]
+
+# ==============================================
+# ОБРАБОТКА ДОКУМЕНТОВ: ЧТЕНИЕ, ОЧИСТКА, РАЗБИЕНИЕ НА РАЗДЕЛЫ
+# ==============================================
+
+class DocumentProcessor:
+    """
+    Превращает файл документа в список разделов: чтение, очистка и разбиение
+    по типу папки. Не хранит состояния базы, поэтому может работать в
+    отдельных процессах при параллельном сканировании.
+    """
+    
+    def __init__(self):
+        self.file_reader = FileFormatReader()
+        self.cleaner = TextCleaner(CONFIG.get("cleaning_rules"))
+        self.splitters = {folder_type: splitter() for folder_type, splitter in SPLITTERS.items()}
+        # Разделители из config.json дополняют и переопределяют встроенные
+        for folder_type, rules in CONFIG.get("splitters", {}).items():
+            self.splitters[folder_type] = ConfigSplitter(folder_type, rules)
+        self.size_normalizer = SectionSizeNormalizer(
+            CONFIG.get("section_max_tokens", 0), CONFIG.get("section_min_tokens", 0)
+        )
+    
+    @staticmethod
+    def processing_settings() -> Dict:
+        """Настройки обработки, влияющие на разделы (хранятся в манифесте)"""
+        return {
+            "normative_split_mode": CONFIG.get("normative_split_mode", "chapter"),
+            "chars_per_token": CHARS_PER_TOKEN,
+            "section_max_tokens": CONFIG.get("section_max_tokens", 0),
+            "section_min_tokens": CONFIG.get("section_min_tokens", 0),
+            "cleaning_rules": TextCleaner(CONFIG.get("cleaning_rules")).fingerprint(),
+            "splitters": hashlib.sha1(
+                json.dumps(CONFIG.get("splitters", {}), sort_keys=True, ensure_ascii=False).encode('utf-8')
+            ).hexdigest()[:12]
+        }
+    
+    def process_file(self, file_path: Path, folder_name: str,
+                     folder_root: Optional[Path] = None) -> Optional[List[Dict]]:
+        """
+        Читает, очищает и разбивает один файл на разделы.
+        Возвращает список разделов или None, если файл прочитать не удалось.
+        """
+        # Ключ документа не зависит от расположения папки на конкретном компьютере
+        try:
+            relative_path = file_path.relative_to(folder_root).as_posix() if folder_root else file_path.name
+        except ValueError:
+            relative_path = file_path.name
+        document_key = f"{folder_name}/{relative_path}"
+        
+        # Используем универсальный ридер файлов
+        content = self.file_reader.read_file(file_path)
+        
+        if content is None:
+            return None
+        
+        # Извлекаем метаданные из YAML заголовка
+        metadata = self._extract_yaml_metadata(content)
+        
+        # Получаем название документа из метаданных или имени файла
+        document_title = metadata.get('title', file_path.stem)
+        
+        # ОЧИЩАЕМ ТЕКСТ ОТ СЛУЖЕБНЫХ СИМВОЛОВ
+        cleaned_content = self.cleaner.normalize(content)
+        
+        # РАЗБИВАЕМ ДОКУМЕНТ НА РАЗДЕЛЫ В ЗАВИСИМОСТИ ОТ ТИПА ПАПКИ
+        sections = self._split_document_by_type(
+            cleaned_content,
+            file_path, 
+            folder_name, 
+            document_title
+        )
+        
+        # ОЧИЩАЕМ КОНТЕНТ КАЖДОГО РАЗДЕЛА ОТ КОММЕНТАРИЕВ И ВЫРАВНИВАЕМ РАЗМЕРЫ РАЗДЕЛОВ
+        cleaned_sections = (
+            {**section, "content": self.cleaner.remove_comments(section.get("content", ""))}
+            for section in sections
+        )
+        splitter = self.splitters.get(folder_name)
+        size_normalizer = getattr(splitter, "size_normalizer", None) or self.size_normalizer
+        
+        file_sections = []
+        for i, section in enumerate(size_normalizer.normalize(cleaned_sections)):
+            final_content = section["content"]
+            
+            file_section = {
+                "id": self._make_section_id(
+                    document_key, i, section.get("title", document_title), final_content
+                ),
+                "folder": folder_name,
+                "document": file_path.name,
+                "document_extension": file_path.suffix,
+                "document_title": document_title,
+                "document_path": str(file_path),
+                "title": section.get("title", document_title),
+                "content": final_content,
+                "section_type": section.get("type", "text"),
+                "word_count": len(final_content.split()),
+                "token_count": estimate_tokens(final_content),
+                "metadata": metadata
+            }
+            
+            # Иерархическое разбиение: уровень и ссылка на родительский раздел
+            if "level" in section:
+                parent = section.get("parent")
+                file_section["level"] = section["level"]
+                file_section["parent_id"] = file_sections[parent]["id"] if parent is not None else None
+                file_section["parent_path"] = section.get("parent_path", "")
+            
+            file_sections.append(file_section)
+        
+        return file_sections
+    
+    @staticmethod
+    def _make_section_id(document_key: str, ordinal: int, title: str, content: str) -> str:
+        """
+        Строит детерминированный ID раздела из пути документа, порядкового номера,
+        заголовка и хэша содержимого. Повторное сканирование неизмененного файла
+        дает те же ID, поэтому выбор и ключи виджетов не сбрасываются.
+        """
+        content_hash = hashlib.sha1(content.encode('utf-8')).hexdigest()
+        digest = hashlib.sha1(
+            f"{document_key}\n{ordinal}\n{title}\n{content_hash}".encode('utf-8')
+        ).hexdigest()
+        stem = Path(document_key).stem
+        return f"{stem}_{ordinal}_{digest[:8]}"
+    
+    def _extract_yaml_metadata(self, content: str) -> Dict:
+        """Извлекает метаданные из YAML заголовка в начале документа"""
+        metadata = {}
+        
+        try:
+            content_stripped = content.strip()
+            if content_stripped.startswith('---'):
+                parts = content_stripped.split('---', 2)
+                if len(parts) >= 3:
+                    yaml_content = parts[1].strip()
+                    if yaml_content:
+                        metadata = yaml.safe_load(yaml_content) or {}
+        except (yaml.YAMLError, AttributeError) as e:
+            print(f"  ⚠ Не удалось прочитать YAML: {e}")
+        
+        if not isinstance(metadata, dict):
+            metadata = {}
+        
+        return metadata
+    
+    def _split_document_by_type(self, content: str, file_path: Path, folder_type: str, doc_title: str) -> List[Dict]:
+        """Разбиваем документ на разделы разделителем, зарегистрированным для типа папки"""
+        splitter = self.splitters.get(folder_type)
+        if splitter is None:
+            return [{
+                "title": doc_title,
+                "content": content.strip() if content else "",
+                "type": "full_document"
+            }]
+        return splitter.split(content, doc_title)
+
+# Обработчик документов дочернего процесса (создается один раз на процесс)
+_worker_processor: Optional[DocumentProcessor] = None
+
+def _process_file_task(task: tuple) -> tuple:
+    """
+    Обрабатывает один файл в дочернем процессе пула сканирования.
+    Возвращает (разделы, статистика очистки текста по этому файлу).
+    """
+    global _worker_processor
+    if _worker_processor is None:
+        _worker_processor = DocumentProcessor()
+    file_path, folder_name, folder_root = task
+    _worker_processor.cleaner.reset_stats()
+    sections = _worker_processor.process_file(file_path, folder_name, folder_root)
+    return sections, _worker_processor.cleaner.stats
+
+# ==============================================
+# СИСТЕМА УПРАВЛЕНИЯ БАЗОЙ РАЗДЕЛОВ
+# ==============================================
+
+class SimpleSectionDatabase:
+    """Простая система для создания и управления базой разделов"""
+    
+    def __init__(self):
+        self.db_path = Path(CONFIG["database_path"])
+        self.manifest_db = self.db_path / "manifest.json"
+        self.storage = create_section_storage(self.db_path)
+        self.processor = DocumentProcessor()  # чтение, очистка и разбиение файлов
+        
+        # Новая версия базы строится без блокировки, а под lock только подменяется
+        # целиком (и читаются тексты из хранилища); scan_lock не дает двум
+        # обновлениям (фоновому и из интерфейса) идти одновременно
+        self.lock = threading.RLock()
+        self.scan_lock = threading.RLock()
+        self.watcher: Optional["FolderWatcher"] = None
+        
+        # Загружаем существующую базу или создаем новую
+        self.sections = self._load_sections()
+        self.metadata = self._load_metadata()
+        self.manifest = self._load_manifest()
+        self.search_index_db = self.db_path / "search_index.json"
+        self.search_index = self._load_search_index()
+        self.vector_index_db = self.db_path / "vector_index.npz"
+        self.vector_index = self._load_vector_index()
+        self.duplicates_db = self.db_path / "duplicates.npz"
+        self.duplicate_index = self._load_duplicate_index()
+        self.citations_db = self.db_path / "citations.json"
+        self.citation_index = self._load_citation_index()
+        # Кэш таблицы для отображения: словарь общий у базы и ее снимков одной версии
+        self._frame_cache: Dict[str, pd.DataFrame] = {}
+        
+        # Индекс ID → раздел; выбор разделов хранится отдельно для каждого
+        # пользователя (SelectionSet), общая база при выборе не меняется
+        self.sections_by_id: Dict[str, Dict] = {}
+        self._reindex_sections()
+        
+        # Номер версии базы (растет при каждом сохранении) и замены ID разделов
+        # после пересканирования - по ним выборы пользователей догоняют базу
+        self.generation = 0
+        self.id_aliases: Dict[str, str] = {}
+        
+        # Ленивый режим: старая база с текстами внутри переносится в хранилище текстов
+        if self.storage.lazy and any("content" in section for section in self.sections):
+            print("📦 Тексты разделов переносятся в отдельное хранилище (lazy_content)")
+            self.save_database()
+    
+    def _reindex_sections(self):
+        """Перестраивает индекс ID → раздел после замены разделов"""
+        self.sections_by_id = {section.get("id"): section for section in self.sections}
+    
+    def _load_sections(self) -> List[Dict]:
+        """Загружаем базу разделов"""
+        try:
+            sections = self.storage.load_sections()
+            if sections is not None:
+                return sections
+        except Exception as e:
+            print(f"❌ Ошибка загрузки базы разделов: {e}")
+            return []
+        print("📁 База разделов не найдена, создается новая")
+        return []
+    
+    def _load_metadata(self) -> Dict:
+        """Загружаем метаданные базы"""
+        try:
+            metadata = self.storage.load_metadata()
+            if metadata is not None:
+                return metadata
+        except Exception as e:
+            print(f"❌ Ошибка загрузки метаданных: {e}")
+            return {}
+        print("📁 Метаданные базы не найдены, создаются новые")
+        return {
+            "created_at": "",
+            "last_updated": "",
+            "total_sections": 0,
+            "total_documents": 0,
+            "by_folder": {},
+            "supported_extensions": SUPPORTED_EXTENSIONS
+        }
+    
+    def _load_manifest(self) -> Dict:
+        """Загружаем манифест отпечатков файлов (для инкрементального сканирования)"""
+        if self.manifest_db.exists():
+            try:
+                manifest = read_json_file(self.manifest_db)
+                if isinstance(manifest, dict) and isinstance(manifest.get("files"), dict):
+                    return manifest
+                print("⚠ Неверная структура манифеста, будет создан новый")
+            except Exception as e:
+                print(f"❌ Ошибка загрузки манифеста: {e}")
+        return {"version": 1, "files": {}}
+    
+    def _load_search_index(self) -> SectionSearchIndex:
+        """Загружаем поисковый индекс и досинхронизируем его с разделами базы"""
+        index = SectionSearchIndex()
+        if self.search_index_db.exists():
+            try:
+                index = SectionSearchIndex.from_dict(read_json_file(self.search_index_db))
+            except Exception as e:
+                print(f"❌ Ошибка загрузки поискового индекса: {e}")
         
-        for folder_name, stats in folder_stats.items():
-            print(f"   📁 {folder_name}: {stats['documents']} док. → {stats['sections']} разд.")
+        self.search_index = index
+        self._update_search_index()
+        return index
+    
+    def _update_search_index(self):
+        """Инкрементально обновляет поисковый индекс и сохраняет его при изменениях"""
+        changes = self.search_index.sync(self.sections, self.load_content)
+        if not changes["added"] and not changes["removed"]:
+            return
         
-        return all_sections
+        print(f"🔎 Поисковый индекс: добавлено {changes['added']}, удалено {changes['removed']} разделов")
+        try:
+            self.db_path.mkdir(exist_ok=True, parents=True)
+            write_json_atomic(self.search_index_db, self.search_index.to_dict(), separators=(',', ':'))
+        except Exception as e:
+            print(f"❌ Ошибка сохранения поискового индекса: {e}")
     
-    def _split_document_by_type(self, content: str, file_path: Path, folder_type: str, doc_title: str) -> List[Dict]:
-        """Разбиваем документ на разделы в зависимости от типа папки"""
-        
-        if folder_type == "normative":
-            return self._split_normative_document(content, file_path, doc_title)
-        elif folder_type == "methodology":
-            return self._split_methodology_document(content, file_path, doc_title)
-        elif folder_type == "structured":
-            return self._split_structured_document(content, file_path, doc_title)
-        elif folder_type == "expertise":
-            return self._split_expertise_document(content, file_path, doc_title)
-        else:
-            return [{
-                "title": doc_title,
-                "content": content.strip() if content else "",
-                "type": "full_document"
-            }]
+    def _load_vector_index(self) -> SectionVectorIndex:
+        """Загружаем векторный индекс подбора разделов и перестраиваем его, если он отстал от базы"""
+        index = SectionVectorIndex()
+        if self.vector_index_db.exists():
+            try:
+                index = SectionVectorIndex.load(self.vector_index_db)
+            except Exception as e:
+                print(f"❌ Ошибка загрузки векторного индекса: {e}")
+        
+        self.vector_index = index
+        self._update_vector_index()
+        return index
     
-    def _split_normative_document(self, content: str, file_path: Path, doc_title: str) -> List[Dict]:
-        """Разделение нормативных документов по 'ГЛАВА' или 'Глава' с номером"""
-        sections = []
+    def _update_vector_index(self):
+        """Перестраивает векторный индекс после изменения поискового индекса и сохраняет его"""
+        if set(self.vector_index.section_ids.tolist()) == self.search_index.section_ids:
+            return
         
-        if not content:
-            return [{
-                "title": doc_title,
-                "content": "",
-                "type": "empty_document"
-            }]
+        started = time.perf_counter()
+        self.vector_index = SectionVectorIndex.build(self.search_index)
+        print(f"🧭 Векторный индекс: {len(self.vector_index)} разделов, {len(self.vector_index.terms)} термов "
+              f"({time.perf_counter() - started:.2f} с)")
+        try:
+            self.db_path.mkdir(exist_ok=True, parents=True)
+            self.vector_index.save(self.vector_index_db)
+        except Exception as e:
+            print(f"❌ Ошибка сохранения векторного индекса: {e}")
+    
+    def _load_duplicate_index(self) -> SectionDuplicateIndex:
+        """Загружаем подписи MinHash разделов и находим группы повторов"""
+        index = SectionDuplicateIndex(
+            float(CONFIG.get("duplicate_threshold", 0.8)), int(CONFIG.get("duplicate_min_words", 30))
+        )
+        if self.duplicates_db.exists():
+            try:
+                index.load(self.duplicates_db)
+            except Exception as e:
+                print(f"❌ Ошибка загрузки индекса повторов: {e}")
         
-        content_to_process = content
-        if content.strip().startswith('---'):
-            parts = content.split('---', 2)
-            if len(parts) >= 3:
-                content_to_process = parts[2].strip()
-        
-        lines = content_to_process.split('\n')
-        current_section = []
-        current_title = doc_title
-        current_type = "document"
-        
-        # Паттерны для поиска глав (ТОЛЬКО ГЛАВА, без Статей)
-        patterns = [
-            (r'^ГЛАВА\s+[IVXLCDM\d]+[\s\.\-:].*$', "chapter"),
-            (r'^Глава\s+[IVXLCDM\d]+[\s\.\-:].*$', "chapter"),
-            (r'^ГЛАВА\s+[0-9]+[\s\.\-:].*$', "chapter"),
-            (r'^Глава\s+[0-9]+[\s\.\-:].*$', "chapter"),
-        ]
+        self.duplicate_index = index
+        self._update_duplicate_index()
+        return index
+    
+    def _update_duplicate_index(self):
+        """Досчитывает подписи новых разделов, пересчитывает группы повторов и сохраняет подписи"""
+        started = time.perf_counter()
+        changes = self.duplicate_index.sync(self.sections, self.load_content)
+        if not changes["added"] and not changes["removed"]:
+            return
         
-        for line in lines:
-            is_header = False
-            for pattern, section_type in patterns:
-                match = re.match(pattern, line.strip())
-                if match:
-                    if current_section:
-                        sections.append({
-                            "title": current_title,
-                            "content": "\n".join(current_section).strip(),
-                            "type": current_type
-                        })
-                    
-                    current_title = line.strip()
-                    current_type = section_type
-                    current_section = []
-                    is_header = True
-                    break
-            
-            if not is_header:
-                current_section.append(line)
+        print(f"♊ Повторы: {len(self.duplicate_index.groups)} групп, "
+              f"{len(self.duplicate_index.duplicate_of)} разделов ({time.perf_counter() - started:.2f} с)")
+        try:
+            self.db_path.mkdir(exist_ok=True, parents=True)
+            self.duplicate_index.save(self.duplicates_db)
+        except Exception as e:
+            print(f"❌ Ошибка сохранения индекса повторов: {e}")
+    
+    def _load_citation_index(self) -> SectionCitationIndex:
+        """Загружаем извлеченные ссылки разделов и строим граф ссылок"""
+        index = SectionCitationIndex()
+        if self.citations_db.exists():
+            try:
+                index = SectionCitationIndex.from_dict(read_json_file(self.citations_db))
+            except Exception as e:
+                print(f"❌ Ошибка загрузки индекса ссылок: {e}")
         
-        if current_section:
-            sections.append({
-                "title": current_title,
-                "content": "\n".join(current_section).strip(),
-                "type": current_type
-            })
+        self.citation_index = index
+        self._update_citation_index()
+        return index
+    
+    def _update_citation_index(self):
+        """Извлекает ссылки новых разделов, перестраивает граф и сохраняет индекс при изменениях"""
+        changes = self.citation_index.sync(self.sections, self.load_content)
+        if not changes["added"] and not changes["removed"]:
+            return
         
-        if not sections:
-            sections.append({
-                "title": doc_title,
-                "content": content_to_process.strip(),
-                "type": "full_document"
-            })
+        links = sum(len(targets) for targets in self.citation_index.cites.values())
+        print(f"🔗 Ссылки: {links} ссылок на статьи из {len(self.citation_index.cites)} разделов")
+        try:
+            self.db_path.mkdir(exist_ok=True, parents=True)
+            write_json_atomic(self.citations_db, self.citation_index.to_dict(), separators=(',', ':'))
+        except Exception as e:
+            print(f"❌ Ошибка сохранения индекса ссылок: {e}")
+
+    def rebuild_indexes(self):
+        """
+        Строит поисковый, векторный индексы, индексы повторов и ссылок заново
+        по текущим разделам (после смены правил анализа или повреждения файлов).
+        """
+        with self.scan_lock:
+            staged = self._stage(self.sections, rebuild=True)
+            with self.lock:
+                self._swap(staged)
+
+    def _save_manifest(self):
+        """Сохраняем манифест отпечатков файлов"""
+        try:
+            self.db_path.mkdir(exist_ok=True, parents=True)
+            write_json_atomic(self.manifest_db, self.manifest, indent=2)
+        except Exception as e:
+            print(f"❌ Ошибка сохранения манифеста: {e}")
+    
+    @staticmethod
+    def _file_fingerprint(file_path: Path, previous: Optional[Dict] = None) -> Dict:
+        """
+        Возвращает отпечаток файла: размер, время изменения и хэш содержимого.
+        Если размер и mtime совпадают с прошлым отпечатком, файл не перечитывается.
+        """
+        stat = file_path.stat()
+        fingerprint = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns
+        }
         
-        return sections
+        if (previous and previous.get("hash") and
+                previous.get("size") == fingerprint["size"] and
+                previous.get("mtime") == fingerprint["mtime"]):
+            fingerprint["hash"] = previous["hash"]
+            return fingerprint
+        
+        hasher = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                hasher.update(chunk)
+        fingerprint["hash"] = hasher.hexdigest()
+        return fingerprint
     
-    def _split_methodology_document(self, content: str, file_path: Path, doc_title: str) -> List[Dict]:
-        """Разделение методических документов на заголовки 1 и 2 уровня markdown"""
-        sections = []
+    def save_database(self):
+        """Сохраняем базу на диск (текущие разделы и метаданные)"""
+        self.replace_sections(self.sections, self.metadata)
+    
+    def replace_sections(self, sections: List[Dict], metadata: Dict,
+                         manifest: Optional[Dict] = None, id_map: Optional[Dict[str, str]] = None):
+        """
+        Сохраняет новую версию базы. Индексы для нее строятся на копиях без
+        блокировки - открытые страницы в это время работают с прежней версией;
+        под блокировкой база только записывается в хранилище и подменяется.
+        id_map - замены ID разделов для переноса выборов пользователей.
+        """
+        with self.scan_lock:
+            staged = self._stage(sections)
+            with self.lock:
+                saved = False
+                try:
+                    self.storage.save(staged.sections, metadata)
+                    saved = True
+                    print(f"💾 База данных сохранена в {self.db_path}")
+                except Exception as e:
+                    print(f"❌ Ошибка сохранения базы данных: {e}")
+                
+                self.metadata = metadata
+                if manifest is not None:
+                    self.manifest = manifest
+                    self._save_manifest()
+                if id_map:
+                    # Замены ID видны вместе с новой версией, иначе выборы потеряли бы разделы
+                    aliases = {old_id: id_map.get(new_id, new_id) for old_id, new_id in self.id_aliases.items()}
+                    aliases.update(id_map)
+                    self.id_aliases = aliases
+                self._swap(staged)
+                
+                # В ленивом режиме сохраненные тексты больше не держим в памяти
+                if saved and self.storage.lazy:
+                    for section in self.sections:
+                        section.pop("content", None)
+            
+            self._remap_selections(id_map)
+    
+    def _stage(self, sections: List[Dict], rebuild: bool = False) -> "SimpleSectionDatabase":
+        """
+        Копия базы с новыми разделами и обновленными индексами (файлы индексов
+        сохраняются сразу). Индексы базы не меняются: обновляются их копии,
+        rebuild - индексы строятся заново.
+        """
+        staged = copy.copy(self)
+        staged.sections = sections
+        if rebuild:
+            staged.search_index = SectionSearchIndex()
+            staged.vector_index = SectionVectorIndex()
+            staged.duplicate_index = SectionDuplicateIndex(
+                float(CONFIG.get("duplicate_threshold", 0.8)), int(CONFIG.get("duplicate_min_words", 30))
+            )
+            staged.citation_index = SectionCitationIndex()
+        else:
+            staged.search_index = self.search_index.copy()
+            staged.duplicate_index = self.duplicate_index.copy()
+            staged.citation_index = self.citation_index.copy()
         
-        if not content:
-            return [{
-                "title": doc_title,
-                "content": "",
-                "type": "empty_document"
-            }]
+        staged._reindex_sections()
+        staged._update_search_index()
+        staged._update_vector_index()
+        staged._update_duplicate_index()
+        staged._update_citation_index()
+        return staged
+    
+    def _swap(self, staged: "SimpleSectionDatabase"):
+        """Подменяет разделы и индексы версией staged (вызывается под блокировкой)"""
+        self.sections = staged.sections
+        self.sections_by_id = staged.sections_by_id
+        self.search_index = staged.search_index
+        self.vector_index = staged.vector_index
+        self.duplicate_index = staged.duplicate_index
+        self.citation_index = staged.citation_index
+        self._frame_cache = {}
+        self.generation += 1
+    
+    def snapshot(self) -> "SimpleSectionDatabase":
+        """
+        Снимок текущей версии базы для построения страницы. Новая версия
+        подменяет атрибуты базы, а не меняет их содержимое, поэтому снимок
+        остается согласованным, даже если посреди вывода база обновилась.
+        """
+        with self.lock:
+            return copy.copy(self)
+    
+    def with_content(self, sections: List[Dict]) -> List[Dict]:
+        """
+        Разделы с текстами: загруженные без текста (ленивый режим) дополняются
+        текстом из хранилища в копиях, разделы базы при этом не меняются.
+        """
+        missing = [section for section in sections if "content" not in section]
+        if not missing:
+            return list(sections)
         
-        content_to_process = content
-        if content.strip().startswith('---'):
-            parts = content.split('---', 2)
-            if len(parts) >= 3:
-                content_to_process = parts[2].strip()
+        contents = self.load_content(missing)
+        return [
+            section if "content" in section else {**section, "content": contents.get(section.get("id"), "")}
+            for section in sections
+        ]
+    
+    def load_content(self, sections: List[Dict]) -> Dict[str, str]:
+        """Тексты разделов из хранилища (ID → текст); чтение не пересекается с сохранением базы"""
+        with self.lock:
+            return self.storage.load_content(sections)
+    
+    def get_content(self, section: Dict) -> str:
+        """Текст одного раздела (из памяти или из хранилища)"""
+        return self.with_content([section])[0].get("content", "")
+    
+    def _remap_selections(self, id_map: Dict[str, str]):
+        """Переносит сохраненные выборы пользователей на новые ID разделов"""
+        if not id_map:
+            return
+        
+        try:
+            updated = self.storage.remap_user_selections(id_map)
+            if updated:
+                print(f"↪ Выборы пользователей перенесены на новые ID разделов: {updated}")
+        except Exception as e:
+            print(f"❌ Ошибка переноса выборов пользователей: {e}")
+    
+    def resolve_section_ids(self, section_ids) -> set:
+        """Приводит ID к текущей версии базы: заменяет устаревшие, отбрасывает исчезнувшие"""
+        resolved = {self.id_aliases.get(section_id, section_id) for section_id in section_ids}
+        return {section_id for section_id in resolved if section_id in self.sections_by_id}
+    
+    def search_sections(self, query: str, limit: int = 200) -> List[str]:
+        """
+        Ищет разделы по заголовку и тексту, возвращает ID по убыванию релевантности.
+        Основной путь - индекс BM25 со стеммингом; пока индекс пуст, разделы
+        перебираются по вхождению запроса.
+        """
+        if not query or not query.strip():
+            return []
         
-        lines = content_to_process.split('\n')
-        current_section = []
-        current_title = doc_title
-        current_type = "document"
+        if self.search_index.doc_lengths:
+            return [section_id for section_id, _ in self.search_index.search(query, limit)]
         
-        patterns = [
-            (r'^#\s+(.+)$', "h1"),
-            (r'^##\s+(.+)$', "h2"),
+        query_lower = query.lower()
+        return [
+            section.get("id") for section in self.sections
+            if query_lower in section.get("title", "").lower()
+            or query_lower in section.get("content", "").lower()
+        ][:limit]
+    
+    def recommend_sections(self, question: str, limit: int = 50) -> List[tuple]:
+        """
+        Подбирает разделы по описанию вопроса: [(ID раздела, близость от 0 до 1)]
+        по убыванию близости TF-IDF векторов вопроса и раздела.
+        """
+        if not question or not question.strip():
+            return []
+        return [
+            (section_id, score) for section_id, score in self.vector_index.recommend(question, limit)
+            if section_id in self.sections_by_id
         ]
+    
+    def get_search_snippets(self, query: str, section_ids: List[str]) -> Dict[str, str]:
+        """Фрагменты текста с совпадениями запроса для указанных разделов"""
+        wanted = [self.sections_by_id[i] for i in section_ids if i in self.sections_by_id]
+        snippets = {}
+        for section in self.with_content(wanted):
+            snippet = self.search_index.snippet(section.get("content", ""), query)
+            if snippet:
+                snippets[section.get("id")] = snippet
+        return snippets
+    
+    def _list_folder_files(self, folder: Path) -> List[Path]:
+        """Возвращает файлы всех поддерживаемых форматов в папке (отсортированы по пути)"""
+        files = []
+        for ext in SUPPORTED_EXTENSIONS:
+            files.extend(list(folder.rglob(f"*{ext}")))
+        return sorted(files)
+    
+    @staticmethod
+    def _selection_keys(sections: List[Dict]) -> List[tuple]:
+        """Ключи (путь документа, заголовок, номер повтора заголовка) для переноса выбора"""
+        keys = []
+        seen = {}
+        for section in sections:
+            base = (section.get("document_path", ""), section.get("title", ""))
+            seen[base] = seen.get(base, 0) + 1
+            keys.append(base + (seen[base],))
+        return keys
+    
+    @staticmethod
+    def _map_section_ids(old_sections: List[Dict], new_sections: List[Dict]) -> Dict[str, str]:
+        """
+        Сопоставляет исчезнувшие ID старых разделов файла с ID новых разделов
+        по пути документа и заголовку раздела (это же мигрирует старые базы со
+        случайными ID). Нужно для переноса выборов пользователей.
+        """
+        new_ids = {section.get("id") for section in new_sections}
+        new_by_key = {
+            key: section.get("id")
+            for key, section in zip(SimpleSectionDatabase._selection_keys(new_sections), new_sections)
+        }
         
-        for line in lines:
-            is_header = False
-            for pattern, section_type in patterns:
-                match = re.match(pattern, line.strip())
-                if match:
-                    if current_section:
-                        sections.append({
-                            "title": current_title,
-                            "content": "\n".join(current_section).strip(),
-                            "type": current_type
-                        })
-                    
-                    current_title = match.group(1)
-                    current_type = section_type
-                    current_section = []
-                    is_header = True
-                    break
-            
-            if not is_header:
-                current_section.append(line)
+        id_map = {}
+        for key, section in zip(SimpleSectionDatabase._selection_keys(old_sections), old_sections):
+            if section.get("id") not in new_ids and key in new_by_key:
+                id_map[section.get("id")] = new_by_key[key]
+        return id_map
+    
+    @staticmethod
+    def _ingest_workers(task_count: int) -> int:
+        """Число процессов для обработки файлов (ingest_workers: 0 - по числу ядер, 1 - без пула)"""
+        try:
+            workers = int(CONFIG.get("ingest_workers", 1))
+        except (TypeError, ValueError):
+            workers = 1
+        if workers <= 0:
+            workers = os.cpu_count() or 1
+        return max(1, min(workers, task_count))
+    
+    def _process_files(self, tasks: List[tuple], progress_callback=None) -> List:
+        """
+        Обрабатывает файлы (путь, тип папки, корень папки) последовательно или
+        в пуле процессов. Результаты возвращаются в порядке задач: список
+        разделов, None (файл не прочитан) или исключение обработки.
+        """
+        results = [None] * len(tasks)
+        workers = self._ingest_workers(len(tasks))
+        pending = list(enumerate(tasks))
         
-        if current_section:
-            sections.append({
-                "title": current_title,
-                "content": "\n".join(current_section).strip(),
-                "type": current_type
-            })
+        if workers > 1:
+            print(f"⚙️ Параллельная обработка {len(tasks)} файлов, процессов: {workers}")
+            completed = set()
+            try:
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    futures = {executor.submit(_process_file_task, task): i for i, task in pending}
+                    for done, future in enumerate(as_completed(futures), 1):
+                        i = futures[future]
+                        try:
+                            results[i], cleaning_stats = future.result()
+                            self.processor.cleaner.merge_stats(cleaning_stats)
+                        except BrokenProcessPool:
+                            raise
+                        except Exception as e:
+                            results[i] = e
+                        completed.add(i)
+                        if progress_callback:
+                            progress_callback(done, len(tasks), tasks[i][0].name)
+                return results
+            except (BrokenProcessPool, OSError) as e:
+                print(f"⚠ Пул процессов недоступен ({e}), обработка продолжается последовательно")
+                # Готовые файлы не обрабатываются повторно: их статистика очистки уже учтена
+                pending = [(i, task) for i, task in pending if i not in completed]
         
-        if not sections:
-            sections.append({
-                "title": doc_title,
-                "content": content_to_process.strip(),
-                "type": "full_document"
-            })
+        for done, (i, task) in enumerate(pending, len(tasks) - len(pending) + 1):
+            try:
+                results[i] = self.processor.process_file(*task)
+            except Exception as e:
+                import traceback
+                traceback.print_exc()
+                results[i] = e
+            if progress_callback:
+                progress_callback(done, len(tasks), task[0].name)
+        return results
+    
+    def scan_and_build_database(self, incremental: bool = True, progress_callback=None):
+        """
+        Сканируем папки и строим базу разделов.
         
-        return sections
+        В инкрементальном режиме файлы сравниваются с манифестом (размер, mtime,
+        хэш содержимого): заново обрабатываются только добавленные и измененные
+        файлы, разделы удаленных файлов убираются, а разделы неизмененных файлов
+        переносятся без изменений вместе с отметками выбора.
+        
+        Измененные файлы обрабатываются в пуле процессов (ingest_workers), а
+        результаты собираются в порядке путей, поэтому база не зависит от
+        порядка завершения процессов. progress_callback(done, total, file_name)
+        вызывается после каждого обработанного файла. Файлы обрабатываются без
+        блокировки базы: страницы работают с прежней версией, пока новая не
+        готова (см. replace_sections), поэтому сканировать можно из фонового потока.
+        """
+        with self.scan_lock:
+            return self._scan_and_build_database(incremental, progress_callback)
     
-    def _split_structured_document(self, content: str, file_path: Path, doc_title: str) -> List[Dict]:
-        """Разделение структурированных документов по квадратным скобкам"""
-        sections = []
+    def _scan_and_build_database(self, incremental: bool, progress_callback) -> List[Dict]:
+        """Сканирование папок (вызывается под scan_lock)"""
+        print("🔍 Начинаем сканирование папок...")
         
-        if not content:
-            return [{
-                "title": doc_title,
-                "content": "",
-                "type": "empty_document"
-            }]
+        all_sections = []
+        folder_stats = {}
         
-        content_to_process = content
-        if content.strip().startswith('---'):
-            parts = content.split('---', 2)
-            if len(parts) >= 3:
-                content_to_process = parts[2].strip()
+        # При смене настроек разбиения все файлы обрабатываются заново
+        settings = DocumentProcessor.processing_settings()
+        if incremental and self.manifest.get("settings") == settings:
+            old_files = self.manifest.get("files", {})
+        else:
+            old_files = {}
+        new_files = {}
+        changes = {"added": 0, "changed": 0, "removed": 0, "unchanged": 0}
         
-        lines = content_to_process.split('\n')
-        current_section = []
-        current_title = doc_title
-        current_type = "document"
+        # Группируем текущие разделы по исходному файлу для переноса без изменений
+        existing_by_path = {}
+        for section in self.sections:
+            existing_by_path.setdefault(section.get("document_path", ""), []).append(section)
         
-        # Паттерн для поиска заголовков в квадратных скобках
-        bracket_pattern = r'^\[([^\[\]]+)\]$'
+        # План: (тип папки, файл, отпечаток, разделы без изменений или None)
+        plan = []
+        tasks = []
+        id_map = {}
         
-        for line in lines:
-            line_stripped = line.strip()
-            is_header = False
+        for folder_name, folder_path in CONFIG["folders"].items():
+            if not folder_path or not Path(folder_path).exists():
+                print(f"⚠ Папка не найдена: {folder_path}")
+                continue
             
-            # Проверяем, является ли строка заголовком в квадратных скобках
-            match = re.match(bracket_pattern, line_stripped)
-            if match:
-                header_content = match.group(1).strip()
+            folder = Path(folder_path)
+            print(f"\n📁 Сканируем: {folder} ({folder_name})")
+            
+            # Ищем файлы ВСЕХ поддерживаемых форматов
+            files = self._list_folder_files(folder)
+            
+            folder_stats[folder_name] = {
+                "documents": len(files),
+                "sections": 0
+            }
+            
+            for file_path in files:
+                path_key = str(file_path)
+                previous = old_files.get(path_key)
                 
-                # Дополнительная проверка: заголовок должен быть не слишком длинным
-                # и содержать осмысленный текст (не только цифры или служебные символы)
-                if (len(header_content) > 3 and 
-                    len(header_content) <= 200 and
-                    re.search(r'[А-Яа-яЁёA-Za-z]', header_content)):
-                    
-                    if current_section:
-                        sections.append({
-                            "title": current_title,
-                            "content": "\n".join(current_section).strip(),
-                            "type": current_type
-                        })
-                    
-                    current_title = header_content
-                    current_type = "bracketed_section"
-                    current_section = []
-                    is_header = True
+                try:
+                    fingerprint = self._file_fingerprint(file_path, previous)
+                except OSError as e:
+                    print(f"  📄 {file_path.name} ❌ Ошибка доступа: {e}")
+                    continue
+                
+                # Файл не изменился и его разделы есть в базе - переносим как есть
+                if previous and previous.get("folder") == folder_name and previous.get("hash") == fingerprint["hash"]:
+                    kept_sections = existing_by_path.get(path_key, [])
+                    if [s.get("id") for s in kept_sections] == previous.get("section_ids", []):
+                        plan.append((folder_name, file_path, {**previous, **fingerprint}, kept_sections))
+                        changes["unchanged"] += 1
+                        continue
+                
+                changes["changed" if previous else "added"] += 1
+                plan.append((folder_name, file_path, fingerprint, None))
+                tasks.append((file_path, folder_name, folder))
+        
+        self.processor.cleaner.reset_stats()
+        results = iter(self._process_files(tasks, progress_callback) if tasks else [])
+        if tasks:
+            print(self.processor.cleaner.report())
+        
+        # Собираем базу в порядке путей файлов
+        for folder_name, file_path, fingerprint, kept_sections in plan:
+            path_key = str(file_path)
+            
+            if kept_sections is not None:
+                all_sections.extend(kept_sections)
+                folder_stats[folder_name]["sections"] += len(kept_sections)
+                new_files[path_key] = fingerprint
+                continue
+            
+            sections = next(results)
+            print(f"  📄 {file_path.name} ({file_path.suffix})...", end="")
+            
+            if isinstance(sections, Exception):
+                print(f" ❌ Ошибка: {sections}")
+                continue
             
-            if not is_header:
-                current_section.append(line)
+            if sections is None:
+                print(f" ❌ Не удалось прочитать файл")
+                sections = []
+            else:
+                print(f" → {len(sections)} разделов")
+                id_map.update(self._map_section_ids(existing_by_path.get(path_key, []), sections))
+            
+            folder_stats[folder_name]["sections"] += len(sections)
+            all_sections.extend(sections)
+            
+            new_files[path_key] = {
+                "folder": folder_name,
+                **fingerprint,
+                "section_ids": [s["id"] for s in sections]
+            }
         
-        if current_section:
-            sections.append({
-                "title": current_title,
-                "content": "\n".join(current_section).strip(),
-                "type": current_type
-            })
+        changes["removed"] = len(set(old_files) - set(new_files))
         
-        if not sections:
-            sections.append({
-                "title": doc_title,
-                "content": content_to_process.strip(),
-                "type": "full_document"
-            })
+        print(f"\n🔁 Изменения: добавлено {changes['added']}, изменено {changes['changed']}, "
+              f"удалено {changes['removed']}, без изменений {changes['unchanged']}")
         
-        return sections
-    
-    def _split_expertise_document(self, content: str, file_path: Path, doc_title: str) -> List[Dict]:
-        """Экспертные документы сохраняем полностью без разделения"""
+        manifest = {
+            "version": 1,
+            "settings": settings,
+            "files": new_files
+        }
         
-        if not content:
-            return [{
-                "title": doc_title,
-                "content": "",
-                "type": "empty_document"
-            }]
+        if (incremental and changes["added"] == 0 and changes["changed"] == 0 and
+                changes["removed"] == 0 and len(all_sections) == len(self.sections)):
+            # Ничего не изменилось - база и метаданные остаются прежними
+            self.manifest = manifest
+            self._save_manifest()
+            print("✅ База актуальна, изменений нет")
+            return self.sections
         
-        content_to_process = content
-        if content.strip().startswith('---'):
-            parts = content.split('---', 2)
-            if len(parts) >= 3:
-                content_to_process = parts[2].strip()
+        # Новая версия базы с метаданными и манифестом
+        metadata = {
+            "created_at": self.metadata.get("created_at", datetime.now().isoformat()),
+            "last_updated": datetime.now().isoformat(),
+            "total_sections": len(all_sections),
+            "total_documents": sum(stats["documents"] for stats in folder_stats.values()),
+            "by_folder": folder_stats,
+            "supported_extensions": SUPPORTED_EXTENSIONS
+        }
+        self.replace_sections(all_sections, metadata, manifest, id_map)
         
-        return [{
-            "title": doc_title,
-            "content": content_to_process.strip(),
-            "type": "expertise_document"
-        }]
+        print(f"\n✅ База создана!")
+        print(f"   Всего документов: {self.metadata['total_documents']}")
+        print(f"   Всего разделов: {self.metadata['total_sections']}")
+        
+        # Статистика по форматам
+        format_stats = {}
+        for section in all_sections:
+            ext = section.get("document_extension", ".txt").lower()
+            format_stats[ext] = format_stats.get(ext, 0) + 1
+        
+        print(f"   Форматы документов:")
+        for ext, count in format_stats.items():
+            print(f"     {ext}: {count} документов")
+        
+        for folder_name, stats in folder_stats.items():
+            print(f"   📁 {folder_name}: {stats['documents']} док. → {stats['sections']} разд.")
+        
+        return all_sections
     
-    def get_sections_for_display(self) -> List[Dict]:
-        """Возвращает разделы для отображения с удобной структуряой"""
-        display_data = []
+    def get_sections_frame(self, selected_ids=()) -> pd.DataFrame:
+        """
+        Возвращает таблицу разделов для отображения (без текстов разделов).
+        Таблица строится один раз и кэшируется до следующего изменения базы,
+        колонка "selected" пересчитывается по выбору пользователя при каждом вызове.
+        """
+        frame = self._frame_cache.get("sections")
+        if frame is None:
+            frame = self._frame_cache["sections"] = self._build_sections_frame()
+        
+        return frame.assign(
+            selected=frame["id"].isin(selected_ids)
+        )
+    
+    def _build_sections_frame(self) -> pd.DataFrame:
+        """Строит колоночную таблицу разделов с готовыми полями для фильтров"""
+        # Число вложенных разделов для узлов иерархии
+        children_count = {}
+        for section in self.sections:
+            if section.get("parent_id"):
+                children_count[section["parent_id"]] = children_count.get(section["parent_id"], 0) + 1
+        
+        format_icons = {
+            ".md": "📝",
+            ".txt": "📄",
+            ".rtf": "📋"
+        }
+        
+        columns = {
+            "id": [], "folder": [], "document": [], "document_full": [], "file": [],
+            "extension": [], "section": [], "section_full": [], "type": [],
+            "words": [], "tokens": [], "level": [], "children": [],
+            "duplicate_of": [], "duplicates": []
+        }
         
         for section in self.sections:
-            section_id = section.get("id", str(uuid.uuid4()))
+            section_id = section.get("id", "")
             folder = section.get("folder", "unknown")
             doc_file = section.get("document", "")
             doc_ext = section.get("document_extension", ".txt")
             doc_title = section.get("document_title", doc_file)
             section_title = section.get("title", doc_title)
-            section_type = section.get("section_type", "text")
-            content = section.get("content", "")
-            word_count = section.get("word_count", 0)
-            selected = section.get("selected", False)
             
             # Сокращаем заголовок для отображения
             short_doc_title = doc_title[:40] + "..." if len(doc_title) > 40 else doc_title
@@ -953,101 +3652,274 @@ class SimpleSectionDatabase:
                 short_section_title = f"[{short_section_title}]"
                 section_title = f"[{section_title}]"
             
-            # Добавляем иконку формата
-            format_icon = {
-                ".md": "📝",
-                ".txt": "📄",
-                ".rtf": "📋"
-            }.get(doc_ext.lower(), "📎")
-            
-            display_data.append({
-                "id": section_id,
-                "folder": folder,
-                "document": f"{format_icon} {short_doc_title}",
-                "document_full": doc_title,
-                "file": doc_file,
-                "extension": doc_ext,
-                "section": short_section_title,
-                "section_full": section_title,
-                "type": section_type,
-                "words": word_count,
-                "selected": selected,
-                "content_full": content
-            })
+            columns["id"].append(section_id)
+            columns["folder"].append(folder)
+            columns["document"].append(f"{format_icons.get(doc_ext.lower(), '📎')} {short_doc_title}")
+            columns["document_full"].append(doc_title)
+            columns["file"].append(doc_file)
+            columns["extension"].append(doc_ext)
+            columns["section"].append(short_section_title)
+            columns["section_full"].append(section_title)
+            columns["type"].append(section.get("section_type", "text"))
+            columns["words"].append(section.get("word_count", 0))
+            columns["tokens"].append(ExpertFileGenerator.section_tokens(section))
+            columns["level"].append(section.get("level", 0))
+            columns["children"].append(children_count.get(section_id, 0))
+            # Повторы: у основного раздела группы - число повторов, у остальных - ID основного
+            main_id = self.duplicate_index.duplicate_of.get(section_id, section_id)
+            columns["duplicate_of"].append("" if main_id == section_id else main_id)
+            columns["duplicates"].append(len(self.duplicate_index.groups.get(section_id, [None])) - 1)
         
-        return display_data
-    
-    def update_selections(self, selected_ids: List[str]):
-        """Обновляет выбор эксперта"""
-        for section in self.sections:
-            section_id = section.get("id", "")
-            section["selected"] = section_id in selected_ids
+        frame = pd.DataFrame(columns)
+        frame["folder"] = frame["folder"].astype("category")
+        frame["type"] = frame["type"].astype("category")
+        frame["extension"] = frame["extension"].astype("category")
+        frame["words"] = frame["words"].astype("int64")
+        frame["tokens"] = frame["tokens"].astype("int64")
+        frame["level"] = frame["level"].astype("int64")
+        frame["duplicates"] = frame["duplicates"].astype("int64")
+        # Текст для поиска по документу и разделу в нижнем регистре
+        # (astype(str): у пустой базы столбцы создаются как float64)
+        frame["search_text"] = (
+            frame["document_full"].astype(str) + "\n" + frame["section_full"].astype(str)
+        ).str.lower()
         
-        self.save_database()
+        return frame
     
-    def get_selected_sections(self) -> List[Dict]:
-        """Возвращает выбранные экспертом разделы"""
-        return [s for s in self.sections if s.get("selected", False)]
+    def get_section(self, section_id: str) -> Optional[Dict]:
+        """Возвращает раздел по ID"""
+        return self.sections_by_id.get(section_id)
     
-    def clear_selections(self):
-        """Очищает все выборы"""
+    def get_selected_sections(self, selected_ids, with_content: bool = False) -> List[Dict]:
+        """
+        Возвращает выбранные экспертом разделы в порядке базы. Выбранный узел
+        иерархии (глава, статья) включает все вложенные разделы; пустые
+        узлы-заголовки пропускаются. with_content - сразу подгрузить тексты
+        всех разделов (в ленивом режиме разделы хранятся без них); файлы сессии
+        подгружают тексты порциями сами (ExpertFileGenerator.create_prompt_file).
+        """
+        included = set()
+        result = []
         for section in self.sections:
-            section["selected"] = False
-        
-        self.save_database()
+            section_id = section.get("id")
+            if section_id in selected_ids or section.get("parent_id") in included:
+                included.add(section_id)
+                if section.get("content") or section.get("word_count") or "parent_id" not in section:
+                    result.append(section)
+        return self.with_content(result) if with_content else result
 
 # ==============================================
-# ГЕНЕРАТОР ФАЙЛОВ ДЛЯ ЭКСПЕРТА
+# ВЫБОР РАЗДЕЛОВ ПОЛЬЗОВАТЕЛЯ
 # ==============================================
 
-class ExpertFileGenerator:
-    """Генерирует файлы для работы эксперта с DeepSeek"""
+class SelectionSet:
+    """
+    Выбор разделов одного пользователя: множество ID, которое сохраняется
+    отдельно от базы (файл selections/<пользователь>.json или таблица
+    user_selections в SQLite). Общая база разделов при выборе не меняется,
+    поэтому несколько экспертов работают с одним сервером независимо.
+    """
     
-    @staticmethod
-    def _clean_content_for_output(content: str) -> str:
-        """Дополнительная очистка контента для вывода в файлы - удаляет лишние пробелы и пустые строки"""
-        if not content:
-            return content
-        
-        # Удаляем множественные переносы строк (оставляем максимум 2 подряд)
-        cleaned = re.sub(r'\n{3,}', '\n\n', content)
+    DEFAULT_USER = "default"
+    
+    def __init__(self, db: SimpleSectionDatabase, user_id: str = DEFAULT_USER):
+        self.db = db
+        self.user_id = user_id or self.DEFAULT_USER
+        self.generation = db.generation
+        self.selected_ids: set = set()
+        self.load()
+    
+    def load(self):
+        """Загружает сохраненный выбор пользователя"""
+        try:
+            section_ids = self.db.storage.load_user_selection(self.user_id)
+        except Exception as e:
+            print(f"❌ Ошибка загрузки выбора пользователя {self.user_id}: {e}")
+            section_ids = []
         
-        # Удаляем пустые строки в начале и конце
-        cleaned = cleaned.strip()
+        if section_ids is None:
+            section_ids = []
+            # Общий выбор из старых версий базы переходит пользователю по умолчанию
+            if self.user_id == self.DEFAULT_USER:
+                section_ids = [s.get("id") for s in self.db.sections if s.get("selected", False)]
+                if section_ids:
+                    self.selected_ids = set(section_ids)
+                    self.save()
+                    print(f"↪ Общий выбор ({len(section_ids)} разделов) перенесен пользователю {self.user_id}")
         
-        # Удаляем пробелы в начале и конце каждой строки
-        lines = cleaned.split('\n')
-        cleaned_lines = []
+        self.generation = self.db.generation
+        self.selected_ids = self.db.resolve_section_ids(section_ids)
+    
+    def sync(self):
+        """Приводит выбор к текущей версии базы после пересканирования"""
+        if self.generation != self.db.generation:
+            self.selected_ids = self.db.resolve_section_ids(self.selected_ids)
+            self.generation = self.db.generation
+    
+    def save(self):
+        """Сохраняем выбор пользователя (без перезаписи базы разделов)"""
+        try:
+            self.db.storage.save_user_selection(self.user_id, sorted(self.selected_ids))
+            print(f"💾 Выбор пользователя {self.user_id} сохранен")
+        except Exception as e:
+            print(f"❌ Ошибка сохранения выбора: {e}")
+    
+    def is_selected(self, section_id: str) -> bool:
+        """Выбран ли раздел"""
+        return section_id in self.selected_ids
+    
+    def set_selected(self, section_ids, selected: bool = True) -> int:
+        """
+        Отмечает или снимает выбор у разделов (без сохранения на диск).
+        Возвращает число разделов, у которых отметка изменилась.
+        """
+        changed = 0
+        for section_id in section_ids:
+            if section_id not in self.db.sections_by_id or (section_id in self.selected_ids) == selected:
+                continue
+            
+            if selected:
+                self.selected_ids.add(section_id)
+            else:
+                self.selected_ids.discard(section_id)
+            changed += 1
+        return changed
+    
+    def get_selected_sections(self, with_content: bool = False) -> List[Dict]:
+        """Выбранные разделы (с вложенными разделами выбранных узлов иерархии)"""
+        return self.db.get_selected_sections(self.selected_ids, with_content)
+    
+    def clear(self):
+        """Очищает выбор и сохраняет его"""
+        self.selected_ids = set()
+        self.save()
+
+# ==============================================
+# ФОНОВОЕ ОБНОВЛЕНИЕ БАЗЫ ПРИ ИЗМЕНЕНИИ ПАПОК
+# ==============================================
+
+class FolderWatcher:
+    """
+    Фоновый поток, который поддерживает базу в актуальном состоянии
+    (watch_folders в config.json). Раз в watch_interval секунд он сравнивает
+    размер и время изменения файлов в папках документов с прошлой проверкой.
+    Когда изменения прекращаются хотя бы на watch_debounce секунд (диск
+    закончил синхронизацию), запускается инкрементальное сканирование:
+    заново обрабатываются только добавленные и измененные файлы.
+    
+    Используется опрос, а не уведомления файловой системы: папки лежат на
+    синхронизируемом диске, где уведомления приходят не всегда. Открытые
+    страницы видят новую версию базы (generation) при следующем обновлении,
+    без перезапуска приложения.
+    """
+    
+    def __init__(self, db: SimpleSectionDatabase, interval: float = 10.0, debounce: float = 5.0):
+        self.db = db
+        self.interval = max(float(interval), 1.0)
+        self.debounce = max(float(debounce), 0.0)
+        self.last_check: Optional[datetime] = None
+        self.last_update: Optional[datetime] = None
+        self.last_generation = db.generation  # версия базы после последнего фонового обновления
+        self.last_error = ""
         
-        for line in lines:
-            line = line.strip()
-            if line:  # добавляем только непустые строки
-                # Удаляем множественные пробелы внутри строки
-                line = re.sub(r' +', ' ', line)
-                cleaned_lines.append(line)
+        # Начальное состояние папок - из манифеста: изменения, сделанные,
+        # пока приложение не работало, тоже попадут в базу
+        self._snapshot = {
+            path: (info.get("folder"), info.get("size"), info.get("mtime"))
+            for path, info in db.manifest.get("files", {}).items()
+        }
+        self._changed_at: Optional[float] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+    
+    def snapshot(self) -> Dict[str, tuple]:
+        """Состояние файлов папок: путь → (тип папки, размер, время изменения)"""
+        files = {}
+        for folder_name, folder_path in CONFIG["folders"].items():
+            if not folder_path or not Path(folder_path).exists():
+                continue
+            for file_path in self.db._list_folder_files(Path(folder_path)):
+                try:
+                    stat = file_path.stat()
+                except OSError:
+                    continue
+                files[str(file_path)] = (folder_name, stat.st_size, stat.st_mtime_ns)
+        return files
+    
+    def poll(self) -> bool:
+        """Одна проверка папок. Возвращает True, если запускалось сканирование"""
+        snapshot = self.snapshot()
+        now = time.monotonic()
+        self.last_check = datetime.now()
         
-        # Собираем обратно, оставляя по одной пустой строки между абзацами
-        if not cleaned_lines:
-            return ""
+        if snapshot != self._snapshot:
+            # Файлы еще меняются - ждем, пока синхронизация закончится
+            self._snapshot = snapshot
+            self._changed_at = now
+            return False
         
-        result = []
-        for i, line in enumerate(cleaned_lines):
-            result.append(line)
-            # Добавляем пустую строку только если следующая строка не пустая
-            # и если это не последняя строка
-            if i < len(cleaned_lines) - 1 and cleaned_lines[i+1]:
-                result.append('')
+        if self._changed_at is None or now - self._changed_at < self.debounce:
+            return False
         
-        return '\n'.join(result)
+        self._changed_at = None
+        print("👁 Изменились файлы в папках документов, обновляю базу")
+        generation = self.db.generation
+        self.db.scan_and_build_database(incremental=True)
+        if self.db.generation != generation:
+            self.last_update = datetime.now()
+            self.last_generation = self.db.generation
+        return True
+    
+    def _run(self):
+        print(f"👁 Наблюдение за папками: проверка каждые {self.interval:g} с")
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+                self.last_error = ""
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"❌ Ошибка фонового обновления базы: {e}")
+    
+    def start(self):
+        """Запускает поток наблюдения (повторный вызов ничего не делает)"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="folder-watcher", daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        """Останавливает поток наблюдения"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+# ==============================================
+# ГЕНЕРАТОР ФАЙЛОВ ДЛЯ ЭКСПЕРТА
+# ==============================================
+
+class ExpertFileGenerator:
+    """Генерирует файлы для работы эксперта с DeepSeek"""
     
     @staticmethod
     def create_prompt_file(selected_sections: List[Dict], output_dir: Path, 
-                         template_manager: TemplateManager, selected_template_id: str) -> Optional[Path]:
-        """Создает файл с промтом для DeepSeek и возвращает путь к папке сессии"""
+                         template_manager: TemplateManager, selected_template_id: str,
+                         duplicate_of: Optional[Dict[str, str]] = None,
+                         question: str = "", session_id: Optional[str] = None,
+                         content_loader: Optional[Callable[[List[Dict]], List[Dict]]] = None) -> Optional[Path]:
+        """
+        Создает файл с промтом для DeepSeek и возвращает путь к папке сессии.
+        duplicate_of - группы повторов (ID раздела → ID основного раздела группы)
+        для исключения повторов по настройке prompt_duplicates.
+        question - текст вопроса, дописывается в промт после шаблона (пакетный режим);
+        session_id - имя папки сессии вместо времени создания.
+        content_loader - подгрузка текстов разделов без текста (SimpleSectionDatabase.with_content):
+        тексты читаются небольшими порциями по ходу записи, а не для всего выбора сразу.
+        """
         if not selected_sections:
             return None
         
-        session_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+        session_id = session_id or datetime.now().strftime("%Y%m%d_%H%M%S")
         session_dir = output_dir / session_id
         session_dir.mkdir(exist_ok=True, parents=True)
         
@@ -1055,121 +3927,79 @@ class ExpertFileGenerator:
         selected_template = template_manager.get_template_by_id(selected_template_id)
         if not selected_template:
             selected_template = template_manager.get_default_template()
+        template_prompt = selected_template.get('prompt', '')
+        if question and question.strip():
+            template_prompt += f"\n\nВОПРОС:\n{question.strip()}"
         
-        # 1. Создаем файл all_sections.md
-        all_sections_file = session_dir / "all_sections.md"
+        # Повторяющиеся разделы исключаются до бюджета, чтобы не тратить его на повторы
+        selected_sections, duplicates_report = ExpertFileGenerator._apply_duplicates(
+            selected_sections, duplicate_of or {}, CONFIG.get("prompt_duplicates", "keep")
+        )
+        
+        # Укладываем разделы в бюджет токенов шаблона (если он задан)
+        budget_report = None
+        token_budget = int(selected_template.get("token_budget", 0) or 0)
+        if token_budget > 0:
+            selected_sections, budget_report = ExpertFileGenerator._apply_token_budget(
+                selected_sections, token_budget, template_prompt, content_loader
+            )
+        
+        # 1, 2, 4. Файлы с текстами разделов: каждый раздел очищается один раз
+        # и сразу дописывается во все файлы в порядке выбора. all_sections.md
+        # группирует разделы по папкам: группы копятся во временных файлах и
+        # собираются в конце, в памяти держится только текущая порция текстов
         try:
-            with open(all_sections_file, 'w', encoding='utf-8') as f:
-                f.write("# ВЫБРАННЫЕ РАЗДЕЛЫ ДЛЯ ОТВЕТА\n\n")
-                f.write(f"**Используемый шаблон:** {selected_template.get('name', 'Стандартный')}\n\n")
+            with open(session_dir / "all_sections.md", 'w', encoding='utf-8') as markdown_file, \
+                    open(session_dir / "deepseek_prompt.txt", 'w', encoding='utf-8') as prompt_file, \
+                    open(session_dir / "sections_data.json", 'w', encoding='utf-8') as json_file, \
+                    ExitStack() as folder_parts:
+                markdown_file.write("# ВЫБРАННЫЕ РАЗДЕЛЫ ДЛЯ ОТВЕТА\n\n")
+                markdown_file.write(f"**Используемый шаблон:** {selected_template.get('name', 'Стандартный')}\n\n")
+                ExpertFileGenerator._write_prompt_header(prompt_file, template_prompt)
+                json_file.write("[")
                 
-                by_folder = {}
-                for section in selected_sections:
+                markdown_parts = {}  # папка → временный файл с ее разделами
+                sections_with_content = ExpertFileGenerator._iter_with_content(selected_sections, content_loader)
+                for i, section in enumerate(sections_with_content, 1):
                     folder = section.get("folder", "unknown")
-                    if folder not in by_folder:
-                        by_folder[folder] = []
-                    by_folder[folder].append(section)
+                    if folder not in markdown_parts:
+                        markdown_parts[folder] = folder_parts.enter_context(
+                            tempfile.TemporaryFile('w+', encoding='utf-8', dir=session_dir)
+                        )
+                    
+                    cleaned_content = TextCleaner.format_for_output(section.get('content', ''))
+                    ExpertFileGenerator._write_markdown_section(markdown_parts[folder], section, cleaned_content)
+                    ExpertFileGenerator._write_prompt_section(prompt_file, i, section, cleaned_content)
+                    ExpertFileGenerator._write_json_section(json_file, section, first=(i == 1))
                 
-                folder_names = {
-                    "normative": "📖 НОРМАТИВНЫЕ АКТЫ",
-                    "methodology": "📚 МЕТОДИЧЕСКИЕ МАТЕРИАЛЫ",
-                    "structured": "🗂️ СТРУКТУРИРОВАННЫЕ ДОКУМЕНТЫ",
-                    "expertise": "👨‍⚖️ ЭКСПЕРТНЫЕ ЗАКЛЮЧЕНИЯ"
-                }
+                for folder, part in markdown_parts.items():
+                    markdown_file.write(f"\n## {ExpertFileGenerator.MARKDOWN_FOLDER_NAMES.get(folder, folder)}\n\n")
+                    part.seek(0)
+                    shutil.copyfileobj(part, markdown_file)
                 
-                for folder, sections in by_folder.items():
-                    folder_name = folder_names.get(folder, folder)
-                    
-                    f.write(f"\n## {folder_name}\n\n")
-                    
-                    for section in sections:
-                        # Для структурированных документов добавляем скобки в заголовок
-                        section_title = section.get('title', 'Без названия')
-                        if folder == "structured" and not section_title.startswith("["):
-                            section_title = f"[{section_title}]"
-                        
-                        f.write(f"### {section_title}\n")
-                        f.write(f"*Название документа:* {section.get('document_title', section.get('document', 'Без названия'))}\n")
-                        f.write(f"*Файл:* {section.get('document', '')}\n")
-                        f.write(f"*Формат:* {section.get('document_extension', '.txt')}\n")
-                        f.write(f"*Тип раздела:* {section.get('section_type', 'text')}\n")
-                        f.write(f"*Количество слов:* {section.get('word_count', 0)}\n")
-                        
-                        metadata = section.get('metadata', {})
-                        if metadata and isinstance(metadata, dict):
-                            if metadata.get('title'):
-                                f.write(f"*Название:* {metadata['title']}\n")
-                            if metadata.get('author'):
-                                f.write(f"*Автор:* {metadata['author']}\n")
-                            if metadata.get('date'):
-                                f.write(f"*Дата:* {metadata['date']}\n")
-                        
-                        # Очищаем контент перед записью
-                        cleaned_content = ExpertFileGenerator._clean_content_for_output(section.get('content', ''))
-                        f.write(f"\n{cleaned_content}\n\n")
-                        f.write("---\n\n")
-        except Exception as e:
-            print(f"Ошибка при создании all_sections.md: {e}")
-            return None
-        
-        # 2. Создаем файл deepseek_prompt.txt
-        prompt_file = session_dir / "deepseek_prompt.txt"
-        try:
-            with open(prompt_file, 'w', encoding='utf-8') as f:
-                prompt_content = ExpertFileGenerator._generate_prompt(
-                    selected_sections, 
-                    selected_template.get('prompt', '')
-                )
-                f.write(prompt_content)
+                prompt_file.write(f"\n{'='*60}\n\n")
+                json_file.write("\n]" if selected_sections else "]")
         except Exception as e:
-            print(f"Ошибка при создании deepseek_prompt.txt: {e}")
+            print(f"Ошибка при создании файлов с разделами: {e}")
             return None
         
-        # 3. Создаем файл report.txt
+        # 3. Создаем файл report.txt (только метаданные разделов)
         report_file = session_dir / "report.txt"
         try:
             with open(report_file, 'w', encoding='utf-8') as f:
                 report_content = ExpertFileGenerator._generate_report(
                     selected_sections, 
                     session_id, 
-                    selected_template
+                    selected_template,
+                    budget_report,
+                    duplicates_report,
+                    question
                 )
                 f.write(report_content)
         except Exception as e:
             print(f"Ошибка при создании report.txt: {e}")
             return None
         
-        # 4. Создаем файл sections_data.json
-        json_file = session_dir / "sections_data.json"
-        try:
-            with open(json_file, 'w', encoding='utf-8') as f:
-                # Упрощаем данные для JSON
-                simplified_sections = []
-                for section in selected_sections:
-                    # Для структурированных документов добавляем скобки в заголовок
-                    title = section.get("title", "")
-                    if section.get("folder") == "structured" and not title.startswith("["):
-                        title = f"[{title}]"
-                    
-                    simplified = {
-                        "id": section.get("id"),
-                        "folder": section.get("folder"),
-                        "document": section.get("document"),
-                        "document_extension": section.get("document_extension"),
-                        "document_title": section.get("document_title"),
-                        "title": title,
-                        "content": section.get("content"),
-                        "section_type": section.get("section_type"),
-                        "word_count": section.get("word_count"),
-                        "metadata": section.get("metadata", {})
-                    }
-                    simplified_sections.append(simplified)
-                
-                json.dump(simplified_sections, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"Ошибка при создании sections_data.json: {e}")
-            return None
-        
         # 5. Сохраняем информацию о шаблоне
         template_file = session_dir / "template_info.json"
         try:
@@ -1180,6 +4010,8 @@ class ExpertFileGenerator:
                     "template_description": selected_template.get("description"),
                     "created_at": datetime.now().isoformat()
                 }
+                if question:
+                    template_info["question"] = question.strip()
                 json.dump(template_info, f, ensure_ascii=False, indent=2)
         except Exception as e:
             print(f"Ошибка при создании template_info.json: {e}")
@@ -1194,63 +4026,301 @@ class ExpertFileGenerator:
         
         return session_dir
     
+    # Оценка постоянной части служебных строк, которые промт добавляет к каждому разделу
+    SECTION_HEADER_TOKENS = 70
+    # Меньший остаток бюджета не используется для сокращенного раздела
+    MIN_TRIMMED_TOKENS = 150
+    TRIM_MARKER = "[... раздел сокращен до бюджета токенов ...]"
+    
+    @staticmethod
+    def section_tokens(section: Dict) -> int:
+        """Оценка токенов раздела (из базы, а для старых баз - по тексту)"""
+        if "token_count" in section:
+            return section["token_count"]
+        return estimate_tokens(section.get("content", ""))
+    
+    @staticmethod
+    def header_tokens(section: Dict) -> int:
+        """Оценка служебных строк раздела в промте (заголовок, документ, расположение)"""
+        return ExpertFileGenerator.SECTION_HEADER_TOKENS + estimate_tokens(
+            section.get("title", "") + section.get("document_title", "") +
+            section.get("document", "") + section.get("parent_path", "")
+        )
+    
+    @staticmethod
+    def estimate_prompt_tokens(sections: List[Dict], template_prompt: str) -> int:
+        """Оценка размера промта в токенах: шаблон, служебные строки и тексты разделов"""
+        return (estimate_tokens(template_prompt) +
+                sum(ExpertFileGenerator.section_tokens(s) + ExpertFileGenerator.header_tokens(s)
+                    for s in sections))
+    
     @staticmethod
-    def _generate_prompt(sections: List[Dict], template_prompt: str) -> str:
-        """Генерирует промт для DeepSeek (вопрос ПЕРЕД материалами)"""
-        prompt = ""
+    def _trim_to_tokens(content: str, max_tokens: int) -> str:
+        """Обрезает текст по границе абзаца (или слова, если первый абзац слишком длинный)"""
+        kept = []
+        used = 0
+        for paragraph in content.split('\n'):
+            paragraph_tokens = estimate_tokens(paragraph) + 1
+            if used + paragraph_tokens > max_tokens:
+                break
+            kept.append(paragraph)
+            used += paragraph_tokens
         
-        # 1. Сначала добавляем вопрос (шаблон)
-        prompt += template_prompt
-        prompt += "\n\n"
+        if not kept:
+            cut = content[:int(max_tokens * CHARS_PER_TOKEN)]
+            kept = [cut.rsplit(' ', 1)[0] if ' ' in cut else cut]
         
-        # 2. Затем добавляем материалы
-        prompt += "МАТЕРИАЛЫ ДЛЯ ОТВЕТА:\n"
-        prompt += "=" * 60 + "\n\n"
+        return '\n'.join(kept)
+    
+    @staticmethod
+    def _section_priority(section: Dict) -> int:
+        """Приоритет папки раздела при упаковке в бюджет (меньше - важнее)"""
+        priority = CONFIG.get("token_budget_priority") or list(CONFIG["folders"].keys())
+        folder = section.get("folder", "unknown")
+        return priority.index(folder) if folder in priority else len(priority)
+    
+    @staticmethod
+    def _apply_token_budget(sections: List[Dict], budget: int, template_prompt: str,
+                            content_loader=None) -> tuple:
+        """
+        Упаковывает разделы в бюджет токенов. Разделы берутся по приоритету папки
+        (token_budget_priority в config.json), внутри папки - в порядке выбора.
+        Раздел, который не помещается целиком, сокращается по границе абзаца,
+        если остаток бюджета достаточно велик, иначе исключается.
+        Возвращает (разделы в исходном порядке, отчет о бюджете).
+        """
+        remaining = budget - estimate_tokens(template_prompt)
+        packed = {}
+        report = {
+            "budget": budget,
+            "requested": ExpertFileGenerator.estimate_prompt_tokens(sections, template_prompt),
+            "used": 0,
+            "trimmed": [],
+            "dropped": []
+        }
         
-        for i, section in enumerate(sections, 1):
-            folder = section.get("folder", "unknown")
-            folder_name = {
-                "normative": "Нормативный акт",
-                "methodology": "Методический материал",
-                "structured": "Структурированный документ",
-                "expertise": "Экспертное заключение"
-            }.get(folder, "Материал")
-            
-            section_title = section.get("title", "Без названия")
-            # Для структурированных документов добавляем скобки в заголовок
-            if folder == "structured" and not section_title.startswith("["):
-                section_title = f"[{section_title}]"
-                
-            doc_title = section.get("document_title", section.get("document", "Без названия"))
-            doc_file = section.get("document", "")
-            doc_ext = section.get("document_extension", ".txt")
-            section_type = section.get("section_type", "text")
-            
-            prompt += f"\n{'='*60}\n"
-            prompt += f"МАТЕРИАЛ {i}: {section_title}\n"
-            prompt += f"Тип: {folder_name} | Документ: {doc_title}\n"
-            prompt += f"Файл: {doc_file} | Формат: {doc_ext} | Тип раздела: {section_type}\n"
-            
-            metadata = section.get('metadata', {})
-            if metadata and isinstance(metadata, dict):
-                if metadata.get('author'):
-                    prompt += f"Автор: {metadata['author']} | "
-                if metadata.get('date'):
-                    prompt += f"Дата: {metadata['date']}"
-                prompt += f"\n"
+        order = sorted(range(len(sections)), key=lambda i: ExpertFileGenerator._section_priority(sections[i]))
+        for i in order:
+            section = sections[i]
+            tokens = ExpertFileGenerator.section_tokens(section)
+            header = ExpertFileGenerator.header_tokens(section)
+            cost = tokens + header
+            info = {
+                "id": section.get("id"),
+                "title": section.get("title", "Без названия"),
+                "document": section.get("document", ""),
+                "tokens": tokens
+            }
             
-            prompt += f"{'-'*40}\n\n"
+            if cost <= remaining:
+                packed[i] = section
+                remaining -= cost
+                continue
             
-            # Очищаем контент перед добавлением
-            cleaned_content = ExpertFileGenerator._clean_content_for_output(section.get('content', ''))
-            prompt += f"{cleaned_content}\n"
+            allowance = remaining - header - estimate_tokens(ExpertFileGenerator.TRIM_MARKER)
+            if allowance >= ExpertFileGenerator.MIN_TRIMMED_TOKENS:
+                if content_loader and "content" not in section:
+                    section = content_loader([section])[0]
+                trimmed_content = ExpertFileGenerator._trim_to_tokens(section.get("content", ""), allowance)
+                trimmed_content += f"\n{ExpertFileGenerator.TRIM_MARKER}"
+                kept_tokens = estimate_tokens(trimmed_content)
+                
+                packed[i] = {
+                    **section,
+                    "content": trimmed_content,
+                    "word_count": len(trimmed_content.split()),
+                    "token_count": kept_tokens,
+                    "trimmed": True
+                }
+                remaining -= kept_tokens + header
+                report["trimmed"].append({**info, "kept_tokens": kept_tokens})
+            else:
+                report["dropped"].append(info)
+        
+        result = [packed[i] for i in sorted(packed)]
+        report["used"] = ExpertFileGenerator.estimate_prompt_tokens(result, template_prompt)
+        
+        if report["trimmed"] or report["dropped"]:
+            print(f"✂️ Бюджет {budget} токенов: сокращено {len(report['trimmed'])}, "
+                  f"исключено {len(report['dropped'])} разделов")
+        
+        return result, report
+    
+    @staticmethod
+    def _apply_duplicates(sections: List[Dict], duplicate_of: Dict[str, str], mode: str) -> tuple:
+        """
+        Исключает повторы из выбранных разделов: из каждой группы повторов
+        остается раздел самой приоритетной папки (token_budget_priority), при
+        равенстве - первый выбранный. mode: keep - оставить все, drop - исключить
+        повторы, collapse - исключить и указать в оставленном разделе, где он
+        повторяется. Возвращает (разделы в исходном порядке, исключенные повторы).
+        """
+        if mode not in ("drop", "collapse") or not duplicate_of:
+            return sections, []
+        
+        kept = {}  # основной раздел группы → индекс оставленного раздела
+        removed = {}  # индекс исключенного раздела → индекс оставленного
+        order = sorted(range(len(sections)), key=lambda i: ExpertFileGenerator._section_priority(sections[i]))
+        for i in order:
+            group = duplicate_of.get(sections[i].get("id"))
+            if group is None:
+                continue
+            if group in kept:
+                removed[i] = kept[group]
+            else:
+                kept[group] = i
+        
+        repeated_in = {}
+        report = []
+        for i, k in removed.items():
+            section, main = sections[i], sections[k]
+            place = f"{section.get('title', 'Без названия')} ({section.get('document_title', section.get('document', ''))})"
+            repeated_in.setdefault(k, []).append(place)
+            report.append({
+                "title": section.get("title", "Без названия"),
+                "document": section.get("document", ""),
+                "kept_title": main.get("title", "Без названия"),
+                "kept_document": main.get("document", "")
+            })
+        
+        result = []
+        for i, section in enumerate(sections):
+            if i in removed:
+                continue
+            if mode == "collapse" and i in repeated_in:
+                section = {**section, "repeated_in": repeated_in[i]}
+            result.append(section)
+        
+        if removed:
+            print(f"♊ Исключено повторяющихся разделов: {len(removed)}")
+        return result, report
+    
+    # Заголовки групп в all_sections.md и названия типов материалов в промте
+    MARKDOWN_FOLDER_NAMES = {
+        "normative": "📖 НОРМАТИВНЫЕ АКТЫ",
+        "methodology": "📚 МЕТОДИЧЕСКИЕ МАТЕРИАЛЫ",
+        "structured": "🗂️ СТРУКТУРИРОВАННЫЕ ДОКУМЕНТЫ",
+        "expertise": "👨‍⚖️ ЭКСПЕРТНЫЕ ЗАКЛЮЧЕНИЯ"
+    }
+    PROMPT_FOLDER_NAMES = {
+        "normative": "Нормативный акт",
+        "methodology": "Методический материал",
+        "structured": "Структурированный документ",
+        "expertise": "Экспертное заключение"
+    }
+    
+    # Сколько текстов разделов подгружается из хранилища за один раз при записи сессии
+    CONTENT_BATCH = 32
+    
+    @staticmethod
+    def _iter_with_content(sections: List[Dict], content_loader=None):
+        """Разделы с текстами по порядку; тексты подгружаются порциями по CONTENT_BATCH"""
+        batch_size = ExpertFileGenerator.CONTENT_BATCH
+        for start in range(0, len(sections), batch_size):
+            batch = sections[start:start + batch_size]
+            if content_loader and any("content" not in section for section in batch):
+                batch = content_loader(batch)
+            yield from batch
+    
+    @staticmethod
+    def _section_title(section: Dict) -> str:
+        """Заголовок раздела для вывода (у структурированных документов - в скобках)"""
+        title = section.get("title", "Без названия")
+        if section.get("folder") == "structured" and not title.startswith("["):
+            title = f"[{title}]"
+        return title
+    
+    @staticmethod
+    def _write_markdown_section(f, section: Dict, cleaned_content: str):
+        """Дописывает раздел в all_sections.md"""
+        f.write(f"### {ExpertFileGenerator._section_title(section)}\n")
+        f.write(f"*Название документа:* {section.get('document_title', section.get('document', 'Без названия'))}\n")
+        f.write(f"*Файл:* {section.get('document', '')}\n")
+        f.write(f"*Формат:* {section.get('document_extension', '.txt')}\n")
+        f.write(f"*Тип раздела:* {section.get('section_type', 'text')}\n")
+        if section.get('parent_path'):
+            f.write(f"*Расположение:* {section['parent_path']}\n")
+        f.write(f"*Количество слов:* {section.get('word_count', 0)}\n")
+        if section.get('repeated_in'):
+            f.write(f"*Повторяется также в:* {'; '.join(section['repeated_in'])}\n")
+        
+        metadata = section.get('metadata', {})
+        if metadata and isinstance(metadata, dict):
+            if metadata.get('title'):
+                f.write(f"*Название:* {metadata['title']}\n")
+            if metadata.get('author'):
+                f.write(f"*Автор:* {metadata['author']}\n")
+            if metadata.get('date'):
+                f.write(f"*Дата:* {metadata['date']}\n")
+        
+        f.write(f"\n{cleaned_content}\n\n")
+        f.write("---\n\n")
+    
+    @staticmethod
+    def _write_prompt_header(f, template_prompt: str):
+        """Начало промта для DeepSeek: вопрос (шаблон) ПЕРЕД материалами"""
+        f.write(template_prompt)
+        f.write("\n\n")
+        f.write("МАТЕРИАЛЫ ДЛЯ ОТВЕТА:\n")
+        f.write("=" * 60 + "\n\n")
+    
+    @staticmethod
+    def _write_prompt_section(f, number: int, section: Dict, cleaned_content: str):
+        """Дописывает раздел в промт как МАТЕРИАЛ с номером"""
+        folder_name = ExpertFileGenerator.PROMPT_FOLDER_NAMES.get(section.get("folder", "unknown"), "Материал")
+        doc_title = section.get("document_title", section.get("document", "Без названия"))
+        
+        f.write(f"\n{'='*60}\n")
+        f.write(f"МАТЕРИАЛ {number}: {ExpertFileGenerator._section_title(section)}\n")
+        f.write(f"Тип: {folder_name} | Документ: {doc_title}\n")
+        f.write(f"Файл: {section.get('document', '')} | Формат: {section.get('document_extension', '.txt')} | "
+                f"Тип раздела: {section.get('section_type', 'text')}\n")
+        if section.get("parent_path"):
+            f.write(f"Расположение: {section['parent_path']}\n")
+        if section.get("repeated_in"):
+            f.write(f"Повторяется также в: {'; '.join(section['repeated_in'])}\n")
+        
+        metadata = section.get('metadata', {})
+        if metadata and isinstance(metadata, dict):
+            if metadata.get('author'):
+                f.write(f"Автор: {metadata['author']} | ")
+            if metadata.get('date'):
+                f.write(f"Дата: {metadata['date']}")
+            f.write("\n")
         
-        prompt += f"\n{'='*60}\n\n"
+        f.write(f"{'-'*40}\n\n")
+        f.write(f"{cleaned_content}\n")
+    
+    @staticmethod
+    def _write_json_section(f, section: Dict, first: bool):
+        """Дописывает упрощенный раздел элементом JSON массива sections_data.json"""
+        title = section.get("title", "")
+        if section.get("folder") == "structured" and not title.startswith("["):
+            title = f"[{title}]"
         
-        return prompt
+        simplified = {
+            "id": section.get("id"),
+            "folder": section.get("folder"),
+            "document": section.get("document"),
+            "document_extension": section.get("document_extension"),
+            "document_title": section.get("document_title"),
+            "title": title,
+            "content": section.get("content"),
+            "section_type": section.get("section_type"),
+            "word_count": section.get("word_count"),
+            "token_count": ExpertFileGenerator.section_tokens(section),
+            "trimmed": section.get("trimmed", False),
+            "metadata": section.get("metadata", {})
+        }
+        # Отступы как у json.dump(..., indent=2) для всего массива
+        item = json.dumps(simplified, ensure_ascii=False, indent=2).replace("\n", "\n  ")
+        f.write(("\n  " if first else ",\n  ") + item)
     
     @staticmethod
-    def _generate_report(sections: List[Dict], session_id: str, template: Dict) -> str:
+    def _generate_report(sections: List[Dict], session_id: str, template: Dict,
+                         budget_report: Optional[Dict] = None,
+                         duplicates_report: Optional[List[Dict]] = None,
+                         question: str = "") -> str:
         """Генерирует отчет по сессии"""
         by_folder = {}
         total_words = 0
@@ -1279,6 +4349,9 @@ class ExpertFileGenerator:
         report += f"• Описание: {template.get('description', '')}\n"
         report += f"• ID: {template.get('id', 'standard')}\n\n"
         
+        if question and question.strip():
+            report += f"ВОПРОС:\n{question.strip()}\n\n"
+        
         report += f"СТАТИСТИКА:\n"
         report += f"• Всего выбрано разделов: {len(sections)}\n"
         report += f"• Общий объем: {total_words} слов\n\n"
@@ -1335,6 +4408,32 @@ class ExpertFileGenerator:
             report += f"{i}. {folder_icon}{format_icon} {section_title} ({word_count} слов)\n"
             report += f"   Документ: {doc_title} ({doc_ext})\n"
         
+        if budget_report:
+            report += f"\nБЮДЖЕТ ТОКЕНОВ:\n"
+            report += f"• Бюджет шаблона: {budget_report['budget']} токенов\n"
+            report += f"• Использовано (оценка): {budget_report['used']} токенов\n"
+            report += f"• Выбрано до применения бюджета: {budget_report['requested']} токенов\n"
+            
+            if budget_report["trimmed"]:
+                report += f"\nСОКРАЩЕННЫЕ РАЗДЕЛЫ:\n"
+                for item in budget_report["trimmed"]:
+                    report += (f"• {item['title']} ({item['document']}): "
+                               f"оставлено {item['kept_tokens']} из {item['tokens']} токенов\n")
+            
+            if budget_report["dropped"]:
+                report += f"\nИСКЛЮЧЕННЫЕ РАЗДЕЛЫ (не поместились в бюджет):\n"
+                for item in budget_report["dropped"]:
+                    report += f"• {item['title']} ({item['document']}): {item['tokens']} токенов\n"
+            
+            if not budget_report["trimmed"] and not budget_report["dropped"]:
+                report += f"• Все разделы поместились в бюджет без сокращений\n"
+        
+        if duplicates_report:
+            report += f"\nПОВТОРЯЮЩИЕСЯ РАЗДЕЛЫ (исключены из промта):\n"
+            for item in duplicates_report:
+                report += (f"• {item['title']} ({item['document']}) - повтор раздела "
+                           f"{item['kept_title']} ({item['kept_document']})\n")
+        
         report += f"\nФАЙЛЫ СЕССИИ:\n"
         report += f"1. all_sections.md - все выбранные разделы\n"
         report += f"2. deepseek_prompt.txt - промт для DeepSeek\n"
@@ -1472,33 +4571,38 @@ div.stContainer {
 }
 </style>
 """
-st.markdown(hide_streamlit_style, unsafe_allow_html=True)
 
 # Инициализация базы данных и менеджера шаблонов
 @st.cache_resource
 def init_database():
-    return SimpleSectionDatabase()
+    db = SimpleSectionDatabase()
+    # Фоновое обновление базы - один поток на сервер (ресурс кэшируется)
+    if CONFIG.get("watch_folders", False):
+        db.watcher = FolderWatcher(db, CONFIG.get("watch_interval", 10), CONFIG.get("watch_debounce", 5))
+        db.watcher.start()
+    return db
 
 @st.cache_resource
 def init_template_manager():
     return TemplateManager()
 
-# Инициализация сессии
-if 'db' not in st.session_state:
-    st.session_state.db = init_database()
-    st.session_state.template_manager = init_template_manager()
-    st.session_state.notifications = []
-    st.session_state.last_update_time = datetime.now()
-    st.session_state.current_filter_hash = ""
-    st.session_state.has_unsaved_changes = False
-    st.session_state.session_dir = None
-    st.session_state.files_created = False
-    st.session_state.selected_template = st.session_state.template_manager.get_default_template()["id"]
-
-db = st.session_state.db
-template_manager = st.session_state.template_manager
-
 # Функция для добавления уведомлений
+def get_query_param(name: str, default: str = "") -> str:
+    """Параметр адреса страницы (st.query_params появился в Streamlit 1.30)"""
+    if hasattr(st, "query_params"):
+        return st.query_params.get(name, default)
+    values = st.experimental_get_query_params().get(name)
+    return values[0] if values else default
+
+def set_query_param(name: str, value: str):
+    """Меняет параметр адреса страницы, остальные параметры сохраняются"""
+    if hasattr(st, "query_params"):
+        st.query_params[name] = value
+    else:
+        params = st.experimental_get_query_params()
+        params[name] = value
+        st.experimental_set_query_params(**params)
+
 def add_notification(message, type="info"):
     if 'notifications' not in st.session_state:
         st.session_state.notifications = []
@@ -1512,741 +4616,1015 @@ def add_notification(message, type="info"):
     if len(st.session_state.notifications) > 10:
         st.session_state.notifications.pop(0)
 
-# Настройка страницы
-st.set_page_config(
-    page_title="База разделов документов",
-    page_icon="📚",
-    layout="wide",
-    initial_sidebar_state="expanded"
-)
-
-# Главный заголовок
-st.title("📚 БАЗА РАЗДЕЛОВ ДОКУМЕНТОВ")
-st.markdown("---")
-
-# Используем вкладки
-tab1, tab2, tab3, tab4 = st.tabs([
-    "📋 Выбор разделов",
-    "🎯 Выбор шаблона", 
-    "⚙️ Настройки",
-    "🛠️ Администрирование"
-])
+def scan_progress_callback(progress_bar):
+    """Callback сканирования базы, обновляющий полосу прогресса Streamlit"""
+    def report(done, total, file_name):
+        progress_bar.progress(done / total, text=f"Обработано файлов: {done}/{total} — {file_name}")
+    return report
 
 # ==============================================
-# ВКЛАДКА 1: ВЫБОР РАЗДЕЛОВ (компактный интерфейс)
+# ЗАПУСК ВЕБ-ИНТЕРФЕЙСА
 # ==============================================
 
-with tab1:
-    st.subheader("📋 ВЫБОР РАЗДЕЛОВ ДЛЯ ЭКСПЕРТНОГО ОТВЕТА")
+def main():
+    """
+    Строит интерфейс Streamlit. Вызывается только при запуске приложения
+    (streamlit run), а не при импорте модуля дочерними процессами пула
+    сканирования, которые заново импортируют app.py (spawn в Windows/macOS).
+    """
+    # Настройка страницы - первая команда Streamlit на странице
+    st.set_page_config(
+        page_title="База разделов документов",
+        page_icon="📚",
+        layout="wide",
+        initial_sidebar_state="expanded"
+    )
+    st.markdown(hide_streamlit_style, unsafe_allow_html=True)
+
+    # Инициализация сессии
+    if 'db' not in st.session_state:
+        st.session_state.db = init_database()
+        st.session_state.template_manager = init_template_manager()
+        st.session_state.notifications = []
+        st.session_state.last_update_time = datetime.now()
+        st.session_state.current_filter_hash = ""
+        st.session_state.page = 0
+        st.session_state.page_size = max(1, int(CONFIG.get("page_size", 50)))
+        st.session_state.has_unsaved_changes = False
+        st.session_state.session_dir = None
+        st.session_state.files_created = False
+        st.session_state.selected_template = st.session_state.template_manager.get_default_template()["id"]
     
-    # Получаем данные для отображения
-    display_data = db.get_sections_for_display()
+    render_page()
+
+
+def render_page():
+    """Строит вкладки и боковую панель интерфейса для текущего пользователя"""
+    # Страница строится по снимку базы: фоновое обновление (watch_folders) может
+    # подменить версию базы посреди вывода, снимок при этом не меняется.
+    # Сканирование, импорт и очистка меняют общую базу (shared_db)
+    shared_db = st.session_state.db
+    db = shared_db.snapshot()
     
-    if not display_data:
-        st.info("База пуста. Нажмите 'Сканировать папки' в боковой панели.")
-    else:
-        # Компактная панель фильтров
-        with st.container():
-            col1, col2, col3 = st.columns(3)
-            
-            with col1:
-                # Фильтр по папке
-                folder_options = list(set(item["folder"] for item in display_data))
-                folder_filter = st.multiselect(
-                    "Папка:",
-                    options=folder_options,
-                    default=folder_options,
-                    format_func=lambda x: {
-                        "normative": "📖 Нормативные",
-                        "methodology": "📚 Методические",
-                        "structured": "🗂️ Структурированные",
-                        "expertise": "👨‍⚖️ Экспертные"
-                    }.get(x, x)
+    # Выбор разделов - свой у каждого пользователя (?user=имя в адресе страницы)
+    if 'selection' not in st.session_state:
+        user_id = get_query_param("user", SelectionSet.DEFAULT_USER)
+        st.session_state.selection = SelectionSet(db, user_id)
+
+    template_manager = st.session_state.template_manager
+    selection = st.session_state.selection
+    selection.db = db  # выбор догоняет ту версию базы, по которой строится страница
+    selection.sync()
+    
+    # Новая версия базы после фонового обновления
+    if db.watcher and db.watcher.last_generation > st.session_state.get("seen_generation", db.generation):
+        add_notification("База обновлена: изменились файлы в папках документов", "info")
+    st.session_state.seen_generation = db.generation
+
+    # Главный заголовок
+    st.title("📚 БАЗА РАЗДЕЛОВ ДОКУМЕНТОВ")
+    st.markdown("---")
+
+    # Используем вкладки
+    tab1, tab2, tab3, tab4 = st.tabs([
+        "📋 Выбор разделов",
+        "🎯 Выбор шаблона", 
+        "⚙️ Настройки",
+        "🛠️ Администрирование"
+    ])
+
+    # ==============================================
+    # ВКЛАДКА 1: ВЫБОР РАЗДЕЛОВ (компактный интерфейс)
+    # ==============================================
+
+    with tab1:
+        st.subheader("📋 ВЫБОР РАЗДЕЛОВ ДЛЯ ЭКСПЕРТНОГО ОТВЕТА")
+        
+        # Получаем таблицу для отображения (кэшируется в базе)
+        display_frame = db.get_sections_frame(selection.selected_ids)
+        
+        if display_frame.empty:
+            st.info("База пуста. Нажмите 'Сканировать папки' в боковой панели.")
+        else:
+            # Подбор разделов по описанию вопроса (векторный индекс TF-IDF)
+            with st.expander("🧭 Подбор разделов по вопросу", expanded=bool(st.session_state.get("question_text"))):
+                question_text = st.text_area(
+                    "Опишите вопрос:",
+                    key="question_text",
+                    height=80,
+                    placeholder="Например: порядок уплаты взносов членами садоводческого товарищества"
                 )
+                recommendations = db.recommend_sections(question_text, limit=len(display_frame))
+                
+                col_question1, col_question2 = st.columns([1, 2])
+                with col_question1:
+                    top_k = st.number_input(
+                        "Сколько отметить:",
+                        min_value=1,
+                        max_value=max(1, len(display_frame)),
+                        value=max(1, min(int(CONFIG.get("recommend_top_k", 10)), len(display_frame))),
+                        label_visibility="collapsed"
+                    )
+                with col_question2:
+                    if st.button(f"☑️ Отметить {top_k} самых подходящих", disabled=not recommendations,
+                                 use_container_width=True):
+                        marked = selection.set_selected([section_id for section_id, _ in recommendations[:top_k]], True)
+                        if marked:
+                            st.session_state.has_unsaved_changes = True
+                        st.success(f"Отмечено {marked}")
+                        st.rerun()
+                
+                if question_text and not recommendations:
+                    st.caption("Нет разделов со словами вопроса")
+            
+            # Компактная панель фильтров
+            with st.container():
+                col1, col2, col3 = st.columns(3)
+                
+                with col1:
+                    # Фильтр по папке
+                    folder_options = list(display_frame["folder"].unique())
+                    folder_filter = st.multiselect(
+                        "Папка:",
+                        options=folder_options,
+                        default=folder_options,
+                        format_func=lambda x: {
+                            "normative": "📖 Нормативные",
+                            "methodology": "📚 Методические",
+                            "structured": "🗂️ Структурированные",
+                            "expertise": "👨‍⚖️ Экспертные"
+                        }.get(x, x)
+                    )
+                
+                with col2:
+                    # Фильтр по типу
+                    type_options = list(display_frame["type"].unique())
+                    type_filter = st.multiselect(
+                        "Тип раздела:",
+                        options=type_options,
+                        default=type_options
+                    )
+                
+                with col3:
+                    # Поиск по тексту
+                    search_text = st.text_input("Поиск:", placeholder="По документу, разделу или тексту...")
+                    hide_duplicates = st.checkbox(
+                        "♊ Скрыть повторы",
+                        help="Показывать из каждой группы одинаковых и почти одинаковых разделов только основной"
+                    )
+            
+            # Фильтрация данных (векторные операции по таблице)
+            mask = pd.Series(True, index=display_frame.index)
+            
+            if folder_filter:
+                mask &= display_frame["folder"].isin(folder_filter)
+            
+            if type_filter:
+                mask &= display_frame["type"].isin(type_filter)
+            
+            if hide_duplicates:
+                mask &= display_frame["duplicate_of"] == ""
+            
+            search_snippets = {}
+            if search_text:
+                # Совпадения в тексте разделов ищем по индексу BM25, порядок - по релевантности
+                ranked_ids = db.search_sections(search_text, limit=len(display_frame))
+                ranking = pd.Series(range(len(ranked_ids)), index=ranked_ids, dtype="int64")
+                mask &= (display_frame["search_text"].str.contains(search_text.lower(), regex=False) |
+                         display_frame["id"].isin(ranking.index))
+            
+            # Порядок: по близости к вопросу, если он описан, иначе по релевантности поиска
+            relevance = dict(recommendations)
+            if recommendations:
+                ranking = pd.Series(range(len(recommendations)), index=list(relevance), dtype="int64")
+            
+            filtered_frame = display_frame[mask]
+            if search_text or recommendations:
+                order = filtered_frame["id"].map(ranking).fillna(len(ranking))
+                filtered_frame = filtered_frame.iloc[order.argsort(kind="stable")]
+            
+            # Создаем хэш текущих фильтров
+            current_filter_hash = f"{folder_filter}_{type_filter}_{search_text}_{question_text}_{hide_duplicates}"
             
-            with col2:
-                # Фильтр по типу
-                type_options = list(set(item["type"] for item in display_data))
-                type_filter = st.multiselect(
-                    "Тип раздела:",
-                    options=type_options,
-                    default=type_options
+            # Обновляем хэш фильтров (при смене фильтров возвращаемся на первую страницу)
+            if st.session_state.current_filter_hash != current_filter_hash:
+                st.session_state.current_filter_hash = current_filter_hash
+                st.session_state.page = 0
+            
+            # Постраничный вывод: виджеты создаются только для текущей страницы
+            page_size = st.session_state.page_size
+            page_count = max(1, math.ceil(len(filtered_frame) / page_size))
+            st.session_state.page = min(st.session_state.page, page_count - 1)
+            page_start = st.session_state.page * page_size
+            page_frame = filtered_frame.iloc[page_start:page_start + page_size]
+            
+            filtered_data = page_frame.to_dict("records")
+            if search_text:
+                search_snippets = db.get_search_snippets(search_text, page_frame["id"].tolist())
+            
+            # Компактная статистика и действия
+            with st.container():
+                col_stat1, col_stat2, col_stat3, col_stat4 = st.columns(4)
+                
+                with col_stat1:
+                    st.metric("Найдено", len(filtered_frame), delta=f"из {len(display_frame)}")
+                
+                with col_stat2:
+                    selected_count = int(filtered_frame["selected"].sum())
+                    st.metric("Выбрано", selected_count)
+                
+                with col_stat3:
+                    if st.button("✅ Выбрать все", use_container_width=True):
+                        selection.set_selected(filtered_frame["id"], True)
+                        st.session_state.has_unsaved_changes = True
+                        st.success(f"Выбрано {len(filtered_frame)}")
+                        st.rerun()
+                
+                with col_stat4:
+                    if st.button("❌ Снять все", use_container_width=True):
+                        selection.set_selected(filtered_frame["id"], False)
+                        st.session_state.has_unsaved_changes = True
+                        st.info(f"Снято {len(filtered_frame)}")
+                        st.rerun()
+            
+            # Места для добавления статей по ссылкам и оценки размера промта
+            # (заполняются после обработки чекбоксов)
+            citation_placeholder = st.empty()
+            token_placeholder = st.empty()
+            
+            # Навигация по страницам
+            if len(filtered_frame) > 0:
+                col_page1, col_page2, col_page3, col_page4 = st.columns([2, 1, 2, 1])
+                
+                with col_page1:
+                    page_size_options = sorted({25, 50, 100, 200, max(1, int(CONFIG.get("page_size", 50)))})
+                    new_page_size = st.selectbox(
+                        "На странице:",
+                        options=page_size_options,
+                        index=page_size_options.index(page_size) if page_size in page_size_options else 0,
+                        label_visibility="collapsed",
+                        format_func=lambda x: f"{x} на странице"
+                    )
+                    if new_page_size != page_size:
+                        st.session_state.page_size = new_page_size
+                        st.session_state.page = page_start // new_page_size
+                        st.rerun()
+                
+                with col_page2:
+                    if st.button("◀", disabled=st.session_state.page == 0, use_container_width=True):
+                        st.session_state.page -= 1
+                        st.rerun()
+                
+                with col_page3:
+                    st.markdown(
+                        f'<div class="section-meta" style="text-align: center;">'
+                        f'Страница {st.session_state.page + 1} из {page_count} '
+                        f'(разделы {page_start + 1}-{page_start + len(page_frame)})</div>',
+                        unsafe_allow_html=True
+                    )
+                
+                with col_page4:
+                    if st.button("▶", disabled=st.session_state.page >= page_count - 1, use_container_width=True):
+                        st.session_state.page += 1
+                        st.rerun()
+            
+            # ОТОБРАЖЕНИЕ РАЗДЕЛОВ В КОМПАКТНОМ ФОРМАТЕ
+            if filtered_data:
+                changes_made = False
+                
+                # Компактный контейнер для разделов
+                with st.container():
+                    for idx, item in enumerate(filtered_data):
+                        # Определяем CSS классы
+                        css_class = "section-item"
+                        if item["selected"]:
+                            css_class += " selected-section"
+                        
+                        # Создаем компактный раздел
+                        col_check, col_content = st.columns([0.4, 11.6])
+                        
+                        with col_check:
+                            # Чекбокс для выбора (компактный)
+                            current_selected = item["selected"]
+                            new_selected = st.checkbox(
+                                "",
+                                value=current_selected,
+                                key=f"select_{selection.user_id}_{item['id']}_{current_filter_hash}",
+                                label_visibility="collapsed"
+                            )
+                            
+                            # Обновляем если изменилось
+                            if new_selected != current_selected:
+                                if selection.set_selected([item["id"]], new_selected):
+                                    changes_made = True
+                        
+                        with col_content:
+                            # Компактное отображение информации
+                            st.markdown(f'<div class="{css_class}">', unsafe_allow_html=True)
+                            
+                            # Документ (жирный шрифт с хорошей видимостью в темной теме)
+                            folder_icon = {
+                                "normative": "📖",
+                                "methodology": "📚",
+                                "structured": "🗂️",
+                                "expertise": "👨‍⚖️"
+                            }.get(item["folder"], "📄")
+                            
+                            # Используем span с важными стилями для темной темы
+                            st.markdown(
+                                f'<div class="section-header">'
+                                f'<span style="font-weight: 600; color: inherit;">{folder_icon} {item["document"]}</span>'
+                                f'</div>', 
+                                unsafe_allow_html=True
+                            )
+                            
+                            # Метаданные в одной строке
+                            meta_info = []
+                            meta_info.append(f"Тип: {item['type']}")
+                            meta_info.append(f"Формат: {item.get('extension', '.txt')}")
+                            meta_info.append(f"Слов: {item['words']}")
+                            if item["children"]:
+                                meta_info.append(f"Вложенных: {item['children']}")
+                            if item["duplicates"]:
+                                meta_info.append(f"♊ Повторов: {item['duplicates']}")
+                            if item["duplicate_of"]:
+                                main_section = db.get_section(item["duplicate_of"]) or {}
+                                meta_info.append(
+                                    f"♊ Повтор ({db.duplicate_index.similarity.get(item['id'], 0):.0%}): "
+                                    f"{main_section.get('title', '')} — {main_section.get('document', '')}"
+                                )
+                            if item["id"] in relevance:
+                                meta_info.append(f"🧭 Близость к вопросу: {relevance[item['id']]:.2f}")
+                            if item["selected"]:
+                                meta_info.append("✅ Выбрано")
+                            
+                            st.markdown(f'<div class="section-meta">{" • ".join(meta_info)}</div>', 
+                                    unsafe_allow_html=True)
+                            
+                            # Название раздела с хорошей видимостью
+                            st.markdown(
+                                f'<div class="section-title">'
+                                f'{"&nbsp;" * 4 * item["level"]}{"↳ " if item["level"] else ""}'
+                                f'<span style="font-weight: 500; color: inherit;">{item["section"]}</span>'
+                                f'</div>', 
+                                unsafe_allow_html=True
+                            )
+                            
+                            # Фрагмент текста с совпадениями поискового запроса
+                            if item["id"] in search_snippets:
+                                st.caption(search_snippets[item["id"]])
+                            
+                            # Ссылки раздела на статьи и ссылки на него
+                            cites = db.citation_index.cites.get(item["id"], [])
+                            cited_by = db.citation_index.cited_by.get(item["id"], [])
+                            external = db.citation_index.external.get(item["id"], [])
+                            if cites or cited_by or external:
+                                with st.expander(f"🔗 Ссылается: {len(cites) + len(external)} • "
+                                                 f"Ссылаются на него: {len(cited_by)}"):
+                                    for label, section_ids in (("Ссылается на", cites), ("Ссылаются на него", cited_by)):
+                                        if section_ids:
+                                            st.markdown(f"**{label}:**")
+                                            st.markdown("\n".join(
+                                                f"- {linked.get('title', '')} — {linked.get('document', '')}"
+                                                for linked in map(db.get_section, section_ids) if linked
+                                            ))
+                                    if external:
+                                        st.caption("Нет в базе: " + ", ".join(external))
+                            
+                            st.markdown('</div>', unsafe_allow_html=True)
+                
+                # Обновляем флаг изменений
+                if changes_made:
+                    st.session_state.has_unsaved_changes = True
+                
+                # Добавление в выбор статей, на которые ссылаются выбранные разделы (граф ссылок)
+                if db.citation_index.cites:
+                    with citation_placeholder.container():
+                        col_cite1, col_cite2 = st.columns([1, 2])
+                        
+                        with col_cite1:
+                            citation_depth = st.selectbox(
+                                "Глубина ссылок:",
+                                options=[1, 2],
+                                index=0 if int(CONFIG.get("citation_depth", 1)) < 2 else 1,
+                                label_visibility="collapsed",
+                                format_func=lambda x: "Прямые ссылки" if x == 1 else "Ссылки и ссылки ссылок"
+                            )
+                        
+                        with col_cite2:
+                            effective_ids = [section.get("id") for section in selection.get_selected_sections()]
+                            cited_ids = db.citation_index.expand(effective_ids, citation_depth) - selection.selected_ids
+                            if st.button(f"🔗 Добавить статьи по ссылкам ({len(cited_ids)})",
+                                         disabled=not cited_ids, use_container_width=True):
+                                selection.set_selected(cited_ids, True)
+                                st.session_state.has_unsaved_changes = True
+                                st.rerun()
+                
+                # Оценка размера промта для выбранных разделов и шаблона
+                budget_template = (template_manager.get_template_by_id(st.session_state.selected_template)
+                                   or template_manager.get_default_template())
+                prompt_tokens = ExpertFileGenerator.estimate_prompt_tokens(
+                    selection.get_selected_sections(), budget_template.get("prompt", "")
                 )
+                token_budget = int(budget_template.get("token_budget", 0) or 0)
+                if not token_budget:
+                    token_placeholder.caption(f"🔢 Промт: ~{prompt_tokens} токенов (бюджет шаблона не задан)")
+                elif prompt_tokens > token_budget:
+                    token_placeholder.warning(
+                        f"🔢 Промт: ~{prompt_tokens} токенов при бюджете {token_budget} - "
+                        f"часть разделов будет сокращена или исключена"
+                    )
+                else:
+                    token_placeholder.caption(f"🔢 Промт: ~{prompt_tokens} из {token_budget} токенов бюджета")
+                
+                # Компактная панель управления
+                st.markdown("---")
+                
+                with st.container():
+                    col_manage1, col_manage2, col_manage3 = st.columns(3)
+                    
+                    with col_manage1:
+                        # Кнопка сохранения
+                        save_disabled = not st.session_state.has_unsaved_changes
+                        
+                        if st.button("💾 Сохранить выбор", type="primary", 
+                                   disabled=save_disabled, use_container_width=True):
+                            selection.save()
+                            st.success("✅ Выбор сохранен!")
+                            add_notification("Выбор разделов сохранен", "success")
+                            st.session_state.has_unsaved_changes = False
+                            st.rerun()
+                    
+                    with col_manage2:
+                        # Кнопка создания файлов для DeepSeek
+                        total_selected = len(selection.selected_ids)
+                        create_disabled = total_selected == 0
+                        
+                        if st.button("🤖 Создать файлы", type="secondary",
+                                   disabled=create_disabled, use_container_width=True):
+                            selected_sections = selection.get_selected_sections()
+                            
+                            with st.spinner("Создаю файлы..."):
+                                output_dir = Path(CONFIG.get("expert_sessions_path", "./expert_sessions"))
+                                output_dir.mkdir(exist_ok=True, parents=True)
+                                
+                                session_dir = ExpertFileGenerator.create_prompt_file(
+                                    selected_sections, 
+                                    output_dir,
+                                    template_manager,
+                                    st.session_state.selected_template,
+                                    db.duplicate_index.duplicate_of,
+                                    content_loader=db.with_content
+                                )
+                                
+                                if session_dir:
+                                    st.session_state.session_dir = session_dir
+                                    st.session_state.files_created = True
+                                    
+                                    st.success(f"✅ Файлы созданы!")
+                                    add_notification("Файлы сессии созданы", "success")
+                                    st.rerun()
+                    
+                    with col_manage3:
+                        # Статус
+                        if st.session_state.has_unsaved_changes:
+                            st.warning("⚠️ Не сохранено")
+                        else:
+                            st.info("💾 Все сохранено")
             
-            with col3:
-                # Поиск по тексту
-                search_text = st.text_input("Поиск:", placeholder="По документу или разделу...")
-        
-        # Фильтрация данных
-        filtered_data = display_data.copy()
-        
-        if folder_filter:
-            filtered_data = [item for item in filtered_data if item["folder"] in folder_filter]
-        
-        if type_filter:
-            filtered_data = [item for item in filtered_data if item["type"] in type_filter]
-        
-        if search_text:
-            search_lower = search_text.lower()
-            filtered_data = [
-                item for item in filtered_data
-                if (search_lower in item["document_full"].lower() or
-                    search_lower in item["section_full"].lower())
-            ]
-        
-        # Создаем хэш текущих фильтров
-        current_filter_hash = f"{folder_filter}_{type_filter}_{search_text}"
+            else:
+                st.info("Нет разделов, соответствующих выбранным фильтрам.")
+
+    # ==============================================
+    # ВКЛАДКА 2: ВЫБОР ШАБЛОНА
+    # ==============================================
+
+    with tab2:
+        st.subheader("🎯 ВЫБОР ШАБЛОНА ДЛЯ ИИ")
         
-        # Обновляем хэш фильтров
-        if st.session_state.current_filter_hash != current_filter_hash:
-            st.session_state.current_filter_hash = current_filter_hash
+        templates = template_manager.get_templates_list()
         
-        # Компактная статистика и действия
-        with st.container():
-            col_stat1, col_stat2, col_stat3, col_stat4 = st.columns(4)
+        if not templates:
+            st.info("Нет доступных шаблонов. Создайте первый шаблон.")
+        else:
+            # Отображаем текущий выбранный шаблон
+            current_template = template_manager.get_template_by_id(st.session_state.selected_template)
+            if current_template:
+                st.markdown(f"### 📌 ТЕКУЩИЙ ШАБЛОН: **{current_template.get('name', 'Неизвестно')}**")
+                st.markdown(f"*{current_template.get('description', '')}*")
+                st.markdown("---")
             
-            with col_stat1:
-                st.metric("Найдено", len(filtered_data), delta=f"из {len(display_data)}")
+            # Выбор шаблона
+            st.markdown("### 📋 ВЫБЕРИТЕ ШАБЛОН ОТВЕТА:")
             
-            with col_stat2:
-                selected_count = sum(1 for item in filtered_data if item["selected"])
-                total_selected = sum(1 for item in display_data if item["selected"])
-                st.metric("Выбрано", selected_count)
+            for template in templates:
+                is_selected = template["id"] == st.session_state.selected_template
+                
+                # Создаем карточку шаблона
+                css_class = "template-card"
+                if is_selected:
+                    css_class += " selected"
+                
+                with st.container():
+                    col1, col2 = st.columns([0.1, 0.9])
+                    
+                    with col1:
+                        # Радио-кнопка для выбора
+                        if st.button("✓", key=f"select_template_{template['id']}", 
+                                   disabled=is_selected, use_container_width=True):
+                            st.session_state.selected_template = template["id"]
+                            st.success(f"Выбран шаблон: {template['name']}")
+                            add_notification(f"Выбран шаблон: {template['name']}", "info")
+                            st.rerun()
+                    
+                    with col2:
+                        st.markdown(f'<div class="{css_class}" onclick="document.getElementById(\'template_{template["id"]}\').click()">', 
+                                  unsafe_allow_html=True)
+                        st.markdown(f'<div class="template-name">{template.get("name", "Без названия")}</div>', 
+                                  unsafe_allow_html=True)
+                        st.markdown(f'<div class="template-description">{template.get("description", "")}</div>', 
+                                  unsafe_allow_html=True)
+                        st.markdown('</div>', unsafe_allow_html=True)
             
-            with col_stat3:
-                if st.button("✅ Выбрать все", use_container_width=True):
-                    for item in filtered_data:
-                        for section in db.sections:
-                            if section.get("id") == item["id"]:
-                                section["selected"] = True
-                    st.session_state.has_unsaved_changes = True
-                    st.success(f"Выбрано {len(filtered_data)}")
-                    st.rerun()
+            # Предпросмотр выбранного шаблона
+            st.markdown("---")
+            st.markdown("### 👁️ ПРЕДПРОСМОТР ШАБЛОНА")
             
-            with col_stat4:
-                if st.button("❌ Снять все", use_container_width=True):
-                    for item in filtered_data:
-                        for section in db.sections:
-                            if section.get("id") == item["id"]:
-                                section["selected"] = False
-                    st.session_state.has_unsaved_changes = True
-                    st.info(f"Снято {len(filtered_data)}")
-                    st.rerun()
-        
-        # ОТОБРАЖЕНИЕ РАЗДЕЛОВ В КОМПАКТНОМ ФОРМАТЕ
-        if filtered_data:
-            changes_made = False
+            if current_template:
+                with st.expander("📝 Показать текст шаблона"):
+                    st.text_area("Текст шаблона:", 
+                               value=current_template.get("prompt", ""),
+                               height=300,
+                               disabled=True,
+                               key=f"preview_{current_template['id']}")
             
-            # Компактный контейнер для разделов
-            with st.container():
-                for idx, item in enumerate(filtered_data):
-                    # Определяем CSS классы
-                    css_class = "section-item"
-                    if item["selected"]:
-                        css_class += " selected-section"
-                    
-                    # Создаем компактный раздел
-                    col_check, col_content = st.columns([0.4, 11.6])
-                    
-                    with col_check:
-                        # Чекбокс для выбора (компактный)
-                        current_selected = item["selected"]
-                        new_selected = st.checkbox(
-                            "",
-                            value=current_selected,
-                            key=f"select_{item['id']}_{current_filter_hash}",
-                            label_visibility="collapsed"
-                        )
-                        
-                        # Обновляем если изменилось
-                        if new_selected != current_selected:
-                            for section in db.sections:
-                                if section.get("id") == item["id"]:
-                                    section["selected"] = new_selected
-                                    changes_made = True
-                                    break
-                    
-                    with col_content:
-                        # Компактное отображение информации
-                        st.markdown(f'<div class="{css_class}">', unsafe_allow_html=True)
-                        
-                        # Документ (жирный шрифт с хорошей видимостью в темной теме)
-                        folder_icon = {
-                            "normative": "📖",
-                            "methodology": "📚",
-                            "structured": "🗂️",
-                            "expertise": "👨‍⚖️"
-                        }.get(item["folder"], "📄")
+            # Отображение кнопок для скачивания файлов
+            if st.session_state.files_created and st.session_state.session_dir:
+                st.markdown("---")
+                st.markdown("##### 📥 СКАЧАТЬ ФАЙЛЫ СЕССИИ")
+                
+                session_dir = st.session_state.session_dir
+                
+                # Компактное отображение кнопок скачивания
+                col_download1, col_download2, col_download3, col_download4, col_download5 = st.columns(5)
+                
+                # Файл all_sections.md
+                all_sections_path = session_dir / "all_sections.md"
+                if all_sections_path.exists():
+                    with col_download1:
+                        with open(all_sections_path, 'r', encoding='utf-8') as f:
+                            all_sections_content = f.read()
                         
-                        # Используем span с важными стилями для темной темы
-                        st.markdown(
-                            f'<div class="section-header">'
-                            f'<span style="font-weight: 600; color: inherit;">{folder_icon} {item["document"]}</span>'
-                            f'</div>', 
-                            unsafe_allow_html=True
+                        st.download_button(
+                            label="📄 Разделы",
+                            data=all_sections_content,
+                            file_name=f"all_sections.md",
+                            mime="text/markdown",
+                            use_container_width=True,
+                            help="Все выбранные разделы"
                         )
+                
+                # Файл deepseek_prompt.txt
+                prompt_path = session_dir / "deepseek_prompt.txt"
+                if prompt_path.exists():
+                    with col_download2:
+                        with open(prompt_path, 'r', encoding='utf-8') as f:
+                            prompt_content = f.read()
                         
-                        # Метаданные в одной строке
-                        meta_info = []
-                        meta_info.append(f"Тип: {item['type']}")
-                        meta_info.append(f"Формат: {item.get('extension', '.txt')}")
-                        meta_info.append(f"Слов: {item['words']}")
-                        if item["selected"]:
-                            meta_info.append("✅ Выбрано")
+                        st.download_button(
+                            label="🤖 Промт",
+                            data=prompt_content,
+                            file_name=f"deepseek_prompt.txt",
+                            mime="text/plain",
+                            use_container_width=True,
+                            help="Промт для DeepSeek"
+                        )
+                
+                # Файл report.txt
+                report_path = session_dir / "report.txt"
+                if report_path.exists():
+                    with col_download3:
+                        with open(report_path, 'r', encoding='utf-8') as f:
+                            report_content = f.read()
                         
-                        st.markdown(f'<div class="section-meta">{" • ".join(meta_info)}</div>', 
-                                unsafe_allow_html=True)
+                        st.download_button(
+                            label="📊 Отчет",
+                            data=report_content,
+                            file_name=f"report.txt",
+                            mime="text/plain",
+                            use_container_width=True,
+                            help="Отчет по сессии"
+                        )
+                
+                # Файл sections_data.json
+                json_path = session_dir / "sections_data.json"
+                if json_path.exists():
+                    with col_download4:
+                        with open(json_path, 'r', encoding='utf-8') as f:
+                            json_content = f.read()
                         
-                        # Название раздела с хорошей видимостью
-                        st.markdown(
-                            f'<div class="section-title">'
-                            f'<span style="font-weight: 500; color: inherit;">{item["section"]}</span>'
-                            f'</div>', 
-                            unsafe_allow_html=True
+                        st.download_button(
+                            label="📁 JSON",
+                            data=json_content,
+                            file_name=f"sections_data.json",
+                            mime="application/json",
+                            use_container_width=True,
+                            help="Данные в JSON"
                         )
+                
+                # Файл template_info.json
+                template_path = session_dir / "template_info.json"
+                if template_path.exists():
+                    with col_download5:
+                        with open(template_path, 'r', encoding='utf-8') as f:
+                            template_content = f.read()
                         
-                        st.markdown('</div>', unsafe_allow_html=True)
-            
-            # Обновляем флаг изменений
-            if changes_made:
-                st.session_state.has_unsaved_changes = True
+                        st.download_button(
+                            label="🎯 Шаблон",
+                            data=template_content,
+                            file_name=f"template_info.json",
+                            mime="application/json",
+                            use_container_width=True,
+                            help="Информация о шаблоне"
+                        )
+
+    # ==============================================
+    # ВКЛАДКА 3: НАСТРОЙКИ
+    # ==============================================
+
+    with tab3:
+        st.subheader("⚙️ НАСТРОЙКИ")
+        
+        st.markdown("### 📂 КОНФИГУРАЦИЯ ПУТЕЙ")
+        
+        # Отображаем текущую конфигурацию
+        for folder_name, folder_path in CONFIG["folders"].items():
+            display_name = {
+                "normative": "📖 Нормативные акты",
+                "methodology": "📚 Методические материалы",
+                "structured": "🗂️ Структурированные документы",
+                "expertise": "👨‍⚖️ Экспертные заключения"
+            }.get(folder_name, folder_name)
             
-            # Компактная панель управления
-            st.markdown("---")
+            st.text_input(
+                f"{display_name}:",
+                value=folder_path,
+                key=f"config_path_{folder_name}",
+                disabled=True
+            )
+        
+        st.markdown("---")
+        
+        # Проверка доступности папок
+        if st.button("🔍 Проверить доступность папок", type="secondary"):
+            status = validate_folders(CONFIG["folders"])
             
-            with st.container():
-                col_manage1, col_manage2, col_manage3 = st.columns(3)
+            if status["all_exist"]:
+                st.success("✅ Все папки доступны!")
+            else:
+                st.error("❌ Некоторые папки недоступны:")
+                for folder_type, path in status["missing"]:
+                    st.error(f"   - {folder_type}: {path}")
                 
-                with col_manage1:
-                    # Кнопка сохранения
-                    save_disabled = not st.session_state.has_unsaved_changes
-                    
-                    if st.button("💾 Сохранить выбор", type="primary", 
-                               disabled=save_disabled, use_container_width=True):
-                        db.save_database()
-                        st.success("✅ Выбор сохранен!")
-                        add_notification("Выбор разделов сохранен", "success")
-                        st.session_state.has_unsaved_changes = False
-                        st.rerun()
+                st.info("ℹ️ Отредактируйте файл `config.json` и перезапустите приложение")
+        
+        st.markdown("---")
+        st.markdown("### 📝 РЕДАКТИРОВАНИЕ КОНФИГУРАЦИИ")
+        
+        # Показываем текущий config.json
+        config_path = Path(__file__).parent / "config.json"
+        if config_path.exists():
+            try:
+                with open(config_path, 'r', encoding='utf-8') as f:
+                    config_content = f.read()
                 
-                with col_manage2:
-                    # Кнопка создания файлов для DeepSeek
-                    total_selected = sum(1 for item in display_data if item["selected"])
-                    create_disabled = total_selected == 0
-                    
-                    if st.button("🤖 Создать файлы", type="secondary",
-                               disabled=create_disabled, use_container_width=True):
-                        selected_sections = db.get_selected_sections()
-                        
-                        with st.spinner("Создаю файлы..."):
-                            output_dir = Path(CONFIG.get("expert_sessions_path", "./expert_sessions"))
-                            output_dir.mkdir(exist_ok=True, parents=True)
-                            
-                            session_dir = ExpertFileGenerator.create_prompt_file(
-                                selected_sections, 
-                                output_dir,
-                                template_manager,
-                                st.session_state.selected_template
-                            )
-                            
-                            if session_dir:
-                                st.session_state.session_dir = session_dir
-                                st.session_state.files_created = True
-                                
-                                st.success(f"✅ Файлы созданы!")
-                                add_notification("Файлы сессии созданы", "success")
-                                st.rerun()
+                st.download_button(
+                    label="⬇️ Скачать текущий config.json",
+                    data=config_content,
+                    file_name="config.json",
+                    mime="application/json",
+                    use_container_width=True,
+                    help="Скачайте, отредактируйте и перезапустите приложение"
+                )
                 
-                with col_manage3:
-                    # Статус
-                    if st.session_state.has_unsaved_changes:
-                        st.warning("⚠️ Не сохранено")
-                    else:
-                        st.info("💾 Все сохранено")
-        
+                with st.expander("👁️ Показать текущий config.json"):
+                    st.code(config_content, language="json")
+            
+            except Exception as e:
+                st.error(f"Ошибка чтения файла конфигурации: {e}")
         else:
-            st.info("Нет разделов, соответствующих выбранным фильтрам.")
+            st.info("Файл config.json не найден. Используются настройки по умолчанию.")
+            
+            # Кнопка для создания config.json с текущими настройками
+            if st.button("📄 Создать config.json", type="primary"):
+                if save_config(CONFIG):
+                    st.success("Файл config.json создан! Перезапустите приложение.")
+                    add_notification("Файл конфигурации создан", "success")
+                else:
+                    st.error("Не удалось создать файл конфигурации")
 
-# ==============================================
-# ВКЛАДКА 2: ВЫБОР ШАБЛОНА
-# ==============================================
+    # ==============================================
+    # ВКЛАДКА 4: АДМИНИСТРИРОВАНИЕ
+    # ==============================================
 
-with tab2:
-    st.subheader("🎯 ВЫБОР ШАБЛОНА ДЛЯ ИИ")
-    
-    templates = template_manager.get_templates_list()
-    
-    if not templates:
-        st.info("Нет доступных шаблонов. Создайте первый шаблон.")
-    else:
-        # Отображаем текущий выбранный шаблон
-        current_template = template_manager.get_template_by_id(st.session_state.selected_template)
-        if current_template:
-            st.markdown(f"### 📌 ТЕКУЩИЙ ШАБЛОН: **{current_template.get('name', 'Неизвестно')}**")
-            st.markdown(f"*{current_template.get('description', '')}*")
-            st.markdown("---")
+    with tab4:
+        st.subheader("🛠️ АДМИНИСТРИРОВАНИЕ")
         
-        # Выбор шаблона
-        st.markdown("### 📋 ВЫБЕРИТЕ ШАБЛОН ОТВЕТА:")
+        col_admin1, col_admin2 = st.columns(2)
         
-        for template in templates:
-            is_selected = template["id"] == st.session_state.selected_template
+        with col_admin1:
+            # Блок операций с базой
+            st.markdown("### 🗑️ ОПЕРАЦИИ С БАЗОЙ")
             
-            # Создаем карточку шаблона
-            css_class = "template-card"
-            if is_selected:
-                css_class += " selected"
+            # Кнопка сканирования (инкрементально - только измененные файлы)
+            if st.button("🔍 Сканировать папки", type="primary", use_container_width=True):
+                with st.spinner("Сканирую папки..."):
+                    progress_bar = st.progress(0.0)
+                    shared_db.scan_and_build_database(progress_callback=scan_progress_callback(progress_bar))
+                    st.success("✅ База данных обновлена!")
+                    add_notification("База данных отсканирована и обновлена", "success")
+                    st.rerun()
             
-            with st.container():
-                col1, col2 = st.columns([0.1, 0.9])
+            # Кнопка полной перестройки (все файлы обрабатываются заново)
+            if st.button("♻️ Полная перестройка", type="secondary", use_container_width=True):
+                with st.spinner("Перестраиваю базу..."):
+                    progress_bar = st.progress(0.0)
+                    shared_db.scan_and_build_database(
+                        incremental=False,
+                        progress_callback=scan_progress_callback(progress_bar)
+                    )
+                    st.success("✅ База данных перестроена!")
+                    add_notification("База данных полностью перестроена", "success")
+                    st.rerun()
+            
+            # Кнопка очистки базы
+            if st.button("🗑️ Очистить базу", type="secondary", use_container_width=True):
+                st.warning("Это действие очистит всю базу данных!")
+                if st.checkbox("Я понимаю последствия"):
+                    shared_db.replace_sections([], {
+                        "created_at": datetime.now().isoformat(),
+                        "last_updated": datetime.now().isoformat(),
+                        "total_sections": 0,
+                        "total_documents": 0,
+                        "by_folder": {},
+                        "supported_extensions": SUPPORTED_EXTENSIONS
+                    })
+                    st.success("База очищена!")
+                    st.session_state.has_unsaved_changes = False
+                    st.rerun()
+        
+        with col_admin2:
+            # Блок импорта/экспорта
+            st.markdown("### 📤 ИМПОРТ/ЭКСПОРТ")
+            
+            # Импорт
+            uploaded_file = st.file_uploader(
+                "Выберите файл базы (JSON):",
+                type=['json'],
+                key="import_uploader"
+            )
+            
+            if uploaded_file is not None:
+                try:
+                    import_data = json.load(uploaded_file)
+                    if st.button("📥 Импортировать данные", type="primary"):
+                        if 'sections' in import_data and 'metadata' in import_data:
+                            shared_db.replace_sections(import_data['sections'], import_data['metadata'])
+                            st.success("База успешно импортирована!")
+                            add_notification(f"База импортирована из {uploaded_file.name}", "success")
+                            st.session_state.has_unsaved_changes = False
+                            st.rerun()
+                        else:
+                            st.error("Неверный формат файла базы")
+                except Exception as e:
+                    st.error(f"Ошибка при чтении файла: {e}")
+            
+            # Экспорт
+            if st.button("📤 Экспортировать базу", type="secondary", use_container_width=True):
+                export_data = {
+                    "sections": db.with_content(db.sections),
+                    "metadata": db.metadata
+                }
                 
-                with col1:
-                    # Радио-кнопка для выбора
-                    if st.button("✓", key=f"select_template_{template['id']}", 
-                               disabled=is_selected, use_container_width=True):
-                        st.session_state.selected_template = template["id"]
-                        st.success(f"Выбран шаблон: {template['name']}")
-                        add_notification(f"Выбран шаблон: {template['name']}", "info")
-                        st.rerun()
+                export_json = json.dumps(export_data, ensure_ascii=False, indent=2)
                 
-                with col2:
-                    st.markdown(f'<div class="{css_class}" onclick="document.getElementById(\'template_{template["id"]}\').click()">', 
-                              unsafe_allow_html=True)
-                    st.markdown(f'<div class="template-name">{template.get("name", "Без названия")}</div>', 
-                              unsafe_allow_html=True)
-                    st.markdown(f'<div class="template-description">{template.get("description", "")}</div>', 
-                              unsafe_allow_html=True)
-                    st.markdown('</div>', unsafe_allow_html=True)
-        
-        # Предпросмотр выбранного шаблона
+                st.download_button(
+                    label="⬇️ Скачать базу (JSON)",
+                    data=export_json,
+                    file_name=f"database_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+                    mime="application/json",
+                    use_container_width=True
+                )
+        
+        # Управление шаблонами
         st.markdown("---")
-        st.markdown("### 👁️ ПРЕДПРОСМОТР ШАБЛОНА")
+        st.markdown("### 🎯 УПРАВЛЕНИЕ ШАБЛОНАМИ")
         
-        if current_template:
-            with st.expander("📝 Показать текст шаблона"):
-                st.text_area("Текст шаблона:", 
-                           value=current_template.get("prompt", ""),
-                           height=300,
-                           disabled=True,
-                           key=f"preview_{current_template['id']}")
-        
-        # Отображение кнопок для скачивания файлов
-        if st.session_state.files_created and st.session_state.session_dir:
-            st.markdown("---")
-            st.markdown("##### 📥 СКАЧАТЬ ФАЙЛЫ СЕССИИ")
-            
-            session_dir = st.session_state.session_dir
-            
-            # Компактное отображение кнопок скачивания
-            col_download1, col_download2, col_download3, col_download4, col_download5 = st.columns(5)
+        col_template1, col_template2 = st.columns(2)
+        
+        with col_template1:
+            # Просмотр и редактирование шаблонов
+            st.markdown("##### 📝 РЕДАКТИРОВАТЬ ШАБЛОНЫ")
             
-            # Файл all_sections.md
-            all_sections_path = session_dir / "all_sections.md"
-            if all_sections_path.exists():
-                with col_download1:
-                    with open(all_sections_path, 'r', encoding='utf-8') as f:
-                        all_sections_content = f.read()
-                    
-                    st.download_button(
-                        label="📄 Разделы",
-                        data=all_sections_content,
-                        file_name=f"all_sections.md",
-                        mime="text/markdown",
-                        use_container_width=True,
-                        help="Все выбранные разделы"
-                    )
+            templates = template_manager.get_templates_list()
             
-            # Файл deepseek_prompt.txt
-            prompt_path = session_dir / "deepseek_prompt.txt"
-            if prompt_path.exists():
-                with col_download2:
-                    with open(prompt_path, 'r', encoding='utf-8') as f:
-                        prompt_content = f.read()
+            for template in templates:
+                with st.expander(f"✏️ {template.get('name', 'Без названия')}", expanded=False):
+                    new_name = st.text_input("Название:", 
+                                           value=template.get('name', ''),
+                                           key=f"name_{template['id']}")
                     
-                    st.download_button(
-                        label="🤖 Промт",
-                        data=prompt_content,
-                        file_name=f"deepseek_prompt.txt",
-                        mime="text/plain",
-                        use_container_width=True,
-                        help="Промт для DeepSeek"
-                    )
-            
-            # Файл report.txt
-            report_path = session_dir / "report.txt"
-            if report_path.exists():
-                with col_download3:
-                    with open(report_path, 'r', encoding='utf-8') as f:
-                        report_content = f.read()
+                    new_description = st.text_area("Описание:",
+                                                 value=template.get('description', ''),
+                                                 key=f"desc_{template['id']}")
                     
-                    st.download_button(
-                        label="📊 Отчет",
-                        data=report_content,
-                        file_name=f"report.txt",
-                        mime="text/plain",
-                        use_container_width=True,
-                        help="Отчет по сессии"
-                    )
-            
-            # Файл sections_data.json
-            json_path = session_dir / "sections_data.json"
-            if json_path.exists():
-                with col_download4:
-                    with open(json_path, 'r', encoding='utf-8') as f:
-                        json_content = f.read()
+                    new_prompt = st.text_area("Текст шаблона:",
+                                            value=template.get('prompt', ''),
+                                            height=200,
+                                            key=f"prompt_{template['id']}")
                     
-                    st.download_button(
-                        label="📁 JSON",
-                        data=json_content,
-                        file_name=f"sections_data.json",
-                        mime="application/json",
-                        use_container_width=True,
-                        help="Данные в JSON"
-                    )
-            
-            # Файл template_info.json
-            template_path = session_dir / "template_info.json"
-            if template_path.exists():
-                with col_download5:
-                    with open(template_path, 'r', encoding='utf-8') as f:
-                        template_content = f.read()
+                    new_budget = st.number_input("Бюджет токенов (0 - без ограничения):",
+                                               min_value=0, step=1000,
+                                               value=int(template.get('token_budget', 0) or 0),
+                                               key=f"budget_{template['id']}")
                     
-                    st.download_button(
-                        label="🎯 Шаблон",
-                        data=template_content,
-                        file_name=f"template_info.json",
-                        mime="application/json",
-                        use_container_width=True,
-                        help="Информация о шаблоне"
-                    )
-
-# ==============================================
-# ВКЛАДКА 3: НАСТРОЙКИ
-# ==============================================
-
-with tab3:
-    st.subheader("⚙️ НАСТРОЙКИ")
-    
-    st.markdown("### 📂 КОНФИГУРАЦИЯ ПУТЕЙ")
-    
-    # Отображаем текущую конфигурацию
-    for folder_name, folder_path in CONFIG["folders"].items():
-        display_name = {
-            "normative": "📖 Нормативные акты",
-            "methodology": "📚 Методические материалы",
-            "structured": "🗂️ Структурированные документы",
-            "expertise": "👨‍⚖️ Экспертные заключения"
-        }.get(folder_name, folder_name)
-        
-        st.text_input(
-            f"{display_name}:",
-            value=folder_path,
-            key=f"config_path_{folder_name}",
-            disabled=True
-        )
-    
-    st.markdown("---")
-    
-    # Проверка доступности папок
-    if st.button("🔍 Проверить доступность папок", type="secondary"):
-        status = validate_folders(CONFIG["folders"])
+                    if st.button("💾 Сохранить изменения", key=f"save_{template['id']}"):
+                        # Обновляем шаблон
+                        template['name'] = new_name
+                        template['description'] = new_description
+                        template['prompt'] = new_prompt
+                        template['token_budget'] = int(new_budget)
+                        
+                        # Сохраняем изменения
+                        template_manager.update_templates(template_manager.templates)
+                        st.success(f"Шаблон '{new_name}' обновлен!")
+                        add_notification(f"Шаблон '{new_name}' обновлен", "success")
+                        st.rerun()
         
-        if status["all_exist"]:
-            st.success("✅ Все папки доступны!")
-        else:
-            st.error("❌ Некоторые папки недоступны:")
-            for folder_type, path in status["missing"]:
-                st.error(f"   - {folder_type}: {path}")
+        with col_template2:
+            # Создание нового шаблона
+            st.markdown("##### ➕ СОЗДАТЬ НОВЫЙ ШАБЛОН")
             
-            st.info("ℹ️ Отредактируйте файл `config.json` и перезапустите приложение")
-    
-    st.markdown("---")
-    st.markdown("### 📝 РЕДАКТИРОВАНИЕ КОНФИГУРАЦИИ")
-    
-    # Показываем текущий config.json
-    config_path = Path(__file__).parent / "config.json"
-    if config_path.exists():
-        try:
-            with open(config_path, 'r', encoding='utf-8') as f:
-                config_content = f.read()
-            
-            st.download_button(
-                label="⬇️ Скачать текущий config.json",
-                data=config_content,
-                file_name="config.json",
-                mime="application/json",
-                use_container_width=True,
-                help="Скачайте, отредактируйте и перезапустите приложение"
-            )
+            with st.form("new_template_form"):
+                new_template_name = st.text_input("Название нового шаблона:", 
+                                                placeholder="Например: Технический анализ")
+                
+                new_template_desc = st.text_area("Описание шаблона:",
+                                               placeholder="Краткое описание цели шаблона")
+                
+                new_template_prompt = st.text_area("Текст шаблона:",
+                                                 placeholder="Введите текст промта для ИИ...",
+                                                 height=250)
+                
+                new_template_budget = st.number_input("Бюджет токенов (0 - без ограничения):",
+                                                    min_value=0, step=1000, value=0)
+                
+                submit_btn = st.form_submit_button("➕ Создать шаблон", type="primary")
             
-            with st.expander("👁️ Показать текущий config.json"):
-                st.code(config_content, language="json")
+            # Обработка формы вынесена ВНЕ формы
+            if submit_btn:
+                if new_template_name and new_template_prompt:
+                    # Создаем новый шаблон
+                    new_template = {
+                        "id": f"template_{uuid.uuid4().hex[:8]}",
+                        "name": new_template_name,
+                        "description": new_template_desc,
+                        "prompt": new_template_prompt,
+                        "token_budget": int(new_template_budget)
+                    }
+                    
+                    # Добавляем в список шаблонов
+                    templates = template_manager.get_templates_list()
+                    templates.append(new_template)
+                    
+                    # Обновляем шаблоны
+                    template_manager.templates["templates"] = templates
+                    template_manager.update_templates(template_manager.templates)
+                    
+                    st.success(f"Шаблон '{new_template_name}' создан!")
+                    add_notification(f"Создан новый шаблон: {new_template_name}", "success")
+                    st.rerun()
+                else:
+                    st.error("Заполните название и текст шаблона")
         
-        except Exception as e:
-            st.error(f"Ошибка чтения файла конфигурации: {e}")
-    else:
-        st.info("Файл config.json не найден. Используются настройки по умолчанию.")
+        # Перезагрузка шаблонов - ВНЕ формы, отдельный блок
+        st.markdown("---")
+        st.markdown("### 🔄 ПЕРЕЗАГРУЗКА ШАБЛОНОВ")
         
-        # Кнопка для создания config.json с текущими настройками
-        if st.button("📄 Создать config.json", type="primary"):
-            if save_config(CONFIG):
-                st.success("Файл config.json создан! Перезапустите приложение.")
-                add_notification("Файл конфигурации создан", "success")
-            else:
-                st.error("Не удалось создать файл конфигурации")
+        if st.button("🔄 Перезагрузить шаблоны из файла", type="secondary", use_container_width=True):
+            template_manager.reload_templates()
+            st.success("Шаблоны перезагружены из файла!")
+            add_notification("Шаблоны перезагружены из файла", "success")
+            st.rerun()
 
-# ==============================================
-# ВКЛАДКА 4: АДМИНИСТРИРОВАНИЕ
-# ==============================================
+    # ==============================================
+    # САЙДБАР
+    # ==============================================
 
-with tab4:
-    st.subheader("🛠️ АДМИНИСТРИРОВАНИЕ")
-    
-    col_admin1, col_admin2 = st.columns(2)
-    
-    with col_admin1:
-        # Блок операций с базой
-        st.markdown("### 🗑️ ОПЕРАЦИИ С БАЗОЙ")
+    with st.sidebar:
+        st.header("👤 ЭКСПЕРТ")
         
-        # Кнопка сканирования
-        if st.button("🔍 Сканировать папки", type="primary", use_container_width=True):
-            with st.spinner("Сканирую папки..."):
-                db.scan_and_build_database()
-                st.success("✅ База данных обновлена!")
-                add_notification("База данных отсканирована и обновлена", "success")
+        # Смена пользователя: несохраненный выбор текущего пользователя сохраняется
+        user_input = st.text_input("Пользователь:", value=selection.user_id,
+                                   help="У каждого пользователя свой сохраненный выбор разделов")
+        new_user = user_input.strip() or SelectionSet.DEFAULT_USER
+        if new_user != selection.user_id:
+            if st.session_state.has_unsaved_changes:
+                selection.save()
                 st.session_state.has_unsaved_changes = False
-                st.rerun()
+            st.session_state.selection = SelectionSet(db, new_user)
+            set_query_param("user", new_user)
+            add_notification(f"Пользователь: {new_user}", "info")
+            st.rerun()
         
-        # Кнопка очистки базы
-        if st.button("🗑️ Очистить базу", type="secondary", use_container_width=True):
-            st.warning("Это действие очистит всю базу данных!")
-            if st.checkbox("Я понимаю последствия"):
-                db.sections = []
-                db.metadata = {
-                    "created_at": datetime.now().isoformat(),
-                    "last_updated": datetime.now().isoformat(),
-                    "total_sections": 0,
-                    "total_documents": 0,
-                    "by_folder": {},
-                    "supported_extensions": SUPPORTED_EXTENSIONS
-                }
-                db.save_database()
-                st.success("База очищена!")
-                st.session_state.has_unsaved_changes = False
-                st.rerun()
-    
-    with col_admin2:
-        # Блок импорта/экспорта
-        st.markdown("### 📤 ИМПОРТ/ЭКСПОРТ")
+        st.markdown("---")
+        st.header("📊 СТАТИСТИКА")
         
-        # Импорт
-        uploaded_file = st.file_uploader(
-            "Выберите файл базы (JSON):",
-            type=['json'],
-            key="import_uploader"
-        )
+        # Основная статистика
+        st.metric("Всего разделов", db.metadata.get("total_sections", 0))
+        st.metric("Всего документов", db.metadata.get("total_documents", 0))
         
-        if uploaded_file is not None:
-            try:
-                import_data = json.load(uploaded_file)
-                if st.button("📥 Импортировать данные", type="primary"):
-                    if 'sections' in import_data and 'metadata' in import_data:
-                        db.sections = import_data['sections']
-                        db.metadata = import_data['metadata']
-                        db.save_database()
-                        st.success("База успешно импортирована!")
-                        add_notification(f"База импортирована из {uploaded_file.name}", "success")
-                        st.session_state.has_unsaved_changes = False
-                        st.rerun()
-                    else:
-                        st.error("Неверный формат файла базы")
-            except Exception as e:
-                st.error(f"Ошибка при чтении файла: {e}")
+        # Подсчет выбранных
+        selected_count = len(selection.selected_ids)
+        st.metric("Выбрано разделов", selected_count)
         
-        # Экспорт
-        if st.button("📤 Экспортировать базу", type="secondary", use_container_width=True):
-            export_data = {
-                "sections": db.sections,
-                "metadata": db.metadata
-            }
-            
-            export_json = json.dumps(export_data, ensure_ascii=False, indent=2)
-            
-            st.download_button(
-                label="⬇️ Скачать базу (JSON)",
-                data=export_json,
-                file_name=f"database_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
-                mime="application/json",
-                use_container_width=True
-            )
-    
-    # Управление шаблонами
-    st.markdown("---")
-    st.markdown("### 🎯 УПРАВЛЕНИЕ ШАБЛОНАМИ")
-    
-    col_template1, col_template2 = st.columns(2)
-    
-    with col_template1:
-        # Просмотр и редактирование шаблонов
-        st.markdown("##### 📝 РЕДАКТИРОВАТЬ ШАБЛОНЫ")
+        # Информация о выбранном шаблоне
+        current_template = template_manager.get_template_by_id(st.session_state.selected_template)
+        if current_template:
+            st.markdown("---")
+            st.header("🎯 ШАБЛОН")
+            st.markdown(f"**{current_template.get('name', 'Неизвестно')}**")
+            st.caption(current_template.get('description', ''))
         
-        templates = template_manager.get_templates_list()
+        if db.metadata.get("last_updated"):
+            st.caption(f"Обновлено: {db.metadata['last_updated'][:10]}")
         
-        for template in templates:
-            with st.expander(f"✏️ {template.get('name', 'Без названия')}", expanded=False):
-                new_name = st.text_input("Название:", 
-                                       value=template.get('name', ''),
-                                       key=f"name_{template['id']}")
-                
-                new_description = st.text_area("Описание:",
-                                             value=template.get('description', ''),
-                                             key=f"desc_{template['id']}")
-                
-                new_prompt = st.text_area("Текст шаблона:",
-                                        value=template.get('prompt', ''),
-                                        height=200,
-                                        key=f"prompt_{template['id']}")
-                
-                if st.button("💾 Сохранить изменения", key=f"save_{template['id']}"):
-                    # Обновляем шаблон
-                    template['name'] = new_name
-                    template['description'] = new_description
-                    template['prompt'] = new_prompt
-                    
-                    # Сохраняем изменения
-                    template_manager.update_templates(template_manager.templates)
-                    st.success(f"Шаблон '{new_name}' обновлен!")
-                    add_notification(f"Шаблон '{new_name}' обновлен", "success")
-                    st.rerun()
-    
-    with col_template2:
-        # Создание нового шаблона
-        st.markdown("##### ➕ СОЗДАТЬ НОВЫЙ ШАБЛОН")
+        if db.watcher:
+            watcher_status = "👁 Наблюдение за папками"
+            if db.watcher.last_check:
+                watcher_status += f": проверено в {db.watcher.last_check:%H:%M:%S}"
+            if db.watcher.last_update:
+                watcher_status += f", база обновлена в {db.watcher.last_update:%H:%M:%S}"
+            st.caption(watcher_status)
+            if db.watcher.last_error:
+                st.caption(f"⚠ {db.watcher.last_error}")
         
-        with st.form("new_template_form"):
-            new_template_name = st.text_input("Название нового шаблона:", 
-                                            placeholder="Например: Технический анализ")
-            
-            new_template_desc = st.text_area("Описание шаблона:",
-                                           placeholder="Краткое описание цели шаблона")
-            
-            new_template_prompt = st.text_area("Текст шаблона:",
-                                             placeholder="Введите текст промта для ИИ...",
-                                             height=250)
-            
-            submit_btn = st.form_submit_button("➕ Создать шаблон", type="primary")
+        st.markdown("---")
+        st.header("⚡ БЫСТРЫЕ ДЕЙСТВИЯ")
         
-        # Обработка формы вынесена ВНЕ формы
-        if submit_btn:
-            if new_template_name and new_template_prompt:
-                # Создаем новый шаблон
-                new_template = {
-                    "id": f"template_{uuid.uuid4().hex[:8]}",
-                    "name": new_template_name,
-                    "description": new_template_desc,
-                    "prompt": new_template_prompt
-                }
-                
-                # Добавляем в список шаблонов
-                templates = template_manager.get_templates_list()
-                templates.append(new_template)
-                
-                # Обновляем шаблоны
-                template_manager.templates["templates"] = templates
-                template_manager.update_templates(template_manager.templates)
+        # Кнопка сохранения если есть изменения
+        if st.session_state.has_unsaved_changes:
+            if st.button("💾 Сохранить выбор", type="primary", use_container_width=True):
+                selection.save()
+                st.success("Сохранено!")
+                st.session_state.has_unsaved_changes = False
+                st.rerun()
+        
+        # Кнопка создания промта
+        if selected_count > 0:
+            if st.button("🤖 Создать файлы сессии", type="secondary", use_container_width=True):
+                # Устанавливаем флаг, чтобы показать кнопки скачивания
+                selected_sections = selection.get_selected_sections()
+                with st.spinner("Создаю файлы..."):
+                    output_dir = Path(CONFIG.get("expert_sessions_path", "./expert_sessions"))
+                    output_dir.mkdir(exist_ok=True, parents=True)
+                    session_dir = ExpertFileGenerator.create_prompt_file(
+                        selected_sections, 
+                        output_dir,
+                        template_manager,
+                        st.session_state.selected_template,
+                        db.duplicate_index.duplicate_of,
+                        content_loader=db.with_content
+                    )
+                    if session_dir:
+                        st.session_state.session_dir = session_dir
+                        st.session_state.files_created = True
+                        st.success("Файлы созданы!")
+                        add_notification("Файлы сессии созданы", "success")
+                        st.rerun()
+        else:
+            st.caption("Выберите разделы для создания файлов")
+        
+        st.markdown("---")
+        st.header("🔔 УВЕДОМЛЕНИЯ")
+        
+        if 'notifications' in st.session_state and st.session_state.notifications:
+            for notification in reversed(st.session_state.notifications[-3:]):
+                icon = {
+                    "info": "ℹ️",
+                    "success": "✅",
+                    "warning": "⚠️",
+                    "error": "❌"
+                }.get(notification["type"], "ℹ️")
                 
-                st.success(f"Шаблон '{new_template_name}' создан!")
-                add_notification(f"Создан новый шаблон: {new_template_name}", "success")
+                st.caption(f"{icon} {notification['time']}: {notification['message']}")
+            
+            if st.button("Очистить уведомления", use_container_width=True):
+                st.session_state.notifications = []
                 st.rerun()
-            else:
-                st.error("Заполните название и текст шаблона")
-    
-    # Перезагрузка шаблонов - ВНЕ формы, отдельный блок
-    st.markdown("---")
-    st.markdown("### 🔄 ПЕРЕЗАГРУЗКА ШАБЛОНОВ")
-    
-    if st.button("🔄 Перезагрузить шаблоны из файла", type="secondary", use_container_width=True):
-        template_manager.reload_templates()
-        st.success("Шаблоны перезагружены из файла!")
-        add_notification("Шаблоны перезагружены из файла", "success")
-        st.rerun()
+        else:
+            st.caption("Нет уведомлений")
 
-# ==============================================
-# САЙДБАР
-# ==============================================
 
-with st.sidebar:
-    st.header("📊 СТАТИСТИКА")
-    
-    # Основная статистика
-    st.metric("Всего разделов", db.metadata.get("total_sections", 0))
-    st.metric("Всего документов", db.metadata.get("total_documents", 0))
-    
-    # Подсчет выбранных
-    selected_count = sum(1 for section in db.sections if section.get("selected", False))
-    st.metric("Выбрано разделов", selected_count)
-    
-    # Информация о выбранном шаблоне
-    current_template = template_manager.get_template_by_id(st.session_state.selected_template)
-    if current_template:
-        st.markdown("---")
-        st.header("🎯 ШАБЛОН")
-        st.markdown(f"**{current_template.get('name', 'Неизвестно')}**")
-        st.caption(current_template.get('description', ''))
-    
-    if db.metadata.get("last_updated"):
-        st.caption(f"Обновлено: {db.metadata['last_updated'][:10]}")
-    
-    st.markdown("---")
-    st.header("⚡ БЫСТРЫЕ ДЕЙСТВИЯ")
-    
-    # Кнопка сохранения если есть изменения
-    if st.session_state.has_unsaved_changes:
-        if st.button("💾 Сохранить выбор", type="primary", use_container_width=True):
-            db.save_database()
-            st.success("Сохранено!")
-            st.session_state.has_unsaved_changes = False
-            st.rerun()
-    
-    # Кнопка создания промта
-    if selected_count > 0:
-        if st.button("🤖 Создать файлы сессии", type="secondary", use_container_width=True):
-            # Устанавливаем флаг, чтобы показать кнопки скачивания
-            selected_sections = db.get_selected_sections()
-            with st.spinner("Создаю файлы..."):
-                output_dir = Path(CONFIG.get("expert_sessions_path", "./expert_sessions"))
-                output_dir.mkdir(exist_ok=True, parents=True)
-                session_dir = ExpertFileGenerator.create_prompt_file(
-                    selected_sections, 
-                    output_dir,
-                    template_manager,
-                    st.session_state.selected_template
-                )
-                if session_dir:
-                    st.session_state.session_dir = session_dir
-                    st.session_state.files_created = True
-                    st.success("Файлы созданы!")
-                    add_notification("Файлы сессии созданы", "success")
-                    st.rerun()
-    else:
-        st.caption("Выберите разделы для создания файлов")
-    
-    st.markdown("---")
-    st.header("🔔 УВЕДОМЛЕНИЯ")
-    
-    if 'notifications' in st.session_state and st.session_state.notifications:
-        for notification in reversed(st.session_state.notifications[-3:]):
-            icon = {
-                "info": "ℹ️",
-                "success": "✅",
-                "warning": "⚠️",
-                "error": "❌"
-            }.get(notification["type"], "ℹ️")
-            
-            st.caption(f"{icon} {notification['time']}: {notification['message']}")
-        
-        if st.button("Очистить уведомления", use_container_width=True):
-            st.session_state.notifications = []
-            st.rerun()
-    else:
-        st.caption("Нет уведомлений")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Замер скорости разбиения документов на разделы (МБ/с) на папках из config.json.
+
+    python benchmark_split.py                   # текущие разделители
+    python benchmark_split.py --baseline REV    # сравнение с app.py из коммита git REV
+
+Разделителям подается текст после нормализации, как при сканировании базы
+(каждой версии - после ее собственной нормализации). При сравнении дополнительно
+проверяется, что разделы совпадают. В версиях до появления DocumentProcessor
+разбиение берется из методов SimpleSectionDatabase.
+"""
+
+import os
+import re
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import importlib.util
+from pathlib import Path
+
+APP_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(APP_DIR))
+
+import app
+
+
+class LegacyProcessor:
+    """
+    Разбиение версии app.py без DocumentProcessor: нормализация и разделители
+    были методами SimpleSectionDatabase (_clean_special_characters, _split_*)
+    """
+
+    def __init__(self, module):
+        # База не загружается: методам разбиения нужен только сам объект
+        self.database = module.SimpleSectionDatabase.__new__(module.SimpleSectionDatabase)
+        self.cleaner = self
+
+    def normalize(self, text: str) -> str:
+        return self.database._clean_special_characters(text)
+
+    def _split_document_by_type(self, content: str, file_path: Path, folder_type: str, doc_title: str) -> list:
+        return self.database._split_document_by_type(content, file_path, folder_type, doc_title)
+
+
+def load_baseline(revision: str, work_dir: Path):
+    """Загружает обработчик документов app.py из указанного коммита"""
+    top_level = subprocess.run(
+        ["git", "rev-parse", "--show-toplevel"], cwd=APP_DIR,
+        capture_output=True, text=True, check=True
+    ).stdout.strip()
+    relative_path = (APP_DIR / "app.py").relative_to(Path(top_level).resolve()).as_posix()
+    source = subprocess.run(
+        ["git", "show", f"{revision}:{relative_path}"], cwd=APP_DIR,
+        capture_output=True, text=True, encoding='utf-8', check=True
+    ).stdout
+
+    # В старых версиях интерфейс строился прямо при импорте модуля:
+    # берется только код до первой команды Streamlit верхнего уровня
+    interface_start = re.search(r'^st\.', source, re.MULTILINE)
+    if interface_start:
+        source = source[:interface_start.start()]
+
+    baseline_path = work_dir / "app_baseline.py"
+    baseline_path.write_text(source, encoding='utf-8')
+    shutil.copy(APP_DIR / "config.json", work_dir / "config.json")
+
+    # Папки, которые модуль создает при импорте, появляются во временной папке
+    spec = importlib.util.spec_from_file_location("app_baseline", baseline_path)
+    module = importlib.util.module_from_spec(spec)
+    current_dir = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        spec.loader.exec_module(module)
+    finally:
+        os.chdir(current_dir)
+
+    if hasattr(module, "DocumentProcessor"):
+        return module.DocumentProcessor()
+    if hasattr(module.SimpleSectionDatabase, "_split_document_by_type"):
+        return LegacyProcessor(module)
+    raise SystemExit(f"❌ В коммите {revision} не найдено разбиение документов")
+
+
+def load_corpus() -> dict:
+    """Прочитанные тексты документов по типам папок"""
+    reader = app.FileFormatReader()
+    corpus = {}
+    for folder_name, folder_path in app.CONFIG["folders"].items():
+        if not folder_path or not Path(folder_path).exists():
+            continue
+        files = sorted(f for ext in app.SUPPORTED_EXTENSIONS for f in Path(folder_path).rglob(f"*{ext}"))
+        documents = []
+        for file_path in files:
+            content = reader.read_file(file_path)
+            if content:
+                documents.append((file_path, content))
+        corpus[folder_name] = documents
+    return corpus
+
+
+def normalize(processor, documents: list) -> list:
+    """Тексты после нормализации обработчика (как перед разбиением при сканировании)"""
+    return [(file_path, processor.cleaner.normalize(content)) for file_path, content in documents]
+
+
+def measure(processor, folder_name: str, documents: list, repeats: int) -> tuple:
+    """Лучшее время разбиения всех документов папки и полученные разделы"""
+    best = float("inf")
+    sections = None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        sections = [
+            processor._split_document_by_type(text, file_path, folder_name, file_path.stem)
+            for file_path, text in documents
+        ]
+        best = min(best, time.perf_counter() - started)
+    return best, sections
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Скорость разбиения документов на разделы")
+    parser.add_argument("--baseline", help="коммит git, с версией app.py которого сравнить")
+    parser.add_argument("--repeats", type=int, default=5, help="число повторов (берется лучшее время)")
+    args = parser.parse_args()
+
+    corpus = load_corpus()
+    current = app.DocumentProcessor()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        baseline = load_baseline(args.baseline, Path(work_dir)) if args.baseline else None
+
+        print(f"\n📊 Разбиение (режим normative: {app.CONFIG.get('normative_split_mode', 'chapter')})")
+        header = f"{'папка':<14}{'МБ':>8}{'МБ/с':>10}"
+        if baseline:
+            header += f"{'МБ/с было':>12}{'ускорение':>11}  разделы"
+        print(header)
+
+        for folder_name, raw_documents in corpus.items():
+            documents = normalize(current, raw_documents)
+            megabytes = sum(len(text.encode('utf-8')) for _, text in documents) / 1e6
+            seconds, sections = measure(current, folder_name, documents, args.repeats)
+            row = f"{folder_name:<14}{megabytes:>8.2f}{megabytes / max(seconds, 1e-9):>10.1f}"
+            if baseline:
+                old_seconds, old_sections = measure(baseline, folder_name, normalize(baseline, raw_documents),
+                                                    args.repeats)
+                row += (f"{megabytes / max(old_seconds, 1e-9):>12.1f}"
+                        f"{old_seconds / max(seconds, 1e-9):>10.1f}x  "
+                        f"{'совпадают' if sections == old_sections else 'РАЗЛИЧАЮТСЯ'}")
+            print(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""
+Работа с базой разделов без браузера: сканирование папок, перестройка индексов,
+поиск и пакетное создание файлов сессий по списку вопросов.
+
+    python cli.py scan [--full]                 # обновить базу (--full - обработать все файлы)
+    python cli.py reindex                       # построить индексы заново
+    python cli.py search "запрос" [--question]  # поиск BM25 или подбор по вопросу
+    python cli.py batch вопросы.json [--workers N] [--output папка]
+
+Файл пакета - JSON список заданий или объект {"defaults": {...}, "items": [...]},
+где defaults дополняют каждое задание. Поля задания (все необязательные):
+name (имя папки сессии), question (вопрос: дописывается в промт и подбирает
+top_k разделов, по умолчанию recommend_top_k), template (ID шаблона), ids (ID
+разделов), user (сохраненный выбор пользователя), search и search_limit (разделы
+по поисковому запросу), folders (только разделы этих папок), citation_depth
+(добавить статьи по ссылкам). Для каждого задания создается папка сессии с теми же
+файлами, что и в интерфейсе; задания обрабатываются в пуле процессов. Совпадающие
+имена заданий получают суффикс: gpzu, gpzu_2, gpzu_3...
+"""
+
+import os
+import re
+import sys
+import json
+import argparse
+from datetime import datetime
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+APP_DIR = Path(__file__).resolve().parent
+START_DIR = Path.cwd()
+sys.path.insert(0, str(APP_DIR))
+
+# Модуль приложения: импортируется в load_app(), а не при импорте cli
+app = None
+
+
+def load_app():
+    """Переходит в папку приложения и импортирует app.
+
+    Пути в config.json задаются относительно папки приложения (как при streamlit run app.py),
+    а app при импорте создает папки по этим путям, поэтому рабочая папка меняется до импорта.
+    """
+    global app
+    if app is None:
+        os.chdir(APP_DIR)
+        import app
+    return app
+
+
+def resolve_selection(db: "app.SimpleSectionDatabase", item: dict) -> list:
+    """ID разделов задания пакета в порядке базы"""
+    folders = set(item.get("folders") or [])
+
+    def allowed(section_id: str) -> bool:
+        section = db.get_section(section_id)
+        return section is not None and (not folders or section.get("folder") in folders)
+
+    selected = set(db.resolve_section_ids(item.get("ids") or []))
+    if item.get("user"):
+        selected |= app.SelectionSet(db, item["user"]).selected_ids
+
+    if item.get("search"):
+        found = [i for i in db.search_sections(item["search"], limit=len(db.sections)) if allowed(i)]
+        selected.update(found[:int(item.get("search_limit", 20))])
+
+    question = item.get("question", "")
+    top_k = int(item.get("top_k", app.CONFIG.get("recommend_top_k", 10)))
+    if question and top_k > 0:
+        ranked = [i for i, _ in db.recommend_sections(question, limit=len(db.sections)) if allowed(i)]
+        selected.update(ranked[:top_k])
+
+    depth = int(item.get("citation_depth", 0))
+    if depth > 0 and selected:
+        selected |= db.citation_index.expand(selected, depth)
+
+    return [s.get("id") for s in db.sections if s.get("id") in selected and allowed(s.get("id"))]
+
+
+def create_session(db: "app.SimpleSectionDatabase", template_manager: "app.TemplateManager", task: tuple) -> str:
+    """Создает файлы одной сессии пакета и возвращает путь к ее папке"""
+    session_id, section_ids, template_id, question, output_dir = task
+    sections = db.get_selected_sections(set(section_ids))
+    session_dir = app.ExpertFileGenerator.create_prompt_file(
+        sections, Path(output_dir), template_manager, template_id,
+        db.duplicate_index.duplicate_of, question, session_id, db.with_content
+    )
+    if not session_dir:
+        raise RuntimeError("файлы сессии не созданы")
+    return str(session_dir)
+
+
+# База и шаблоны дочернего процесса (загружаются один раз на процесс)
+_worker_db = None
+_worker_templates = None
+
+
+def _init_worker():
+    global _worker_db, _worker_templates
+    # При запуске процессов через spawn cli импортируется заново, без main()
+    load_app()
+    _worker_db = app.SimpleSectionDatabase()
+    _worker_templates = app.TemplateManager()
+
+
+def _create_session_task(task: tuple) -> str:
+    return create_session(_worker_db, _worker_templates, task)
+
+
+def load_batch(path: Path) -> list:
+    """Задания пакета с примененными defaults"""
+    data = json.loads(path.read_text(encoding='utf-8'))
+    defaults = {}
+    if isinstance(data, dict):
+        defaults = data.get("defaults", {})
+        data = data.get("items", [])
+    if not isinstance(data, list):
+        raise SystemExit(f"❌ В {path} нет списка заданий")
+    return [{**defaults, **item} for item in data]
+
+
+def run_batch(args):
+    batch_path = START_DIR / args.file
+    items = load_batch(batch_path)
+    output_dir = (START_DIR / args.output) if args.output else Path(app.CONFIG.get("expert_sessions_path", "./expert_sessions"))
+    output_dir.mkdir(exist_ok=True, parents=True)
+
+    # База загружается до запуска пула: дочерние процессы застают индексы актуальными
+    db = app.SimpleSectionDatabase()
+    template_manager = app.TemplateManager()
+    batch_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+
+    results = []
+    tasks = []
+    used_names = set()
+    for number, item in enumerate(items, 1):
+        base_name = re.sub(r'[^\w.-]+', '_', str(item.get("name") or f"{number:03d}")).strip('_') or f"{number:03d}"
+        # Папки сессий не должны совпадать (в том числе без учета регистра, как в Windows)
+        name, suffix = base_name, 1
+        while name.lower() in used_names:
+            suffix += 1
+            name = f"{base_name}_{suffix}"
+        used_names.add(name.lower())
+        result = {"name": name, "question": item.get("question", ""), "sections": 0}
+        results.append(result)
+        section_ids = resolve_selection(db, item)
+        if not section_ids:
+            result["error"] = "не выбрано ни одного раздела"
+            continue
+        result["sections"] = len(section_ids)
+        tasks.append((len(results) - 1, (f"{batch_id}_{name}", section_ids, item.get("template", ""),
+                                        item.get("question", ""), str(output_dir))))
+
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+    workers = max(1, min(workers, len(tasks)))
+    pending = list(tasks)
+    if workers > 1:
+        print(f"⚙️ Создание {len(tasks)} сессий, процессов: {workers}")
+        try:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+                futures = {executor.submit(_create_session_task, task): i for i, task in pending}
+                for future in as_completed(futures):
+                    i = futures[future]
+                    try:
+                        results[i]["session_dir"] = future.result()
+                    except BrokenProcessPool:
+                        raise
+                    except Exception as e:
+                        results[i]["error"] = str(e)
+            pending = []
+        except (BrokenProcessPool, OSError) as e:
+            print(f"⚠ Пул процессов недоступен ({e}), сессии создаются последовательно")
+            pending = [(i, task) for i, task in pending if "session_dir" not in results[i]]
+
+    for i, task in pending:
+        try:
+            results[i]["session_dir"] = create_session(db, template_manager, task)
+        except Exception as e:
+            results[i]["error"] = str(e)
+
+    summary_path = output_dir / f"batch_{batch_id}.json"
+    app.write_json_atomic(summary_path, results, indent=2)
+
+    failed = [result for result in results if "error" in result]
+    print(f"\n📦 Пакет {batch_path.name}: создано сессий {len(results) - len(failed)} из {len(results)}")
+    for result in failed:
+        print(f"❌ {result['name']}: {result['error']}")
+    print(f"📄 Итоги пакета: {summary_path}")
+    return 1 if failed else 0
+
+
+def run_scan(args):
+    db = app.SimpleSectionDatabase()
+    db.scan_and_build_database(incremental=not args.full)
+    return 0
+
+
+def run_reindex(args):
+    db = app.SimpleSectionDatabase()
+    db.rebuild_indexes()
+    print(f"✅ Индексы перестроены: {len(db.sections)} разделов")
+    return 0
+
+
+def run_search(args):
+    db = app.SimpleSectionDatabase()
+    if args.question:
+        found = db.recommend_sections(args.query, args.limit)
+    else:
+        found = [(section_id, None) for section_id in db.search_sections(args.query, args.limit)]
+
+    for number, (section_id, score) in enumerate(found, 1):
+        section = db.get_section(section_id)
+        relevance = f"{score:.3f}  " if score is not None else ""
+        print(f"{number:>3}. {relevance}{section_id}  [{section.get('folder')}] "
+              f"{section.get('document_title', '')} / {section.get('title', '')}")
+    if not found:
+        print("Ничего не найдено")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="База разделов и сессии эксперта без браузера")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    scan = commands.add_parser("scan", help="сканировать папки и обновить базу")
+    scan.add_argument("--full", action="store_true", help="обработать все файлы, а не только измененные")
+    scan.set_defaults(handler=run_scan)
+
+    reindex = commands.add_parser("reindex", help="построить индексы базы заново")
+    reindex.set_defaults(handler=run_reindex)
+
+    search = commands.add_parser("search", help="найти разделы")
+    search.add_argument("query", help="поисковый запрос или текст вопроса")
+    search.add_argument("--question", action="store_true", help="подбор по близости к вопросу вместо поиска")
+    search.add_argument("--limit", type=int, default=20, help="число результатов")
+    search.set_defaults(handler=run_search)
+
+    batch = commands.add_parser("batch", help="создать сессии по файлу заданий")
+    batch.add_argument("file", help="JSON файл заданий")
+    batch.add_argument("--workers", type=int, default=0, help="число процессов (0 - по числу ядер, 1 - без пула)")
+    batch.add_argument("--output", help="папка сессий (по умолчанию expert_sessions_path)")
+    batch.set_defaults(handler=run_batch)
+
+    args = parser.parse_args()
+    load_app()
+    sys.exit(args.handler(args))
+
+
+if __name__ == "__main__":
+    main()